@@ -1,4 +1,6 @@
 import json
+import os
+import pickle
 
 '''
 Eli Miller
@@ -6,15 +8,54 @@ Eli Miller
 Contains functions for getting and parsing the data annotations out
 of JSON files. Can search through an annotation for a certain term
 and can get all the annotations for any given record.
+
+Each annotations file is parsed at most once per process. The parsed
+record id -> annotation index is kept in memory and shared by every
+lookup into that file. If a binary sidecar (see build_sidecar) exists
+and is newer than the JSON file, it is loaded instead of the JSON.
 '''
 
+_indexes = {} # maps absolute annotations file path -> parsed index
+
 def parse_json(file):
 	rids = {} # maps record id -> their annotations
-	annots = json.load(open(file))
+	with open(file) as f:
+		annots = json.load(f)
 	for record in annots:
 		rids[record] = annots[record]["Annotations"]
 	return rids
 
+def sidecar_path(file):
+	''' Returns the path of the binary sidecar for an annotations file. '''
+	return file + ".idx"
+
+def build_sidecar(file):
+	''' Parses an annotations file and writes its index to a binary sidecar
+	next to it, so later runs can skip decoding the JSON.
+	Returns the path of the sidecar.
+	'''
+	rids = parse_json(file)
+	path = sidecar_path(file)
+	with open(path, "wb") as out:
+		pickle.dump(rids, out, pickle.HIGHEST_PROTOCOL)
+	_indexes[os.path.abspath(file)] = rids
+	return path
+
+def load_index(file):
+	''' Returns the record id -> annotation index for an annotations file.
+	The file is only read the first time it is asked for; later calls get the
+	same in-memory index. Uses the sidecar if it is up to date.
+	'''
+	key = os.path.abspath(file)
+	if key not in _indexes:
+		sidecar = sidecar_path(file)
+		if os.path.exists(sidecar) and os.path.getmtime(sidecar) >= os.path.getmtime(file):
+			with open(sidecar, "rb") as f:
+				_indexes[key] = pickle.load(f)
+		else:
+			_indexes[key] = parse_json(file)
+	return _indexes[key]
+
 def get_annotation(rid, file):
 	''' Returns the full annotations section for a record.
 	Takes a record id and the file where the record is located.
@@ -22,8 +63,7 @@ def get_annotation(rid, file):
 	Returns the annotations section of the json object, as a group of nested dictionaries.
 	Returns None if there is no annotation with the given record id.
 	'''
-	rids = parse_json(file)
-	return rids[rid] if rid in rids else None
+	return load_index(file).get(rid)
 
 def search_annotation(annot, search):
 	''' Returns the entry for one category in a record's annotation.
@@ -41,7 +81,12 @@ def search_annotation(annot, search):
 
 if __name__ == "__main__":
 	# to test: python annotation_matcher.py record_id filename
+	# to build sidecars: python annotation_matcher.py build-sidecar filename...
 	import sys
 	from pprint import pprint
-	a = get_annotation(sys.argv[1], sys.argv[2])
-	pprint(a)
+	if sys.argv[1] == "build-sidecar":
+		for f in sys.argv[2:]:
+			print(build_sidecar(f))
+	else:
+		a = get_annotation(sys.argv[1], sys.argv[2])
+		pprint(a)
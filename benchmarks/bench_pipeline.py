@@ -0,0 +1,134 @@
+import os
+import sys
+import json
+import time
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import annotation_matcher
+import classification
+import feature_store
+import ml_classifier
+import patient_splitter
+import rule_based_classifier
+import synthetic_corpus
+from pipeline import build_training_lines
+from record import Record
+
+'''
+Times each stage of the pipeline end to end on synthetic corpora (see
+synthetic_corpus.py) of several sizes, without MetaMap Lite:
+
+    load         reading and splitting the data files, with annotations
+    annotations  looking up every record's annotations and gold grades,
+                 starting from unparsed annotation files
+    train        building the training lines and training the ML classifier
+    rule         the rule-based classifier over every test record
+    ml           the ML classifier over every line of every test record
+    ml_prefilter the same, over only the lines the prefilter keeps
+    ml_features  the same as ml, with the features loaded from a feature store
+                 filled by an earlier pass
+
+USAGE: python(3) benchmarks/bench_pipeline.py sizes save-baseline
+
+sizes are optional numbers of records in each of the training and test sets
+    (default 100 400 1600).
+save-baseline is an optional string. If it is present, the timings are saved
+    to BASELINE_FILE. Otherwise, if BASELINE_FILE exists, each timing is
+    compared with it and the exit status is 1 if any stage is more than
+    REGRESSION_RATIO times slower than its baseline. Stages whose baseline is
+    under MIN_SECONDS are printed but not compared; timer and scheduling noise
+    swamps differences that small.
+Each time is the fastest of REPEATS runs. Baselines are only comparable on
+the same machine.
+'''
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pipeline_baseline.json")
+REGRESSION_RATIO = 1.25
+# Each size is run this many times and the fastest time for each stage is kept
+REPEATS = 5
+# Baseline times below this many seconds are too short to compare
+MIN_SECONDS = 0.1
+DEFAULT_SIZES = [100, 400, 1600]
+STAGES = ["load", "annotations", "train", "rule", "ml", "ml_prefilter", "ml_features"]
+
+def timed(function, *args):
+    ''' Returns (seconds function took, what it returned). '''
+    start = time.perf_counter()
+    value = function(*args)
+    return time.perf_counter() - start, value
+
+def lookup_annotations(records, test):
+    for record in records:
+        annotation = annotation_matcher.get_annotation(record.rid, patient_splitter.annotation_file_name(record.file, test))
+        annotation_matcher.search_annotation(annotation, "Grade Category")
+        # a new Record, so its gold grades are parsed from the annotation again
+        Record(record.rid, record.text, record.file, annotation).gold
+
+def rule_classify(records):
+    for record in records:
+        rule_based_classifier.classify_record(record.text, 2)
+
+def ml_classify(trained_objects, records, prefilter=False):
+    ml_classifier.test_batch(trained_objects, classification.lines_for_ml([record.text for record in records], prefilter))
+
+def run(size):
+    ''' Times every stage on a new corpus of size training and size test records. Returns {stage: seconds}. '''
+    times = {}
+    with tempfile.TemporaryDirectory() as out_dir:
+        data_dir = synthetic_corpus.generate(out_dir, size)
+        annotation_matcher._indexes.clear()
+        times["load"], (train_records, test_records) = timed(
+            lambda: (patient_splitter.load_records(data_dir), patient_splitter.load_records(data_dir, test=True)))
+        annotation_matcher._indexes.clear()
+        times["annotations"], _ = timed(lambda: (lookup_annotations(train_records, False), lookup_annotations(test_records, True)))
+        times["train"], trained_objects = timed(lambda: ml_classifier.train(build_training_lines(train_records, False)))
+        times["rule"], _ = timed(rule_classify, test_records)
+        times["ml"], _ = timed(ml_classify, trained_objects, test_records)
+        times["ml_prefilter"], _ = timed(ml_classify, trained_objects, test_records, True)
+        feature_store.enable(os.path.join(out_dir, "features"))
+        try:
+            ml_classify(trained_objects, test_records)
+            times["ml_features"], _ = timed(ml_classify, trained_objects, test_records)
+        finally:
+            feature_store.disable()
+    return times
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:] if arg.isdigit()] or DEFAULT_SIZES
+    save_baseline = "save-baseline" in sys.argv
+    baseline = None
+    if not save_baseline:
+        if os.path.exists(BASELINE_FILE):
+            with open(BASELINE_FILE) as f:
+                baseline = json.load(f)
+        else:
+            print("No baseline in %s; run with save-baseline to make one" % BASELINE_FILE, file=sys.stderr)
+
+    results = {}
+    regressions = 0
+    print("records\tstage\tseconds\trecords/sec" + ("\tbaseline\tratio" if baseline is not None else ""))
+    for size in sizes:
+        runs = [run(size) for _ in range(REPEATS)]
+        results[str(size)] = {stage: min(times[stage] for times in runs) for stage in STAGES}
+        for stage in STAGES:
+            seconds = results[str(size)][stage]
+            line = "%d\t%s\t%.3f\t%.0f" % (size, stage, seconds, size / seconds if seconds > 0 else float("inf"))
+            if baseline is not None and stage in baseline.get(str(size), {}):
+                ratio = seconds / baseline[str(size)][stage] if baseline[str(size)][stage] > 0 else 1.0
+                line += "\t%.3f\t%.2f" % (baseline[str(size)][stage], ratio)
+                if ratio > REGRESSION_RATIO and baseline[str(size)][stage] >= MIN_SECONDS:
+                    line += "\tREGRESSION"
+                    regressions += 1
+            print(line)
+
+    if save_baseline:
+        with open(BASELINE_FILE, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print("Baseline saved to " + BASELINE_FILE)
+    elif regressions > 0:
+        print("%d stage(s) more than %.2f times slower than the baseline" % (regressions, REGRESSION_RATIO))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
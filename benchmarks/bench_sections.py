@@ -0,0 +1,67 @@
+import os
+import re
+import sys
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from record import Record
+
+'''
+Times Record.close_tags against the line-by-line version it replaced, which
+ran two regex searches on every line and rebuilt each section by string
+concatenation, on records of increasing length.
+
+USAGE: python(3) benchmarks/bench_sections.py sections lines_per_section
+
+sections and lines_per_section are optional numbers (defaults 50 and 200)
+giving the size of the largest record timed.
+'''
+
+def old_close_tags(text):
+    stack = []
+    cleaned = defaultdict(str)
+    curr_tag = None
+    for line in text.split("\n"):
+        open_tag = re.search(r"<(\w+)>", line)
+        closed_tag = re.search(r"</(\w+]?)>", line)
+        if open_tag is not None:
+            curr_tag = open_tag.expand(r"\1")
+            stack.append(open_tag.expand(r"\1"))
+        elif closed_tag is not None:
+            stack.pop()
+        elif curr_tag:
+            cleaned[curr_tag] += line + " "
+    return cleaned
+
+def make_record(sections, lines_per_section):
+    lines = []
+    for i in range(sections):
+        lines.append("<SECTION_%d>" % (i % 10))
+        for j in range(lines_per_section):
+            lines.append("Line %d of section %d: invasive ductal carcinoma, see comment." % (j, i))
+        lines.append("</SECTION_%d>" % (i % 10))
+    return "\n".join(lines)
+
+def best_time(function, text, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(text)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    sections = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    lines_per_section = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    print("lines\told (ms)\tspans (ms)\tspans+join (ms)")
+    for scale in (1, 4, 16):
+        text = make_record(max(1, sections * scale // 16), lines_per_section)
+        old = best_time(old_close_tags, text)
+        spans = best_time(Record.close_tags, text)
+        joined = best_time(lambda t: [s for s in Record.close_tags(t).values()], text)
+        print("%d\t%.2f\t%.2f\t%.2f" % (text.count("\n") + 1, old * 1000, spans * 1000, joined * 1000))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,330 @@
+import os
+from functools import lru_cache
+from multiprocessing import Pool
+import rule_based_classifier
+import ml_classifier
+import prediction_cache
+import feature_store
+from metrics import ConfusionMatrix
+from config import LINE_GRADE_MEMO_SIZE
+
+'''
+Classifies records with the rule-based and machine learning classifiers and
+tallies the grades they give against the gold grades.
+
+Everything a classification pass produces is kept in a ClassificationResult.
+Results for different chunks of records can be merged. classify_parallel
+grades chunks of records on worker processes and tallies them in order, so it
+gives exactly what a serial pass would produce.
+
+Given the artifact id of the model, each record's rule-based grades and the
+lines the ML classifier finds a grade in are kept in the prediction cache
+(see prediction_cache.py), so after a rule change only the rules are rerun,
+and after a model change only the ML classifier. The cache is skipped while
+rules are being profiled, so the profile covers every record.
+
+With prefilter set, only the lines rule_based_classifier.is_candidate_line
+accepts are sent to the ML classifier; the rest are taken to have no grade.
+prefilter_recall measures what that misses.
+
+Records repeat a lot of template text, so the lines of a pass are interned
+(see LineTable) and the ML classifier sees each distinct line once, and the
+grade classify_string gives a line is memoized. line_stats reports how much
+that saved.
+'''
+
+class ClassificationResult:
+    '''
+    Confusion matrices, counts and error lists for a group of records.
+    Matrices are metrics.ConfusionMatrix objects over grades 0-4, indexed [assigned grade][gold grade].
+    rb_* track results of the rule-based classifier only, ml_* track results
+    of the machine learning classifier only, and combo_* track results of
+    the system as a whole.
+    '''
+    def __init__(self):
+        self.seen = 0 # records processed
+        self.should_have_class = 0 # records that should have nonzero class
+        self.has_gold = [] # for each record in order, whether it should have nonzero class
+        # accuracy matrices
+        self.combo_matrix = ConfusionMatrix()
+        self.rb_matrix = ConfusionMatrix()
+        self.ml_matrix = ConfusionMatrix()
+        # error analysis, as (file/record id, grade(s)) tuples
+        self.wrong_should_have_no_class = []
+        self.wrong_should_have_class = []
+        self.incorrect = []
+
+    def merge(self, other):
+        '''Adds another result's counts to this one. Error lists are appended in order.'''
+        self.seen += other.seen
+        self.should_have_class += other.should_have_class
+        self.has_gold.extend(other.has_gold)
+        self.combo_matrix.merge(other.combo_matrix)
+        self.rb_matrix.merge(other.rb_matrix)
+        self.ml_matrix.merge(other.ml_matrix)
+        self.wrong_should_have_no_class.extend(other.wrong_should_have_no_class)
+        self.wrong_should_have_class.extend(other.wrong_should_have_class)
+        self.incorrect.extend(other.incorrect)
+        return self
+
+def best_grade(grades):
+    '''Returns the most common grade in the list, preferring the higher grade in a tie.'''
+    counts = {0:0, 1:0, 2:0, 3:0, 4:0}
+    for grade in grades:
+        counts[grade] += 1
+    counts = sorted(counts.items(), key=lambda x: x[1], reverse=True)
+    if counts[0][1] == counts[1][1]:
+        return max(counts[0][0], counts[1][0])
+    return counts[0][0]
+
+def lines_for_ml(texts, prefilter=False):
+    '''Returns the lines of each text the ML classifier should see.'''
+    text_lines = [text.split("\n") for text in texts]
+    if prefilter:
+        return [[line for line in lines if rule_based_classifier.is_candidate_line(line)] for lines in text_lines]
+    return text_lines
+
+def rule_grades(texts):
+    '''Runs the rule-based classifier over a list of record texts. Returns the grades found in each, in order.'''
+    # Options for dealing with "differentiation" strings
+    # 0: Skip differentiation search
+    # 1: Return max diff, if there's more than one
+    # 2: skip "poorly differentiated"
+    return [rule_based_classifier.classify_record(text, 2) for text in texts]
+
+class LineTable:
+    '''
+    Interns lines: gives each distinct line an id, its index in lines, so work
+    done per line only has to be done once per distinct line.
+    '''
+    def __init__(self):
+        self.ids = {}
+        self.lines = []
+
+    def intern(self, line):
+        line_id = self.ids.setdefault(line, len(self.lines))
+        if line_id == len(self.lines):
+            self.lines.append(line)
+        return line_id
+
+# Lines given to ml_positive_lines, and how many of them were distinct, so far
+_line_counts = {"lines": 0, "distinct": 0}
+
+def ml_positive_lines(texts, trained_objects, prefilter=False, predict=None):
+    '''
+    Runs the ML classifier over every line of every record at once, classifying
+        each distinct line once.
+    predict is the function that classifies a list of lines; by default
+        ml_classifier.test with the trained objects.
+    Returns, for each text, the numbers of the lines it thinks have a grade (counting from 0).
+    '''
+    table = LineTable()
+    text_ids = [[table.intern(line) for line in text.split("\n")] for text in texts]
+    _line_counts["lines"] += sum(len(ids) for ids in text_ids)
+    _line_counts["distinct"] += len(table.lines)
+    if prefilter:
+        candidates = [i for i, line in enumerate(table.lines) if rule_based_classifier.is_candidate_line(line)]
+    else:
+        candidates = range(len(table.lines))
+    if predict is None:
+        predict = lambda lines: ml_classifier.test(trained_objects, lines)
+    labels = predict([table.lines[i] for i in candidates]) if len(candidates) > 0 else []
+    positive = set(i for i, label in zip(candidates, labels) if label != "0")
+    return [[n for n, line_id in enumerate(ids) if line_id in positive] for ids in text_ids]
+
+@lru_cache(maxsize=LINE_GRADE_MEMO_SIZE)
+def _memo_line_grade(line):
+    return rule_based_classifier.classify_string(line)
+
+def line_grade(line):
+    '''
+    Returns the grade classify_string gives the line, memoized. While the rules are
+        being profiled, every line is run, so the profile counts stay the same.
+    '''
+    if rule_based_classifier.get_profile() is not None:
+        return rule_based_classifier.classify_string(line)
+    return _memo_line_grade(line)
+
+def line_stats():
+    '''
+    Returns a dict of the number of "lines" the ML classifier was given so far, how many
+        were "distinct" and the "dedup_ratio" between them, and the "memo_hits",
+        "memo_misses" and "memo_size" of the classify_string memo.
+    '''
+    memo = _memo_line_grade.cache_info()
+    return {"lines": _line_counts["lines"], "distinct": _line_counts["distinct"],
+            "dedup_ratio": _line_counts["lines"] / _line_counts["distinct"] if _line_counts["distinct"] else 1.0,
+            "memo_hits": memo.hits, "memo_misses": memo.misses, "memo_size": memo.currsize}
+
+def ml_grades(text, line_numbers):
+    '''Extracts the specific grade from each line of the text the ML classifier thinks has a grade.'''
+    lines = text.split("\n")
+    return [line_grade(lines[i]) for i in line_numbers]
+
+def grade_texts(texts, trained_objects, prefilter=False, model_id=None, parallel=False, processes=None):
+    '''
+    Runs both classifiers over a list of record texts.
+    Returns a (rule-based grades, ML grades) tuple for each text, in order.
+    model_id is the artifact id of the model; given one, results are taken from and
+        added to the prediction cache.
+    With parallel set, the classifiers run on a pool of processes (see Grader).
+    '''
+    grader = Grader(trained_objects, prefilter, processes if parallel else 0)
+    try:
+        cache = prediction_cache.get_cache() if model_id is not None and rule_based_classifier.get_profile() is None else None
+        if cache is None:
+            rb_grades = grader.rule_grades(texts)
+            positive_lines = grader.ml_positive_lines(texts)
+        else:
+            rb_grades = cached(cache, texts, [cache.rules_key(text) for text in texts], grader.rule_grades)
+            positive_lines = cached(cache, texts, [cache.ml_key(text, model_id, prefilter) for text in texts], grader.ml_positive_lines)
+    finally:
+        grader.close()
+    return [(rb_grade, ml_grades(text, line_numbers)) for text, rb_grade, line_numbers in zip(texts, rb_grades, positive_lines)]
+
+def cached(cache, texts, keys, compute):
+    '''
+    Looks up the value of each text under its key in the prediction cache. compute is called
+    once, on the distinct texts that aren't cached, and must return their values in order.
+    Returns the value for each text.
+    '''
+    values = cache.get_many(keys)
+    misses = dict((text, key) for text, key, value in zip(texts, keys, values) if value is None)
+    if len(misses) == 0:
+        return values
+    computed = dict(zip(misses, compute(list(misses))))
+    cache.put_many(list(misses.values()), [computed[text] for text in misses])
+    return [value if value is not None else computed[text] for text, value in zip(texts, values)]
+
+def prefilter_recall(texts, trained_objects):
+    '''
+    Runs the ML classifier over every line of the texts and checks how many of the
+    lines it finds a grade in the prefilter keeps.
+    Returns a dict of counts of "lines", prefilter "candidates", "ml_positive" lines
+    and ML positive lines the prefilter "missed", and the "recall" of ML positive lines.
+    '''
+    lines = [line for lines in lines_for_ml(texts) for line in lines]
+    positive = [line for line, label in zip(lines, ml_classifier.test(trained_objects, lines) if lines else []) if label != "0"]
+    missed = [line for line in positive if not rule_based_classifier.is_candidate_line(line)]
+    return {"lines": len(lines),
+            "candidates": sum(1 for line in lines if rule_based_classifier.is_candidate_line(line)),
+            "ml_positive": len(positive),
+            "missed": len(missed),
+            "recall": 1 - len(missed) / len(positive) if positive else 1.0}
+
+def classify_records(records_list, trained_objects, prefilter=False, model_id=None, parallel=False, processes=None):
+    '''
+    Classifies all the records in the given list of records. Returns a ClassificationResult.
+    See grade_texts for the options.
+    '''
+    result = ClassificationResult()
+    grades = grade_texts([record.text for record in records_list], trained_objects, prefilter, model_id, parallel, processes)
+    for record, (rb_grade, ml_grade) in zip(records_list, grades):
+        tally(result, record, rb_grade, ml_grade)
+    return result
+
+def tally(result, record, rb_grade, ml_grade):
+    '''Counts one record's rule-based and ML grades into the result.'''
+    gold = record.gold
+    # get best combined grade
+    grade = best_grade(rb_grade + ml_grade)
+    rb_best_grade = best_grade(rb_grade)
+    ml_best_grade = best_grade(ml_grade)
+    best_gold = max(gold) if gold != [] else 0
+    # account for grade 9 being used for unknown grade in one annotation
+    if best_gold == 9:
+        best_gold = 0
+    # count for accuracy
+    result.seen += 1
+    result.combo_matrix.add(grade, best_gold)
+    result.rb_matrix.add(rb_best_grade, best_gold)
+    result.ml_matrix.add(ml_best_grade, best_gold)
+    result.has_gold.append(gold != [])
+    if gold != []:
+        result.should_have_class += 1
+
+    # update variables for doing error analysis
+    rec_file = record.file.split(os.sep)[-1]
+    if grade != best_gold and best_gold != 0 and grade != 0:
+        result.incorrect.append((rec_file + "/" + record.rid, grade, best_gold))
+    if grade == 0 and best_gold != 0:
+        result.wrong_should_have_class.append((rec_file + "/" + record.rid, best_gold))
+    if best_gold == 0 and grade != 0:
+        result.wrong_should_have_no_class.append((rec_file + "/" + record.rid, grade))
+
+# Set in each worker process by _init_worker
+_worker_trained_objects = None
+
+def _init_worker(trained_objects, profile_rules, store_directory):
+    global _worker_trained_objects
+    _worker_trained_objects = trained_objects
+    if store_directory is not None:
+        feature_store.enable(store_directory)
+    # the pool already uses every CPU
+    ml_classifier.set_jobs(trained_objects, 1)
+    if profile_rules:
+        rule_based_classifier.enable_profiling()
+
+def _worker_profile():
+    profile = rule_based_classifier.get_profile()
+    if profile is not None:
+        rule_based_classifier.enable_profiling()
+    return profile
+
+def _rule_chunk(texts):
+    return rule_grades(texts), _worker_profile()
+
+def _ml_chunk(lines):
+    return ml_classifier.test(_worker_trained_objects, lines), None
+
+class Grader:
+    '''
+    Runs the rule-based classifier and the ML classifier over lists of texts, in this
+    process, or, if processes isn't 0, on a pool of that many worker processes (None
+    for one per CPU). Texts (or, for the ML classifier, the distinct lines of the
+    texts) are split into contiguous chunks and the results put back together in
+    order, so they are the same either way.
+    '''
+    def __init__(self, trained_objects, prefilter=False, processes=0):
+        self.trained_objects = trained_objects
+        self.prefilter = prefilter
+        self.processes = processes if processes == 0 else processes or os.cpu_count() or 1
+        self.pool = None
+
+    def map(self, function, items):
+        if self.pool is None:
+            profile_rules = rule_based_classifier.get_profile() is not None
+            store = feature_store.get_store()
+            self.pool = Pool(self.processes, initializer=_init_worker,
+                             initargs=(self.trained_objects, profile_rules, store.directory if store is not None else None))
+        chunk_size = max(1, -(-len(items) // (self.processes * 4)))
+        results = []
+        for chunk, profile in self.pool.map(function, [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]):
+            results.extend(chunk)
+            if profile is not None:
+                rule_based_classifier.merge_profile(profile)
+        return results
+
+    def rule_grades(self, texts):
+        if self.processes == 0 or len(texts) == 0:
+            return rule_grades(texts)
+        return self.map(_rule_chunk, texts)
+
+    def ml_positive_lines(self, texts):
+        if self.processes == 0 or len(texts) == 0:
+            return ml_positive_lines(texts, self.trained_objects, self.prefilter)
+        # lines are interned here, so the workers only classify distinct lines
+        return ml_positive_lines(texts, self.trained_objects, self.prefilter, lambda lines: self.map(_ml_chunk, lines))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+def classify_parallel(records_list, trained_objects, processes=None, prefilter=False, model_id=None):
+    '''
+    Classifies the records on a pool of worker processes (see Grader).
+    The result is the same as classify_records would give.
+    '''
+    return classify_records(records_list, trained_objects, prefilter, model_id, True, processes)
@@ -0,0 +1,282 @@
+"""
+Concept extractors: the backends record.get_UMLS_tags can tag text with
+
+Every extractor returns the same record.Term/record.Concept objects, so the
+rest of the pipeline doesn't care which one is used. CONCEPT_BACKEND in
+config.py picks the backend:
+- "metamap": MetaMap Lite, run in external processes (see metamap_pool.py).
+  Results are kept in the UMLS cache.
+- "dictionary": DictionaryExtractor, an in-process longest-match tagger built
+  from a local term table (CONCEPT_TABLE). It needs no JVM or subprocess, and
+  is fast enough that its results aren't cached.
+"""
+import os
+import re
+import hashlib
+from bisect import bisect_right
+from subprocess import Popen, PIPE, STDOUT
+import metamap_pool
+import record
+from config import CONCEPT_BACKEND, CONCEPT_TABLE, METAMAP_DIR, METAMAP_POOL_SIZE, METAMAP_BATCH_SIZE
+
+# Goes between strings joined into one document by MetaMapLiteExtractor.tag_batch, so that no term spans two strings
+BATCH_SEPARATOR = "\n.\n"
+
+# Words the dictionary extractor matches on
+TOKEN_RX = re.compile(r"\w+")
+
+
+class ConceptExtractor:
+    """
+    Interface of a concept extractor. Subclasses implement tag, and may implement
+    tag_batch when tagging many strings at once is cheaper.
+    """
+    name = None
+    # whether results should be kept in the UMLS cache
+    cached = False
+    # printed when the backend isn't available
+    missing = None
+
+    def available(self):
+        """
+        :return: whether the backend can be used (e.g. its files are installed)
+        """
+        return True
+
+    def fingerprint(self):
+        """
+        :return: a string identifying everything that decides the tags this backend gives
+        """
+        return self.name
+
+    def tag(self, text):
+        """
+        :param text: text to tag
+        :return: a list of Terms found in the text, with their Concepts
+        """
+        raise NotImplementedError
+
+    def tag_batch(self, texts):
+        """
+        :param texts: list of strings
+        :return: a list of Terms for each string, in the same order
+        """
+        return [self.tag(text) for text in texts]
+
+
+class MetaMapLiteExtractor(ConceptExtractor):
+    name = "metamap"
+    cached = True
+    missing = "MetaMap Lite installation not found. To use MetaMap Lite, install it and edit config.py."
+
+    def available(self):
+        return os.path.exists(METAMAP_DIR)
+
+    def tag(self, text):
+        return record.parse_umls_terms(self.run(text))
+
+    @staticmethod
+    def run(text):
+        """
+        Runs Metamap Lite over a string. Uses the persistent worker pool unless
+        METAMAP_POOL_SIZE is 0, in which case a new process is started for this string.
+
+        :param text: text to annotate
+        :return: BRAT format metamap lite output, as bytes
+        """
+        if METAMAP_POOL_SIZE > 0:
+            return metamap_pool.get_pool().tag(text)
+        args, shell = metamap_pool.metamap_command()
+        p = Popen(args, stdin=PIPE, stdout=PIPE, stderr=STDOUT, shell=shell)
+        return p.communicate(input=text.encode())[0]
+
+    def tag_batch(self, texts):
+        """
+        Joins the strings into documents of up to METAMAP_BATCH_SIZE strings, tags each
+        document in one request, and hands every Term back to the string its offsets fall in.
+
+        :param texts: list of strings
+        :return: a list of Terms for each string, in the same order, with offsets relative to that string
+        """
+        batches = [texts[i:i + METAMAP_BATCH_SIZE] for i in range(0, len(texts), METAMAP_BATCH_SIZE)]
+        documents = []
+        batch_starts = []
+        for batch in batches:
+            starts = []
+            offset = 0
+            for text in batch:
+                starts.append(offset)
+                offset += len(text) + len(BATCH_SEPARATOR)
+            documents.append(BATCH_SEPARATOR.join(batch))
+            batch_starts.append(starts)
+        if METAMAP_POOL_SIZE > 0:
+            outputs = metamap_pool.get_pool().map(documents)
+        else:
+            outputs = [self.run(document) for document in documents]
+
+        tagged = []
+        for batch, starts, output in zip(batches, batch_starts, outputs):
+            tagged.extend(split_terms(record.parse_umls_terms(output), starts, [len(text) for text in batch]))
+        return tagged
+
+
+def split_terms(terms, starts, lengths):
+    """
+    Hands the Terms found in a joined document back to the strings it was built from
+
+    :param terms: Terms parsed from the output for the joined document
+    :param starts: character offset of each string within the document, ascending
+    :param lengths: length of each string
+    :return: a list of Terms for each string, with offsets rebased to that string.
+             Terms that span more than one string are dropped.
+    """
+    split = [[] for _ in starts]
+    for term in terms:
+        start, stop = int(term.start), int(term.stop)
+        i = bisect_right(starts, start) - 1
+        if i < 0 or stop > starts[i] + lengths[i]:
+            continue
+        rebased = record.Term(term.id, str(start - starts[i]), str(stop - starts[i]), term.tag)
+        rebased.concepts = term.concepts
+        split[i].append(rebased)
+    return split
+
+
+def load_term_table(path):
+    """
+    Reads a term table. Either a tab-separated file with a concept id, a term and the
+    concept's preferred name on each line (lines starting with # are skipped), or a
+    UMLS MRCONSO.RRF file, from which the English strings are taken, named by each
+    concept's preferred English string.
+
+    :param path: location of the table
+    :return: list of (term, concept id, preferred name) tuples
+    """
+    with open(path, encoding="utf-8") as f:
+        if not path.upper().endswith(".RRF"):
+            rows = []
+            for line in f:
+                if line.startswith("#") or line.strip() == "":
+                    continue
+                fields = line.rstrip("\n").split("\t")
+                rows.append((fields[1], fields[0], fields[2] if len(fields) > 2 else fields[1]))
+            return rows
+        strings = []
+        preferred = {}
+        for line in f:
+            fields = line.split("|")
+            # CUI|LAT|TS|LUI|STT|SUI|ISPREF|AUI|SAUI|SCUI|SDUI|SAB|TTY|CODE|STR|...
+            if fields[1] != "ENG":
+                continue
+            strings.append((fields[14], fields[0]))
+            if fields[2] == "P" and fields[4] == "PF" and fields[6] == "Y":
+                preferred.setdefault(fields[0], fields[14])
+        return [(term, cui, preferred.get(cui, term)) for term, cui in strings]
+
+
+class DictionaryExtractor(ConceptExtractor):
+    name = "dictionary"
+    missing = "Concept table not found. To use the dictionary concept extractor, set CONCEPT_TABLE in config.py."
+
+    def __init__(self, path=CONCEPT_TABLE):
+        """
+        In-process concept tagger. Terms are split into lower-cased words and stored in a
+        trie; text is scanned a word at a time, taking the longest term starting at each
+        word, so tagging costs one dictionary lookup per word.
+
+        :param path: location of the term table (see load_term_table)
+        """
+        self.path = path
+        self.trie = None
+
+    def available(self):
+        return os.path.exists(self.path)
+
+    def fingerprint(self):
+        """
+        :return: the backend name and a hash of the term table, so editing the table changes it
+        """
+        h = hashlib.sha256()
+        with open(self.path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        return "%s:%s" % (self.name, h.hexdigest())
+
+    def load(self):
+        """
+        Builds the trie from the term table, if it hasn't been built yet
+
+        :return: the trie: nested dicts of word -> node, where the None key of a node
+                 holds the (concept id, preferred name) pairs of the term ending there
+        """
+        if self.trie is None:
+            trie = {}
+            for term, concept_id, name in load_term_table(self.path):
+                words = TOKEN_RX.findall(term.lower())
+                if len(words) == 0:
+                    continue
+                node = trie
+                for word in words:
+                    node = node.setdefault(word, {})
+                concepts = node.setdefault(None, [])
+                if (concept_id, name) not in concepts:
+                    concepts.append((concept_id, name))
+            self.trie = trie
+        return self.trie
+
+    def tag(self, text):
+        """
+        Terms and Concepts are filled in the way record.parse_umls_terms fills them from
+        MetaMap Lite output: offsets as strings, and the first word of the matched text
+        and of each concept's name.
+        """
+        trie = self.load()
+        words = [(m.start(), m.end(), m.group().lower()) for m in TOKEN_RX.finditer(text)]
+        terms = []
+        concept_number = 0
+        i = 0
+        while i < len(words):
+            node = trie.get(words[i][2])
+            if node is None:
+                i += 1
+                continue
+            match = None
+            j = i
+            while True:
+                if None in node:
+                    match = (j, node[None])
+                j += 1
+                if j == len(words) or words[j][2] not in node:
+                    break
+                node = node[words[j][2]]
+            if match is None:
+                i += 1
+                continue
+            end, concepts = match
+            start, stop = words[i][0], words[end][1]
+            term = record.Term("T%d" % (len(terms) + 1), str(start), str(stop), text[start:stop].split()[0])
+            for concept_id, name in concepts:
+                concept_number += 1
+                term.concepts.append(record.Concept("N%d" % concept_number, concept_id, (name.split() or [""])[0]))
+            terms.append(term)
+            i = end + 1
+        return terms
+
+
+BACKENDS = {"metamap": MetaMapLiteExtractor, "dictionary": DictionaryExtractor}
+
+_extractor = None
+
+
+def get_extractor():
+    """
+    Returns the process-wide extractor of the CONCEPT_BACKEND set in config.py, making it on first use.
+
+    :return: a ConceptExtractor
+    """
+    global _extractor
+    if _extractor is None:
+        if CONCEPT_BACKEND not in BACKENDS:
+            raise ValueError("Unknown CONCEPT_BACKEND %r; expected one of %s" % (CONCEPT_BACKEND, ", ".join(BACKENDS)))
+        _extractor = BACKENDS[CONCEPT_BACKEND]()
+    return _extractor
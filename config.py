@@ -1 +1,46 @@
 METAMAP_DIR = r"/opt/Meta_map_lite/public_mm_lite"
+# Number of MetaMap Lite processes kept running for the whole run.
+# 0 starts a new MetaMap Lite process for every string instead.
+METAMAP_POOL_SIZE = 2
+# Number of strings joined into one MetaMap Lite request by concept_extractors.MetaMapLiteExtractor.tag_batch
+METAMAP_BATCH_SIZE = 200
+# Seconds to wait for a MetaMap Lite worker to answer before restarting it.
+# The first request to a worker also pays for the JVM start and index load.
+METAMAP_TIMEOUT = 300
+# On-disk cache of MetaMap Lite results, so text that has been tagged before
+# isn't sent to MetaMap Lite again. Set UMLS_CACHE_FILE to None to disable it.
+UMLS_CACHE_FILE = "umls_cache.sqlite"
+# Least recently used entries are evicted once the cache holds more than this many strings
+UMLS_CACHE_MAX_ENTRIES = 200000
+# Seed for picking the negative training lines, so the training data (and model) can be reproduced
+NEGATIVE_SAMPLING_SEED = 575
+# Directory where trained models are saved, keyed by a fingerprint of their training data
+MODEL_DIR = "models"
+# Hashed (out-of-core) training: number of hashed features, and number of training lines vectorized
+# and fitted at a time. Memory use depends on these, not on the size of the training data
+HASHED_FEATURES = 2 ** 20
+HASHED_CHUNK_SIZE = 10000
+# ML classifier built by ml_classifier.train: "full" (the SVM/MaxEnt/random forest/decision tree
+# voting ensemble) or "fast" (logistic regression only, much quicker to train and apply)
+MODEL_PROFILE = "full"
+# Processes used to fit the members of an ensemble and the trees of a forest; -1 uses every CPU
+ML_JOBS = -1
+# Number of resamples for the bootstrap confidence intervals main.py prints with "bootstrap"
+BOOTSTRAP_RESAMPLES = 2000
+# On-disk cache of the grades given to each record, keyed by the record text, the rule-based
+# classifier source and the model, so a rerun only reclassifies what changed. None disables it
+PREDICTION_CACHE_FILE = "prediction_cache.sqlite"
+PREDICTION_CACHE_MAX_ENTRIES = 1000000
+# Number of distinct lines whose classify_string grade is memoized by classification.line_grade
+LINE_GRADE_MEMO_SIZE = 100000
+# Directory of the feature store (see feature_store.py), used with main.py feature-store
+FEATURE_STORE_DIR = "features"
+# Least recently used entries are removed once the feature store's arrays take up more than this many bytes
+FEATURE_STORE_MAX_BYTES = 2 * 1024 ** 3
+# Number of folds for main.py cross-validate, when no number follows it
+CROSS_VALIDATION_FOLDS = 5
+# Concept extractor record.get_UMLS_tags uses (see concept_extractors.py): "metamap" for MetaMap Lite, or
+# "dictionary" for the in-process tagger built from the term table CONCEPT_TABLE, a tab-separated file of
+# concept id, term and preferred name on each line, or a UMLS MRCONSO.RRF file
+CONCEPT_BACKEND = "metamap"
+CONCEPT_TABLE = "concepts.tsv"
@@ -0,0 +1,135 @@
+import os
+import time
+import hashlib
+from multiprocessing import Pool
+from sklearn.feature_extraction.text import CountVectorizer
+import classification
+import feature_store
+import instrumentation
+import ml_classifier
+import patient_splitter
+from pipeline import build_training_lines
+from config import CROSS_VALIDATION_FOLDS, NEGATIVE_SAMPLING_SEED, MODEL_PROFILE, ML_JOBS
+
+'''
+Patient-level k-fold cross-validation.
+
+    folds, total = cross_validate(train_records + test_records, k=5)
+
+Records are grouped by patient (PATIENT_DISPLAY_ID, or the record ID for
+records without one), so all of a patient's records are in the same fold, and
+each fold in turn is graded by a model trained on the other k - 1.
+
+Work shared between folds is done once, in this process: the training lines of
+every fold are built first (so MetaMap Lite tags each line once), and one
+vectorizer is fitted on all of them and vectorizes each distinct line once.
+Each fold then only fits its feature selector and classifier on its rows of
+that matrix. Since the selector drops every feature the fold's training lines
+don't use, the model is the same as one trained on the fold alone with
+ml_classifier.train.
+
+The folds run on a pool of worker processes, so on a machine with a CPU per
+fold the whole run takes about as long as one fold.
+'''
+
+def patient_id(record):
+    ''' The id records are grouped by: the patient's id, or the record's own if it has none '''
+    return patient_splitter.get_patient_id(record.text) or record.rid
+
+def patient_folds(records, k=CROSS_VALIDATION_FOLDS, seed=NEGATIVE_SAMPLING_SEED):
+    '''
+    Splits the records into k folds, keeping each patient's records together.
+    Patients are placed largest first, each in the fold with the fewest records so far;
+    patients with the same number of records are ordered by a keyed hash of their id,
+    so the folds only depend on the seed and the records.
+    Returns a list of k sorted lists of indexes into records.
+    '''
+    groups = {}
+    for i, record in enumerate(records):
+        groups.setdefault(patient_id(record), []).append(i)
+    if k < 2 or k > len(groups):
+        raise ValueError("Can't make %d folds from %d patients" % (k, len(groups)))
+    key = str(seed).encode()[:64]
+    def order(pid):
+        return (-len(groups[pid]), hashlib.blake2b(pid.encode(), key=key, digest_size=8).digest())
+    folds = [[] for _ in range(k)]
+    for pid in sorted(groups, key=order):
+        min(folds, key=len).extend(groups[pid])
+    return [sorted(fold) for fold in folds]
+
+def shared_features(fold_lines):
+    '''
+    Vectorizes the training lines of every fold at once.
+    fold_lines is the list of (line, label) tuples of each fold. One vectorizer is fitted
+        on all the distinct lines, and each distinct line is vectorized once (through the
+        feature store, if it's on).
+    Returns (vectorizer, matrix with a row per distinct line, the row of each fold's lines).
+    '''
+    table = classification.LineTable()
+    rows = [[table.intern(line) for line, label in lines] for lines in fold_lines]
+    vectorizer = CountVectorizer()
+    store = feature_store.get_store()
+    if store is None:
+        matrix = vectorizer.fit_transform(table.lines)
+    else:
+        vectorizer, matrix = store.fit_transform(vectorizer, table.lines)
+    return vectorizer, matrix.tocsr(), rows
+
+# Set in each worker process by _init_worker
+_shared = None
+
+def _init_worker(vectorizer, matrix, n_jobs):
+    global _shared
+    _shared = (vectorizer, matrix, n_jobs)
+
+def _run_fold(fold):
+    rows, labels, test_records, profile, prefilter = fold
+    vectorizer, matrix, n_jobs = _shared
+    start = time.perf_counter()
+    selector, classifier = ml_classifier.fit_counts(matrix[rows], labels, profile, n_jobs)
+    result = classification.classify_records(test_records, [vectorizer, classifier, selector], prefilter)
+    return result, time.perf_counter() - start
+
+def cross_validate(records, k=CROSS_VALIDATION_FOLDS, use_metamap=False, seed=NEGATIVE_SAMPLING_SEED,
+                   profile=MODEL_PROFILE, processes=None, prefilter=False):
+    '''
+    Runs patient-level k-fold cross-validation over the records, with the ML classifier
+    of the given profile (see ml_classifier.PROFILES).
+    prefilter is whether the ML classifier only sees the lines that could carry a grade,
+        as for pipeline.Pipeline.
+    processes is the number of worker processes: None for one per fold (up to one per
+        CPU), 0 to run the folds one after another in this process.
+    Returns (folds, total): for each fold a dict of the number of "train_records" and
+    "test_records", the "seconds" it took to fit and grade, and its "result" (a
+    classification.ClassificationResult); and all the folds' results merged.
+    '''
+    folds = patient_folds(records, k, seed)
+    with instrumentation.stage("training_lines") as counts:
+        fold_lines = []
+        for fold in folds:
+            held_out = set(fold)
+            fold_lines.append(build_training_lines([r for i, r in enumerate(records) if i not in held_out], use_metamap, seed))
+        counts.records = len(records)
+    with instrumentation.stage("vectorize") as counts:
+        vectorizer, matrix, rows = shared_features(fold_lines)
+        counts.lines = matrix.shape[0]
+    tasks = [(fold_rows, [label for line, label in lines], [records[i] for i in fold], profile, prefilter)
+             for fold_rows, lines, fold in zip(rows, fold_lines, folds)]
+    with instrumentation.stage("folds") as counts:
+        if processes is None:
+            processes = min(k, os.cpu_count() or 1)
+        if processes == 0:
+            _init_worker(vectorizer, matrix, ML_JOBS)
+            outcomes = [_run_fold(task) for task in tasks]
+        else:
+            # the pool already uses the CPUs, so each fold fits on one
+            with Pool(processes, initializer=_init_worker, initargs=(vectorizer, matrix, 1)) as pool:
+                outcomes = pool.map(_run_fold, tasks, chunksize=1)
+        counts.records = len(records)
+    total = classification.ClassificationResult()
+    fold_stats = []
+    for fold, (result, seconds) in zip(folds, outcomes):
+        fold_stats.append({"train_records": len(records) - len(fold), "test_records": len(fold),
+                           "seconds": seconds, "result": result})
+        total.merge(result)
+    return fold_stats, total
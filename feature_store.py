@@ -0,0 +1,218 @@
+import os
+import json
+import shutil
+import pickle
+import hashlib
+import numpy as np
+from scipy.sparse import csr_matrix
+from config import FEATURE_STORE_DIR, FEATURE_STORE_MAX_BYTES
+
+'''
+On-disk store of vectorized lines, so the same lines don't have to be
+tokenized again by the same vectorizer.
+
+Each entry is a directory holding the CSR arrays of the feature matrix
+(data.npy, indices.npy, indptr.npy), the offsets of each document's first
+line (offsets.npy; a document is one record's list of lines) and the matrix
+shape. Entries are keyed by a fingerprint of the vectorizer (its parameters
+and, once fitted, its vocabulary) and a hash of the lines. Arrays are loaded
+with numpy memory mapping, so loading an entry copies nothing and the
+operating system only reads the parts of it that are used.
+
+A fitted vectorizer only depends on its parameters and the lines it was fitted
+on, so fit_transform also stores the fitted vectorizer and can skip fitting.
+
+Call enable() to turn the store on for this process (main.py feature-store);
+ml_classifier then vectorizes through get_store(). Each entry directory's
+modification time is its last use. Once the entries take up more than
+max_bytes, the least recently used are removed after each save, so the store
+stays bounded however many different line sets (training chunks, parallel
+chunks, folds) go through it. Delete the directory to clear the store.
+'''
+
+ARRAYS = ["data", "indices", "indptr", "offsets"]
+
+_store = None
+
+def fingerprint(vectorizer):
+    '''
+    Returns a hash of everything that decides how the vectorizer turns lines into
+    features: its class, parameters and, if it has one, its fitted vocabulary.
+    '''
+    h = hashlib.sha256()
+    h.update(type(vectorizer).__name__.encode())
+    h.update(repr(sorted(vectorizer.get_params().items())).encode())
+    vocabulary = getattr(vectorizer, "vocabulary_", None)
+    if vocabulary is not None:
+        h.update(json.dumps(vocabulary, sort_keys=True, default=int).encode())
+    return h.hexdigest()
+
+def documents_key(vectorizer_fingerprint, documents, kind="transform"):
+    ''' Returns the key of the features of the documents (lists of lines) under the vectorizer fingerprint '''
+    h = hashlib.sha256(("%s\0%s\0" % (kind, vectorizer_fingerprint)).encode())
+    for document in documents:
+        h.update(b"\1")
+        for line in document:
+            h.update(line.encode("utf-8", "surrogatepass"))
+            h.update(b"\0")
+    return h.hexdigest()
+
+def offsets_of(documents):
+    offsets = np.zeros(len(documents) + 1, dtype=np.int64)
+    np.cumsum([len(document) for document in documents], out=offsets[1:])
+    return offsets
+
+class FeatureStore:
+    '''
+    Feature matrices saved under a directory, one subdirectory per entry.
+    '''
+    def __init__(self, directory=FEATURE_STORE_DIR, max_bytes=FEATURE_STORE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def save(self, key, matrix, offsets, vectorizer=None):
+        '''
+        Saves a CSR matrix and its document offsets (and a fitted vectorizer) under the key.
+        The entry is written to a temporary directory and renamed into place, so a reader
+        never sees a partly written entry.
+        '''
+        os.makedirs(self.directory, exist_ok=True)
+        temporary = self.path(key) + ".tmp%d" % os.getpid()
+        os.makedirs(temporary, exist_ok=True)
+        matrix = matrix.tocsr()
+        arrays = {"data": matrix.data, "indices": matrix.indices, "indptr": matrix.indptr, "offsets": offsets}
+        for name in ARRAYS:
+            np.save(os.path.join(temporary, name + ".npy"), arrays[name])
+        with open(os.path.join(temporary, "shape.json"), "w") as out:
+            json.dump(list(matrix.shape), out)
+        if vectorizer is not None:
+            with open(os.path.join(temporary, "vectorizer.pickle"), "wb") as out:
+                pickle.dump(vectorizer, out, pickle.HIGHEST_PROTOCOL)
+        try:
+            os.replace(temporary, self.path(key))
+        except OSError:
+            # another process saved the same entry first
+            shutil.rmtree(temporary, ignore_errors=True)
+        self.prune(keep=key)
+
+    def entries(self):
+        '''
+        Returns (last use time, bytes, key) for every complete entry, least recently used first
+        '''
+        entries = []
+        for key in os.listdir(self.directory) if os.path.isdir(self.directory) else []:
+            path = self.path(key)
+            if ".tmp" in key or ".old" in key or not os.path.exists(os.path.join(path, "shape.json")):
+                continue
+            try:
+                size = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+                entries.append((os.path.getmtime(path), size, key))
+            except OSError:
+                # removed by another process meanwhile
+                continue
+        return sorted(entries)
+
+    def prune(self, keep=None):
+        '''
+        Removes the least recently used entries (except keep) until the store takes up
+        no more than max_bytes. Returns the number of entries removed.
+        '''
+        entries = self.entries()
+        total = sum(size for used, size, key in entries)
+        removed = 0
+        for used, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            # rename first, so no reader finds a half-removed entry
+            old = self.path(key) + ".old%d" % os.getpid()
+            try:
+                os.replace(self.path(key), old)
+            except OSError:
+                continue
+            shutil.rmtree(old, ignore_errors=True)
+            total -= size
+            removed += 1
+        return removed
+
+    def load(self, key):
+        '''
+        Returns (matrix, offsets, fitted vectorizer or None) saved under the key, with the
+        arrays memory mapped, or None if there is no such entry.
+        '''
+        path = self.path(key)
+        try:
+            arrays = {name: np.load(os.path.join(path, name + ".npy"), mmap_mode="r") for name in ARRAYS}
+            with open(os.path.join(path, "shape.json")) as f:
+                shape = tuple(json.load(f))
+            vectorizer = None
+            if os.path.exists(os.path.join(path, "vectorizer.pickle")):
+                with open(os.path.join(path, "vectorizer.pickle"), "rb") as f:
+                    vectorizer = pickle.load(f)
+            # mark the entry as just used
+            os.utime(path)
+        except OSError:
+            # not saved yet, or removed by prune
+            self.misses += 1
+            return None
+        self.hits += 1
+        matrix = csr_matrix((arrays["data"], arrays["indices"], arrays["indptr"]), shape=shape, copy=False)
+        return matrix, arrays["offsets"], vectorizer
+
+    def transform_documents(self, vectorizer, documents):
+        '''
+        Vectorizes every line of the documents (lists of lines) with a fitted vectorizer,
+        or loads the features saved for them.
+        Returns (matrix with a row per line, offsets), where document i is rows
+        offsets[i] to offsets[i + 1].
+        '''
+        key = documents_key(fingerprint(vectorizer), documents)
+        entry = self.load(key)
+        if entry is not None:
+            return entry[0], entry[1]
+        offsets = offsets_of(documents)
+        matrix = vectorizer.transform([line for document in documents for line in document])
+        self.save(key, matrix, offsets)
+        return matrix, offsets
+
+    def transform(self, vectorizer, lines):
+        ''' Like vectorizer.transform(lines), through the store '''
+        return self.transform_documents(vectorizer, [lines])[0]
+
+    def fit_transform(self, vectorizer, lines):
+        '''
+        Like vectorizer.fit_transform(lines), through the store.
+        Returns (fitted vectorizer, matrix). The given vectorizer is only fitted if the
+        store has nothing for it and the lines; otherwise the saved one is returned.
+        '''
+        key = documents_key(fingerprint(vectorizer), [lines], "fit")
+        entry = self.load(key)
+        if entry is not None and entry[2] is not None:
+            return entry[2], entry[0]
+        matrix = vectorizer.fit_transform(lines)
+        self.save(key, matrix, offsets_of([lines]), vectorizer)
+        return vectorizer, matrix
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+def enable(directory=FEATURE_STORE_DIR, max_bytes=FEATURE_STORE_MAX_BYTES):
+    ''' Turns the store on for this process '''
+    global _store
+    if _store is None or _store.directory != directory:
+        _store = FeatureStore(directory, max_bytes)
+    return _store
+
+def disable():
+    global _store
+    _store = None
+
+def get_store():
+    ''' Returns the FeatureStore if enable has been called, otherwise None '''
+    return _store
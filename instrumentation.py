@@ -0,0 +1,142 @@
+import os
+import sys
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+'''
+Stage-level performance instrumentation for pipeline runs.
+
+Call enable() before a run, wrap each stage in "with stage(name) as s:", set
+s.records/s.lines to the number of records/lines the stage handled, then call
+write_report(file_name). Stages can be nested; a nested stage is reported as
+"outer/inner". A stage that runs more than once under the same name (once
+per fold when cross-validating, say) is reported once, with its times and
+counts added up over the runs and "calls" set to the number of runs. While
+instrumentation is off, stage() does nothing.
+
+For each stage the report has wall and CPU time, records/sec and lines/sec,
+and the peak resident set size of the process so far. If enable was asked to
+trace memory, it also has the most memory tracemalloc has seen allocated so
+far and the source lines holding the most memory when the stage ended.
+Tracing memory makes everything much slower, so leave it off when timing.
+
+CPU time is for this process only; work done in worker processes (main.py
+parallel) shows up in wall time but not CPU time.
+'''
+
+# Number of allocating source lines listed for each stage when tracing memory
+TOP_ALLOCATIONS = 10
+
+_report = None # stage name -> stats, in the order stages first finished, while instrumentation is on
+_stack = [] # names of the stages currently running, outermost first
+_trace_memory = False
+
+class Stage:
+    ''' Counts filled in by the code being measured '''
+    def __init__(self):
+        self.records = None
+        self.lines = None
+
+def enable(trace_memory=False):
+    '''
+    Starts recording stages. Clears earlier results
+    '''
+    global _report, _trace_memory
+    _report = {}
+    _stack.clear()
+    _trace_memory = trace_memory
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+def disable():
+    global _report, _trace_memory
+    _report = None
+    if _trace_memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _trace_memory = False
+
+def enabled():
+    return _report is not None
+
+def peak_rss():
+    '''
+    Returns the peak resident set size of this process in bytes, or None where
+    the resource module isn't available (Windows)
+    '''
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def top_allocations(limit=TOP_ALLOCATIONS):
+    '''
+    Returns the source lines holding the most traced memory right now, as a list
+    of {"location", "bytes", "blocks"}
+    '''
+    statistics = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    )).statistics("lineno")
+    return [{"location": "%s:%d" % (os.path.relpath(s.traceback[0].filename), s.traceback[0].lineno),
+             "bytes": s.size, "blocks": s.count} for s in statistics[:limit]]
+
+def add_count(total, count):
+    ''' Adds a stage's count to the total of its earlier runs, either of which may be unset (None) '''
+    if count is None:
+        return total
+    return count if total is None else total + count
+
+@contextmanager
+def stage(name):
+    '''
+    Measures the code in the with block as one stage. Yields a Stage whose
+    records and lines can be set to report throughput
+    '''
+    counts = Stage()
+    if _report is None:
+        yield counts
+        return
+    _stack.append(name)
+    full_name = "/".join(_stack)
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield counts
+    finally:
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+        _stack.pop()
+        stats = _report.setdefault(full_name, {"calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0,
+                                               "records": None, "lines": None})
+        stats["calls"] += 1
+        stats["wall_seconds"] += wall
+        stats["cpu_seconds"] += cpu
+        stats["records"] = add_count(stats["records"], counts.records)
+        stats["lines"] = add_count(stats["lines"], counts.lines)
+        wall = stats["wall_seconds"]
+        stats["records_per_second"] = stats["records"] / wall if stats["records"] is not None and wall > 0 else None
+        stats["lines_per_second"] = stats["lines"] / wall if stats["lines"] is not None and wall > 0 else None
+        stats["peak_rss_bytes"] = peak_rss()
+        if _trace_memory:
+            stats["traced_peak_bytes"] = max(stats.get("traced_peak_bytes", 0), tracemalloc.get_traced_memory()[1])
+            stats["top_allocations"] = top_allocations()
+
+def report():
+    '''
+    Returns a JSON-serializable dict with the stats of every stage, in the order
+    the stages first finished, and the peak resident set size of the whole run
+    '''
+    return {
+        "stages": dict(_report or {}),
+        "peak_rss_bytes": peak_rss(),
+        "trace_memory": _trace_memory,
+    }
+
+def write_report(file_name):
+    with open(file_name, "w") as out:
+        json.dump(report(), out, indent=2)
@@ -1,11 +1,14 @@
 import sys
-import os
-from random import randrange
 import patient_splitter
 import rule_based_classifier
-import ml_classifier
-import annotation_matcher
-import record as record_module
+import instrumentation
+import prediction_cache
+import classification
+import feature_store
+import cross_validation
+import concept_extractors
+from pipeline import Pipeline, compare_profiles
+from config import MODEL_PROFILE, BOOTSTRAP_RESAMPLES, CROSS_VALIDATION_FOLDS
 
 '''
 Breast and Lung Cancer Grading Pipeline
@@ -14,325 +17,333 @@ Breast and Lung Cancer Grading Pipeline
 
 Contains the top-level code for classifying a records's histological grade.
 Makes calls to other more specific programs; manages and outputs what they return.
+The training and classification steps themselves are in pipeline.py, which
+can be imported without running anything.
 
 
 USAGE: python(3) main.py data_dir print-errors no-metamap full-results
+    profile-rules parallel retrain bootstrap model-profile fast
+    compare-profiles hashed prefilter prefilter-check perf-report
+    trace-memory feature-store cross-validate 5
 
 data_dir is the directory containing the data files.
 print-errors is an optional string. If it is present, error data will
     be printed to an "error_analysis.txt" file.
-no-metamap is an optional string. If it is present, MetaMap Lite will
-    not be used.
+no-metamap is an optional string. If it is present, MetaMap Lite (or the
+    concept extractor set by CONCEPT_BACKEND in config.py) will not be used.
 full-results is an optional string. If it is present, the program will
     print results for each module as well as combined results.
+profile-rules is an optional string. If it is present, per-rule counts and
+    timings for the rule-based classifier are written to "rule_profile.json".
+parallel is an optional string. If it is present, records are classified
+    on one process per CPU. The results are the same as without it.
+retrain is an optional string. If it is present, the ML classifier is
+    trained even if a model for the same training data has been saved.
+model-profile is optional, and must be followed by the name of a model
+    profile: "full" (the default, see MODEL_PROFILE in config.py) or "fast".
+compare-profiles is an optional string. If it is present, every model
+    profile is trained and tested, and their fit time, predict time and
+    accuracy on the test data are printed instead of the usual results.
+hashed is an optional string. If it is present, the ML classifier is a
+    linear model trained on hashed features a chunk of lines at a time
+    (see ml_classifier.train_hashed), instead of the voting ensemble.
+prefilter is an optional string. If it is present, only lines containing
+    words or numbers a grade could be written with are given to the ML
+    classifier (see rule_based_classifier.prefilter_rx).
+prefilter-check is an optional string. If it is present, the ML classifier
+    is also run over every test line, and the share of the lines it finds
+    a grade in that the prefilter keeps is printed to standard error.
+bootstrap is an optional string. If it is present, 95% confidence intervals
+    for every metric, from BOOTSTRAP_RESAMPLES (config.py) resamples of the
+    records, are printed after each set of results.
+perf-report is an optional string. If it is present, wall and CPU time,
+    throughput and peak memory for each stage of the run are written to
+    "performance_report.json".
+trace-memory is an optional string. If it is present with perf-report, the
+    report also lists the source lines holding the most memory after each
+    stage. This makes the run much slower.
+feature-store is an optional string. If it is present, vectorized lines are
+    saved to and loaded from the feature store in FEATURE_STORE_DIR
+    (config.py), so lines vectorized before aren't tokenized again. It is
+    kept under FEATURE_STORE_MAX_BYTES by removing the least recently used.
+cross-validate is optional, and may be followed by a number of folds
+    (default CROSS_VALIDATION_FOLDS in config.py). If it is present, the
+    training and test records are pooled and graded by patient-level k-fold
+    cross-validation, with the folds run in parallel, instead of the usual
+    train/test split. Each fold's accuracies and confusion matrix (and, with
+    full-results, the rule-based and ML matrices) are printed, then the
+    results of all the folds together. It can be combined with
+    model-profile and prefilter, but not with hashed.
 '''
 # Corrections for incorrectly-annotated records
 corrections = {'PAT7':[1], 'PAT14':[2], 'REC86':[1], 'PAT157':[1], 'REC720':[3], 'REC191':[1], 'REC798':[3]}
 
-data_dir = sys.argv[1]
-report_errors = "print-errors" in sys.argv
-if report_errors:
-    ea = open("error_analysis.txt", 'w')
-use_metamap = "no-metamap" not in sys.argv
-if use_metamap:
-    from config import METAMAP_DIR
-    if not os.path.exists(METAMAP_DIR):
-        print("MetaMap Lite installation not found. To use MetaMap Lite, install it and edit config.py. Running without MetaMap Lite.", file=sys.stderr)
-        use_metamap = False
-full_results = "full-results" in sys.argv
-
-# call patient_splitter to get a list of patient records
-train_records = patient_splitter.load_records(data_dir)
-test_records = patient_splitter.load_records(data_dir, test=True)
-
-# train the ML classifier
-# labels: 0 == no grade, 1 == has a grade
-positive_lines = []
-negative_lines = []
-for record in train_records:
-    grade_text = annotation_matcher.search_annotation(record.annotation, "Histologic Grade Text").split("~")
-    grades = []
-    for grade in grade_text:
-        if grade == "":
-            continue
-        if use_metamap:
-            umls = record_module.get_UMLS_tags(grade)
-            for term in umls:
-                grade += " " + term.tag
-                for concept in term.concepts:
-                    grade += " " + concept.concept
-        positive_lines.append(grade) # add metamap stuff here
-    for line in record.text.split("\n"):
-        if grade not in line:
-            negative_lines.append(line)
-# randomly cull the negative examples so that we have a 50:50 positive/negative split of training data
-culled_negatives = []
-used = set()
-while len(culled_negatives) < len(positive_lines):
-    r = randrange(0, len(negative_lines))
-    if negative_lines[r] not in used:
-        selected_line = negative_lines[r]
-        used.add(selected_line)
-        if use_metamap:
-            umls = record_module.get_UMLS_tags(selected_line)
-            for term in umls:
-                selected_line += " " + term.tag
-                for concept in term.concepts:
-                    selected_line += " " + concept.concept
-        culled_negatives.append(selected_line)
-training_lines = [(x, "1") for x in positive_lines] + [(x, "0") for x in culled_negatives]
-trained_objects = ml_classifier.train(training_lines)
-
-# classify each record
-# rb_* variables track results of rule-based classifier only
-# ml_* variables track results of machine learning classifier only
-# generic and combo_* variables track results of system as a whole
-seen = 0 # records processed
-should_have_class = 0 # records that should have nonzero class
-classified, rb_classified, ml_classified = 0, 0, 0 # records that were given nonzero class
-correct, rb_correct, ml_correct = 0, 0, 0 # records given the correct grade, including correctly giving zero class
-# accuracy matrices
-combo_matrix = [[0 for _ in range(5)] for _ in range(5)]
-rb_matrix = [[0 for _ in range(5)] for _ in range(5)]
-ml_matrix = [[0 for _ in range(5)] for _ in range(5)]
-# initialize variables for doing error analysis here
-if report_errors:
-    wrong_should_have_no_class = []
-    wrong_should_have_class = []
-    incorrect = []
-
-def reset_variables():
-    '''Resets all the results-tracking variables to initial state.'''
-    global seen, combo_matrix, rb_matrix, ml_matrix, should_have_class
-    global classified, rb_classified, ml_classified, correct, rb_correct, ml_correct
-    global wrong_should_have_class, wrong_should_have_no_class, incorrect, len_mismatches
-    seen = 0 # records processed
-    should_have_class = 0 # records that should have nonzero class
-    classified, rb_classified, ml_classified = 0, 0, 0 # records that were given nonzero class
-    correct, rb_correct, ml_correct = 0, 0, 0 # records given the correct grade, including correctly giving zero class
-    # accuracy matrices
-    combo_matrix = [[0 for _ in range(5)] for _ in range(5)]
-    rb_matrix = [[0 for _ in range(5)] for _ in range(5)]
-    ml_matrix = [[0 for _ in range(5)] for _ in range(5)]
-    # variables for doing error analysis
-    if report_errors:
-        wrong_should_have_no_class = []
-        wrong_should_have_class = []
-        incorrect = []
-
-def classify(records_list):
-    '''Classifies all the records in the given list of records.'''
-    global seen, combo_matrix, rb_matrix, ml_matrix, should_have_class
-    global classified, rb_classified, ml_classified, correct, rb_correct, ml_correct
-    global wrong_should_have_class, wrong_should_have_no_class, incorrect
-    for record in records_list:
-        gold = record.gold
-        rb_grade = rule_based_classifier.classify_record(record.text, 2)
-            # Options for dealing with "differentiation" strings
-            # 0: Skip differentiation search
-            # 1: Return max diff, if there's more than one
-            # 2: skip "poorly differentiated"
-        ml_lines = record.text.split("\n")
-        ml_grade = ml_classifier.test(trained_objects, ml_lines)
-        for i in range(len(ml_grade) - 1, -1, -1):
-            if ml_grade[i] == "0":
-                del ml_lines[i]
-        # extract the specific grade from the lines
-        ml_grade = [rule_based_classifier.classify_string(x) for x in ml_lines]
-        # get best combined grade
-        combo_grades = rb_grade + ml_grade
-        counts = {0:0, 1:0, 2:0, 3:0, 4:0}
-        rb_counts = {0:0, 1:0, 2:0, 3:0, 4:0}
-        ml_counts = {0:0, 1:0, 2:0, 3:0, 4:0}
-        for grade in combo_grades:
-            counts[grade] += 1
-        for grade in rb_grade:
-            rb_counts[grade] += 1
-        for grade in ml_grade:
-            ml_counts[grade] += 1
-        counts = sorted(counts.items(), key=lambda x: x[1], reverse=True)
-        rb_counts = sorted(rb_counts.items(), key=lambda x: x[1], reverse=True)
-        ml_counts = sorted(ml_counts.items(), key=lambda x: x[1], reverse=True)
-        if counts == []:
-            best_grade = 0
-        else:
-            if counts[0][1] == counts[1][1]:
-                best_grade = max(counts[0][0], counts[1][0])
-            else:
-                best_grade = counts[0][0]
-        if rb_counts == []:
-            rb_best_grade = 0
-        else:
-            if rb_counts[0][1] == rb_counts[1][1]:
-                rb_best_grade = max(rb_counts[0][0], rb_counts[1][0])
-            else:
-                rb_best_grade = rb_counts[0][0]
-        if ml_counts == []:
-            ml_best_grade = 0
-        else:
-            if ml_counts[0][1] == ml_counts[1][1]:
-                ml_best_grade = max(ml_counts[0][0], ml_counts[1][0])
-            else:
-                ml_best_grade = ml_counts[0][0]
-        best_gold = max(gold) if gold != [] else 0
-        # account for grade 9 being used for unknown grade in one annotation
-        if best_gold == 9:
-            best_gold = 0
-        # count for accuracy
-        seen += 1
-        combo_matrix[best_grade][best_gold] += 1
-        rb_matrix[rb_best_grade][best_gold] += 1
-        ml_matrix[ml_best_grade][best_gold] += 1
-        if gold != []:
-            should_have_class += 1
-
-        # update variables for doing error analysis
-        if report_errors:
-            pos_grades = [x for x in rb_grade if x != 0]
-            rec_file = record.file.split(os.sep)[-1]
-            if best_grade != best_gold and best_gold != 0 and best_grade != 0:
-                incorrect.append((rec_file + "/" + record.rid, best_grade, best_gold))
-            if best_grade == 0 and best_gold != 0:
-                wrong_should_have_class.append((rec_file + "/" + record.rid, best_gold))
-            if best_gold == 0 and best_grade != 0:
-                wrong_should_have_no_class.append((rec_file + "/" + record.rid, best_grade))
+def show(value):
+    return "N/A" if value is None else str(value)
 
 # output accuracy data
-def print_results(matrix):
-    binary_true_positive = matrix[1][1] + matrix[1][2] + matrix[1][3] + matrix[1][4] + matrix[2][1] + matrix[2][2] + matrix[2][3] + matrix[2][4]
-    binary_true_positive += matrix[3][1] + matrix[3][2] + matrix[3][3] + matrix[3][4] + matrix[4][1] + matrix[4][2] + matrix[4][3] + matrix[4][4]
-    binary_false_positive = matrix[1][0] + matrix[2][0] + matrix[3][0] + matrix[4][0]
-    binary_true_negative = matrix[0][0]
-    binary_false_negative = matrix[0][1] + matrix[0][2] + matrix[0][3] + matrix[0][4]
-
-    print("Records processed: " + str(seen))
-    print("Records which should not have a grade given:" + str(seen - should_have_class))
-    print("Records which should have a grade given: "+ str(should_have_class))
+def print_results(result, matrix):
+    '''Prints the counts and metrics of one metrics.ConfusionMatrix'''
+    binary_true_positive, binary_false_positive, binary_true_negative, binary_false_negative = matrix.binary()
+    scores = matrix.metrics(positives=result.should_have_class)
+
+    print("Records processed: " + str(result.seen))
+    print("Records which should not have a grade given:" + str(result.seen - result.should_have_class))
+    print("Records which should have a grade given: "+ str(result.should_have_class))
     print("Records not given a grade: " + str(binary_true_negative + binary_false_negative))
     print("Records given a grade: " + str(binary_false_positive + binary_true_positive))
-    print("Binary accuracy: " + str((binary_true_positive + binary_true_negative) / seen))
-    binary_precision = binary_true_positive / (binary_true_positive + binary_false_positive)
-    binary_recall = binary_true_positive / should_have_class
-    print("Binary precision: " + str(binary_precision))
-    print("Binary recall: " + str(binary_recall))
-    print("Binary F1-Score: " + str(((binary_precision * binary_recall) / (binary_precision + binary_recall)) * 2))
-    print("Binary specificity: " + str(binary_true_negative / (binary_true_negative + binary_false_positive)))
-    try:
-        print("Binary NPV: " + str(binary_true_negative / (binary_true_negative + binary_false_negative)))
-    except ZeroDivisionError as e:
+    print("Binary accuracy: " + show(scores["binary_accuracy"]))
+    print("Binary precision: " + show(scores["binary_precision"]))
+    print("Binary recall: " + show(scores["binary_recall"]))
+    print("Binary F1-Score: " + show(scores["binary_f1"]))
+    print("Binary specificity: " + show(scores["binary_specificity"]))
+    if scores["binary_npv"] is not None:
+        print("Binary NPV: " + str(scores["binary_npv"]))
+    else:
         print("Binary NPV: N/A (no records given negative classification)")
     print()
+    print_matrix(matrix)
+    print()
+    print("Specific accuracy:" + show(scores["specific_accuracy"]))
+    print("Specific accuracy excluding negatives:" + show(scores["specific_accuracy_excluding_negatives"]))
+    print("Specific accuracy over records that we gave a grade: " + show(scores["specific_accuracy_given_label"]))
+
+def print_matrix(matrix):
+    '''Prints the counts of one metrics.ConfusionMatrix'''
     print("Confusion matrix")
     print("Assigned grade on the left, gold grade along the top")
     print("0 = no grade")
     print()
-    print("  | 0\t1\t2\t3\t4")
+    print("  | " + "\t".join(str(label) for label in matrix.labels))
     print("--+-----------------------------------")
-    for i in range(len(matrix)):
-        print(str(i) + " | ", end='')
-        for j in range(len(matrix[i])):
-            print(str(matrix[i][j]) + "\t", end='')
-        print()
+    for i, label in enumerate(matrix.labels):
+        print(str(label) + " | " + "".join(str(count) + "\t" for count in matrix.counts[i]))
+
+def print_intervals(result, matrix, resamples):
+    '''
+    Prints bootstrap confidence intervals for the metrics of one metrics.ConfusionMatrix,
+    with the same recall denominators as print_results
+    '''
+    print()
+    print("95% bootstrap confidence intervals (" + str(resamples) + " resamples of the records)")
+    for name, (low, high) in matrix.bootstrap(resamples, positive=result.has_gold).items():
+        print(name + ": " + ("N/A" if low is None else "%.4f - %.4f" % (low, high)))
+
+def print_per_label(matrix):
+    '''Prints precision, recall and F1 for each grade of one metrics.ConfusionMatrix'''
     print()
-    print("Specific accuracy:" + str((matrix[0][0] + matrix[1][1] + matrix[2][2] + matrix[3][3] + matrix[4][4]) / seen))
-    print("Specific accuracy excluding negatives:" + str((matrix[1][1] + matrix[2][2] + matrix[3][3] + matrix[4][4]) / should_have_class))
-    print("Specific accuracy over records that we gave a grade: " + str((matrix[1][1] + matrix[2][2] + matrix[3][3] + matrix[4][4]) / (binary_true_positive + binary_false_positive)))
+    print("Per-grade results (each grade against all the others)")
+    print("grade\tprecision\trecall\tF1\tsupport")
+    for label, scores in matrix.per_label().items():
+        print("%s\t%s\t%s\t%s\t%d" % (label, show(scores["precision"]), show(scores["recall"]), show(scores["f1"]), scores["support"]))
 
-def write_errors():
+def write_errors(ea, result):
     '''Writes data for doing error analysis.'''
-    ea.write("Records processed: " + str(seen) + "\n\n")
+    ea.write("Records processed: " + str(result.seen) + "\n\n")
     
-    ea.write("Records that should be unclassified but were given a class: " + str(len(wrong_should_have_no_class)) + "\n")
+    ea.write("Records that should be unclassified but were given a class: " + str(len(result.wrong_should_have_no_class)) + "\n")
     ea.write("Format: record, grade given\n")
-    ea.write("\n".join([x[0] + ", " + str(x[1]) for x in wrong_should_have_no_class]) + "\n\n")
+    ea.write("\n".join([x[0] + ", " + str(x[1]) for x in result.wrong_should_have_no_class]) + "\n\n")
 
-    ea.write("Records that were given the wrong class: " + str(len(incorrect)) + "\n")
+    ea.write("Records that were given the wrong class: " + str(len(result.incorrect)) + "\n")
     ea.write("Format: record, given label, gold label\n")
-    ea.write("\n".join(map(lambda x: x[0] + ", " + str(x[1]) + ", " + str(x[2]), incorrect)) + "\n\n")
+    ea.write("\n".join(map(lambda x: x[0] + ", " + str(x[1]) + ", " + str(x[2]), result.incorrect)) + "\n\n")
 
-    ea.write("Records that should be classified but were not given a class: " + str(len(wrong_should_have_class)) + "\n")
+    ea.write("Records that should be classified but were not given a class: " + str(len(result.wrong_should_have_class)) + "\n")
     ea.write("Format: record, gold label\n")
-    ea.write("\n".join([x[0] + ", " + str(x[1]) for x in wrong_should_have_class]) + "\n\n")
-
-# test on training data
-classify(train_records)
-
-# print training results
-print("Results on training data")
-print("-------------------------------------------------")
-# print combined results
-print("Combined")
-print("---------")
-print_results(combo_matrix)
-if report_errors:
-    ea.write("Training data errors\n")
-    ea.write("-------------------------------------------------\n")
-    ea.write("Combined\n")
-    ea.write("---------\n")
-    write_errors()
-
-if full_results:
-    # print rule-based results
-    print()
-    print()
-    print("Rule-based Only")
-    print("----------------")
-    print_results(rb_matrix)
-    if report_errors:
-        ea.write("Rule-based only\n")
-        ea.write("----------------\n")
-        write_errors()
-
-    # print machine learning results
-    print()
-    print()
-    print("Machine Learning Only")
-    print("----------------------")
-    print_results(ml_matrix)
-    if report_errors:
-        ea.write("Machine Learning only\n")
-        ea.write("----------------------\n")
-        write_errors()
-
-# test on test data
-reset_variables()
-classify(test_records)
-
-# print test results
-print()
-print()
-print("Results on test data")
-print("-------------------------------------------------")
-# print combined results
-print("Combined")
-print("---------")
-print_results(combo_matrix)
-if report_errors:
-    ea.write("Test data errors\n")
-    ea.write("-------------------------------------------------\n")
-    ea.write("Combined\n")
-    ea.write("---------\n")
-    write_errors()
-
-if full_results:
-    # print rule-based results
-    print()
-    print()
-    print("Rule-based Only")
-    print("----------------")
-    print_results(rb_matrix)
-    if report_errors:
-        ea.write("Rule-based only\n")
-        ea.write("----------------\n")
-        write_errors()
-
-    # print machine learning results
+    ea.write("\n".join([x[0] + ", " + str(x[1]) for x in result.wrong_should_have_class]) + "\n\n")
+
+def report(result, data_name, full_results, ea=None, resamples=0):
+    '''
+    Prints the results of one classification pass, and writes its errors if ea
+    (the error analysis file) is given. data_name is "training" or "test".
+    If resamples is set, bootstrap confidence intervals are printed too.
+    '''
+    print("Results on " + data_name + " data")
+    print("-------------------------------------------------")
+    # print combined results
+    print("Combined")
+    print("---------")
+    print_results(result, result.combo_matrix)
+    if resamples:
+        print_intervals(result, result.combo_matrix, resamples)
+    if full_results:
+        print_per_label(result.combo_matrix)
+    if ea is not None:
+        ea.write(data_name.capitalize() + " data errors\n")
+        ea.write("-------------------------------------------------\n")
+        ea.write("Combined\n")
+        ea.write("---------\n")
+        write_errors(ea, result)
+
+    if full_results:
+        # print rule-based results
+        print()
+        print()
+        print("Rule-based Only")
+        print("----------------")
+        print_results(result, result.rb_matrix)
+        if resamples:
+            print_intervals(result, result.rb_matrix, resamples)
+        print_per_label(result.rb_matrix)
+        if ea is not None:
+            ea.write("Rule-based only\n")
+            ea.write("----------------\n")
+            write_errors(ea, result)
+
+        # print machine learning results
+        print()
+        print()
+        print("Machine Learning Only")
+        print("----------------------")
+        print_results(result, result.ml_matrix)
+        if resamples:
+            print_intervals(result, result.ml_matrix, resamples)
+        print_per_label(result.ml_matrix)
+        if ea is not None:
+            ea.write("Machine Learning only\n")
+            ea.write("----------------------\n")
+            write_errors(ea, result)
+
+def print_profile_comparison(comparison):
+    print("Model profiles on test data")
+    print("-------------------------------------------------")
+    print("profile\tfit (s)\tpredict (s)\tms/line\taccuracy\tML-only accuracy")
+    for profile, stats in comparison.items():
+        print("%s\t%.3f\t%.3f\t%.4f\t%.4f\t%.4f" % (profile, stats["fit_seconds"], stats["predict_seconds"],
+                                                   stats["predict_ms_per_line"], stats["accuracy"], stats["ml_accuracy"]))
+
+def print_folds(folds, full_results):
+    print("Cross-validation folds")
+    print("-------------------------------------------------")
+    print("fold\ttrain\ttest\tseconds\taccuracy\trule-based accuracy\tML-only accuracy")
+    for i, fold in enumerate(folds):
+        result = fold["result"]
+        print("%d\t%d\t%d\t%.3f\t%s\t%s\t%s" % (i + 1, fold["train_records"], fold["test_records"], fold["seconds"],
+                                             show(result.combo_matrix.metrics()["specific_accuracy"]),
+                                             show(result.rb_matrix.metrics()["specific_accuracy"]),
+                                             show(result.ml_matrix.metrics()["specific_accuracy"])))
+    for i, fold in enumerate(folds):
+        result = fold["result"]
+        matrices = [("Combined", result.combo_matrix)]
+        if full_results:
+            matrices += [("Rule-based Only", result.rb_matrix), ("Machine Learning Only", result.ml_matrix)]
+        for name, matrix in matrices:
+            print()
+            print("Fold %d, %s" % (i + 1, name))
+            print("-------------------------------------------------")
+            print_matrix(matrix)
+
+def count_lines(records_list):
+    return sum(record.text.count("\n") + 1 for record in records_list)
+
+def main():
+    data_dir = sys.argv[1]
+    if "cross-validate" in sys.argv and "hashed" in sys.argv:
+        sys.exit("cross-validate can't be used with hashed: the folds share one CountVectorizer, "
+                 "so they can only train the model-profile ensembles")
+    report_errors = "print-errors" in sys.argv
+    ea = open("error_analysis.txt", 'w') if report_errors else None
+    use_metamap = "no-metamap" not in sys.argv
+    if use_metamap and not concept_extractors.get_extractor().available():
+        print(concept_extractors.get_extractor().missing + " Running without concept tags.", file=sys.stderr)
+        use_metamap = False
+    full_results = "full-results" in sys.argv
+    profile_rules = "profile-rules" in sys.argv
+    parallel = "parallel" in sys.argv
+    retrain = "retrain" in sys.argv
+    prefilter = "prefilter" in sys.argv
+    hashed = "hashed" in sys.argv
+    profile = MODEL_PROFILE
+    if "model-profile" in sys.argv:
+        profile = sys.argv[sys.argv.index("model-profile") + 1]
+    perf_report = "perf-report" in sys.argv
+    resamples = BOOTSTRAP_RESAMPLES if "bootstrap" in sys.argv else 0
+    if "feature-store" in sys.argv:
+        feature_store.enable()
+    if perf_report:
+        instrumentation.enable(trace_memory="trace-memory" in sys.argv)
+
+    # call patient_splitter to get a list of patient records
+    with instrumentation.stage("load_train") as counts:
+        train_records = patient_splitter.load_records(data_dir)
+        counts.records = len(train_records)
+    with instrumentation.stage("load_test") as counts:
+        test_records = patient_splitter.load_records(data_dir, test=True)
+        counts.records = len(test_records)
+
+    if "cross-validate" in sys.argv:
+        i = sys.argv.index("cross-validate")
+        k = int(sys.argv[i + 1]) if i + 1 < len(sys.argv) and sys.argv[i + 1].isdigit() else CROSS_VALIDATION_FOLDS
+        with instrumentation.stage("cross_validate") as counts:
+            folds, result = cross_validation.cross_validate(train_records + test_records, k, use_metamap, profile=profile,
+                                                            prefilter=prefilter)
+            counts.records = len(train_records) + len(test_records)
+        print_folds(folds, full_results)
+        print()
+        print()
+        report(result, "cross-validation", full_results, ea, resamples)
+        if perf_report:
+            instrumentation.write_report("performance_report.json")
+        if ea is not None:
+            ea.close()
+        return
+
+    if "compare-profiles" in sys.argv:
+        with instrumentation.stage("compare_profiles") as counts:
+            comparison = compare_profiles(train_records, test_records, use_metamap=use_metamap)
+            counts.records = len(train_records) + len(test_records)
+        print_profile_comparison(comparison)
+        if perf_report:
+            instrumentation.write_report("performance_report.json")
+        if ea is not None:
+            ea.close()
+        return
+
+    # train the ML classifier, or load the model saved for this training data
+    with instrumentation.stage("fit") as counts:
+        pipeline = Pipeline(use_metamap, prefilter=prefilter, hashed=hashed, profile=profile).fit(train_records, retrain)
+        counts.records = len(train_records)
+
+    # test on training data
+    if profile_rules:
+        rule_based_classifier.enable_profiling()
+    with instrumentation.stage("classify_train") as counts:
+        result = pipeline.evaluate(train_records, parallel)
+        counts.records = len(train_records)
+        counts.lines = count_lines(train_records)
+    report(result, "training", full_results, ea, resamples)
+
+    # test on test data
+    with instrumentation.stage("classify_test") as counts:
+        result = pipeline.evaluate(test_records, parallel)
+        counts.records = len(test_records)
+        counts.lines = count_lines(test_records)
     print()
     print()
-    print("Machine Learning Only")
-    print("----------------------")
-    print_results(ml_matrix)
-    if report_errors:
-        ea.write("Machine Learning only\n")
-        ea.write("----------------------\n")
-        write_errors()
+    report(result, "test", full_results, ea, resamples)
+
+    if prediction_cache.get_cache() is not None:
+        cache_stats = prediction_cache.get_cache().stats()
+        print("Prediction cache: %d hits, %d misses, %d entries" % (cache_stats["hits"], cache_stats["misses"], cache_stats["entries"]), file=sys.stderr)
+    if feature_store.get_store() is not None:
+        store_stats = feature_store.get_store().stats()
+        print("Feature store: %d hits, %d misses" % (store_stats["hits"], store_stats["misses"]), file=sys.stderr)
+    stats = classification.line_stats()
+    print("Line dedup: %d lines, %d distinct (%.2fx); classify_string memo: %d hits, %d misses"
+          % (stats["lines"], stats["distinct"], stats["dedup_ratio"], stats["memo_hits"], stats["memo_misses"]), file=sys.stderr)
+
+    if "prefilter-check" in sys.argv:
+        check = pipeline.prefilter_recall(test_records)
+        print("Prefilter: kept %d of %d test lines; %d of %d lines with an ML grade missed (recall %.4f)"
+              % (check["candidates"], check["lines"], check["missed"], check["ml_positive"], check["recall"]), file=sys.stderr)
+
+    if profile_rules:
+        rule_based_classifier.write_profile_report("rule_profile.json")
+    if perf_report:
+        instrumentation.write_report("performance_report.json")
+    if ea is not None:
+        ea.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""
+Pool of long-running MetaMap Lite workers
+
+Starting MetaMap Lite means starting a JVM and loading its indexes, which
+takes seconds. The pool keeps METAMAP_POOL_SIZE "--pipe" processes up for
+the whole run and hands each string to whichever worker is free.
+
+Each string is written to a worker as one line (newlines are replaced by
+spaces, so character offsets don't change) followed by a blank line, and
+the BRAT output for it is read back up to the next blank line. MetaMap Lite
+may print nothing at all, not even the blank line, for a string without
+terms, so SENTINEL (a term it always finds) is added to the end of each
+string and its annotations are dropped from the output.
+"""
+import atexit
+import queue
+import re
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from subprocess import Popen, PIPE, DEVNULL
+from config import METAMAP_DIR, METAMAP_POOL_SIZE, METAMAP_TIMEOUT
+
+
+# Added after each string sent to a worker, so its output is never empty. The full stop
+# keeps it from joining a term at the end of the string
+SENTINEL = " . carcinoma"
+
+# A BRAT term line: T<number>, then its type, start and end offsets
+TERM_RX = re.compile(rb"T[0-9]+")
+
+
+class MetaMapWorkerError(Exception):
+    pass
+
+
+def drop_terms_after(output, length):
+    """
+    Removes the terms ending after the given offset, and their concept lines, from BRAT output
+
+    :param output: BRAT format output, as bytes
+    :param length: length of the string the output is for
+    :return: the output without the terms found in what was added after the string
+    """
+    kept = []
+    keep = True
+    for line in output.splitlines(True):
+        if TERM_RX.match(line):
+            keep = int(line.split()[3]) <= length
+        if keep:
+            kept.append(line)
+    return b"".join(kept)
+
+
+def metamap_command():
+    """
+    Builds the command line used to start MetaMap Lite in pipe mode
+
+    :return: the argument list and whether it has to be run through the shell
+    """
+    if "win" in sys.platform:
+        metamap_path = METAMAP_DIR + r"/metamaplite.bat"
+        shell = True
+    else:
+        metamap_path = METAMAP_DIR + r"/metamaplite.sh"
+        shell = False
+    args = [metamap_path, "--pipe",
+            "--indexdir=" + METAMAP_DIR + r"/data/ivf/strict",
+            "--modelsdir=" + METAMAP_DIR + "/data/models",
+            "--specialtermsfile=" + METAMAP_DIR + "/data/specialterms.txt",
+            "--brat"]
+    return args, shell
+
+
+class MetaMapWorker:
+
+    def __init__(self):
+        """
+        One MetaMap Lite process. It is started on first use and restarted if it dies.
+        """
+        self.process = None
+        self.lines = None
+
+    def start(self):
+        args, shell = metamap_command()
+        self.process = Popen(args, stdin=PIPE, stdout=PIPE, stderr=DEVNULL, shell=shell)
+        self.lines = queue.Queue()
+        reader = threading.Thread(target=self._read, args=(self.process.stdout, self.lines))
+        reader.daemon = True
+        reader.start()
+
+    @staticmethod
+    def _read(stdout, lines):
+        # None marks the end of the output, i.e. the process exited
+        for line in iter(stdout.readline, b""):
+            lines.put(line)
+        lines.put(None)
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def tag(self, text, timeout):
+        """
+        Sends one string to the worker and waits for its annotations
+
+        :param text: text to annotate
+        :param timeout: seconds to wait for each line of output
+        :return: BRAT format output for the text, as bytes
+        """
+        document = text.replace("\r", " ").replace("\n", " ")
+        if document.strip() == "":
+            # a blank line would be read as the end of the document, so don't send it at all
+            return b""
+        if not self.alive():
+            self.start()
+        try:
+            self.process.stdin.write((document + SENTINEL).encode() + b"\n\n")
+            self.process.stdin.flush()
+        except OSError as e:
+            raise MetaMapWorkerError("MetaMap Lite worker stopped accepting input") from e
+        output = []
+        while True:
+            try:
+                line = self.lines.get(timeout=timeout)
+            except queue.Empty:
+                raise MetaMapWorkerError("MetaMap Lite worker timed out")
+            if line is None:
+                raise MetaMapWorkerError("MetaMap Lite worker exited")
+            if line.strip() == b"":
+                return drop_terms_after(b"".join(output), len(document))
+            output.append(line)
+
+    def stop(self, timeout=10):
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout)
+        except Exception:
+            self.process.kill()
+            self.process.wait()
+        self.process = None
+
+    def restart(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.wait()
+            self.process = None
+        self.start()
+
+
+class MetaMapPool:
+
+    def __init__(self, size=METAMAP_POOL_SIZE, timeout=METAMAP_TIMEOUT):
+        """
+        A fixed number of MetaMap Lite workers shared by all callers
+
+        :param size: number of worker processes
+        :param timeout: seconds to wait for a worker's output before restarting it
+        """
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.workers = [MetaMapWorker() for _ in range(self.size)]
+        self.idle = queue.Queue()
+        for worker in self.workers:
+            self.idle.put(worker)
+
+    def tag(self, text):
+        """
+        Runs MetaMap Lite over a string on the next free worker.
+        A worker that crashes or hangs is restarted and the string is tried once more.
+
+        :param text: text to annotate
+        :return: BRAT format output for the text, as bytes
+        """
+        worker = self.idle.get()
+        try:
+            try:
+                return worker.tag(text, self.timeout)
+            except MetaMapWorkerError as e:
+                sys.stderr.write(str(e) + ", restarting it\n")
+                worker.restart()
+                return worker.tag(text, self.timeout)
+        finally:
+            self.idle.put(worker)
+
+    def map(self, texts):
+        """
+        Runs MetaMap Lite over many strings, spread across all the workers
+
+        :param texts: list of strings
+        :return: BRAT output for each string, in the same order
+        """
+        with ThreadPoolExecutor(self.size) as executor:
+            return list(executor.map(self.tag, texts))
+
+    def close(self):
+        for worker in self.workers:
+            worker.stop()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    Returns the process-wide pool, creating it on first use.
+    The pool is shut down automatically when the interpreter exits.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = MetaMapPool()
+            atexit.register(shutdown_pool)
+        return _pool
+
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
@@ -0,0 +1,179 @@
+import numpy as np
+
+'''
+Confusion matrix accumulator and the evaluation metrics computed from it.
+
+A ConfusionMatrix counts (assigned label, gold label) pairs for any list of
+labels, the first of which is the negative ("no grade") label by default.
+Counts are kept in a numpy array indexed [assigned][gold], so matrix[i][j]
+still reads like the old 5x5 lists, and matrices built from different
+chunks, workers or shards can be merged. Every record's pair is also kept,
+as one small integer, so metrics can be bootstrapped over records.
+
+All metrics are computed on stacks of matrices at once (batch_metrics), so
+a bootstrap over thousands of resamples needs no Python loop per record or
+per resample.
+'''
+
+# Metrics batch_metrics computes, in the order they are reported
+METRICS = ["binary_accuracy", "binary_precision", "binary_recall", "binary_f1", "binary_specificity", "binary_npv",
+           "specific_accuracy", "specific_accuracy_excluding_negatives", "specific_accuracy_given_label"]
+
+def ratio(numerator, denominator):
+    ''' Elementwise numerator / denominator, with nan where the denominator is 0 '''
+    numerator = np.asarray(numerator, dtype=float)
+    denominator = np.asarray(denominator, dtype=float)
+    out = np.full(np.broadcast(numerator, denominator).shape, np.nan)
+    return np.divide(numerator, denominator, out=out, where=denominator != 0)
+
+def binary_counts(counts, negative=0):
+    '''
+    Collapses a stack of matrices (..., n, n) indexed [assigned][gold] to binary counts,
+    where every label except the negative one counts as positive.
+    Returns (true positives, false positives, true negatives, false negatives) arrays.
+    '''
+    total = counts.sum(axis=(-2, -1))
+    assigned_negative = counts[..., negative, :].sum(axis=-1)
+    gold_negative = counts[..., :, negative].sum(axis=-1)
+    tn = counts[..., negative, negative]
+    fn = assigned_negative - tn
+    fp = gold_negative - tn
+    tp = total - tn - fn - fp
+    return tp, fp, tn, fn
+
+def batch_metrics(counts, negative=0, positives=None):
+    '''
+    Computes every metric in METRICS for a stack of matrices (..., n, n) indexed [assigned][gold].
+    positives is the number of records that should have a non-negative label, for the recall
+        denominators; it defaults to the gold positive counts of each matrix.
+    Returns {metric: array over the stack}, with nan where a metric is undefined.
+    '''
+    counts = np.asarray(counts)
+    tp, fp, tn, fn = binary_counts(counts, negative)
+    total = counts.sum(axis=(-2, -1))
+    diagonal = np.trace(counts, axis1=-2, axis2=-1)
+    if positives is None:
+        positives = tp + fn
+    precision = ratio(tp, tp + fp)
+    recall = ratio(tp, positives)
+    return {
+        "binary_accuracy": ratio(tp + tn, total),
+        "binary_precision": precision,
+        "binary_recall": recall,
+        "binary_f1": ratio(precision * recall, precision + recall) * 2,
+        "binary_specificity": ratio(tn, tn + fp),
+        "binary_npv": ratio(tn, tn + fn),
+        "specific_accuracy": ratio(diagonal, total),
+        "specific_accuracy_excluding_negatives": ratio(diagonal - tn, positives),
+        "specific_accuracy_given_label": ratio(diagonal - tn, tp + fp),
+    }
+
+def number(value):
+    ''' Converts a 0-d metric to a float, or None if it's undefined '''
+    value = float(value)
+    return None if np.isnan(value) else value
+
+class ConfusionMatrix:
+    '''
+    Counts of (assigned label, gold label) pairs, indexed [assigned][gold].
+    '''
+    def __init__(self, labels=(0, 1, 2, 3, 4), negative=None):
+        self.labels = list(labels)
+        self.index = {label: i for i, label in enumerate(self.labels)}
+        self.negative = 0 if negative is None else self.index[negative] # index of the negative label
+        self.counts = np.zeros((len(self.labels), len(self.labels)), dtype=np.int64)
+        self.pairs = [] # assigned index * len(labels) + gold index, for each record in order
+
+    def __getitem__(self, assigned):
+        return self.counts[assigned]
+
+    def __len__(self):
+        return len(self.labels)
+
+    @property
+    def seen(self):
+        return len(self.pairs)
+
+    def add(self, assigned, gold):
+        ''' Counts one record. Labels must be in the label list '''
+        i, j = self.index[assigned], self.index[gold]
+        self.counts[i, j] += 1
+        self.pairs.append(i * len(self.labels) + j)
+
+    def add_many(self, assigned, gold):
+        ''' Counts many records at once, given their assigned and gold labels in order '''
+        codes = np.array([self.index[a] * len(self.labels) + self.index[g] for a, g in zip(assigned, gold)], dtype=np.int64)
+        self.counts += np.bincount(codes, minlength=len(self.labels) ** 2).reshape(self.counts.shape)
+        self.pairs.extend(codes.tolist())
+
+    def merge(self, other):
+        ''' Adds another matrix's counts (over the same labels) to this one. Records are appended in order '''
+        if other.labels != self.labels:
+            raise ValueError("Can't merge confusion matrices over different labels: %s and %s" % (self.labels, other.labels))
+        self.counts += other.counts
+        self.pairs.extend(other.pairs)
+        return self
+
+    def binary(self):
+        ''' Returns (true positives, false positives, true negatives, false negatives) as ints '''
+        return tuple(int(x) for x in binary_counts(self.counts, self.negative))
+
+    def metrics(self, positives=None):
+        '''
+        Returns {metric: value} for every metric in METRICS, with None for undefined ones.
+        See batch_metrics for positives.
+        '''
+        return {name: number(value) for name, value in batch_metrics(self.counts, self.negative, positives).items()}
+
+    def per_label(self):
+        '''
+        Returns {label: {"precision", "recall", "f1", "support"}} for every label,
+        treating each label in turn as the positive class. Undefined values are None.
+        '''
+        diagonal = np.diag(self.counts)
+        precision = ratio(diagonal, self.counts.sum(axis=1))
+        recall = ratio(diagonal, self.counts.sum(axis=0))
+        f1 = ratio(2 * precision * recall, precision + recall)
+        support = self.counts.sum(axis=0)
+        return {label: {"precision": number(precision[i]), "recall": number(recall[i]),
+                        "f1": number(f1[i]), "support": int(support[i])}
+                for i, label in enumerate(self.labels)}
+
+    def bootstrap(self, resamples=2000, confidence=0.95, seed=0, block=500, positive=None):
+        '''
+        Bootstrap confidence intervals: resamples the records with replacement, recomputes
+        every metric on each resample, and takes percentiles. Resamples are drawn block at a
+        time, each block as one array, so memory stays at block * records integers.
+        positive is, for each record in order, whether it counts towards the positives of
+            metrics(positives=...); the positives of each resample are the resampled records
+            that do. By default they are the gold positive counts, as in batch_metrics.
+        Returns {metric: (low, high)}, with None for metrics undefined on too many resamples.
+        '''
+        n = len(self.labels)
+        pairs = np.array(self.pairs, dtype=np.int64)
+        if positive is not None:
+            positive = np.asarray(positive, dtype=np.int64)
+        if len(pairs) == 0:
+            return {name: (None, None) for name in METRICS}
+        rng = np.random.default_rng(seed)
+        values = {name: [] for name in METRICS}
+        for start in range(0, resamples, block):
+            size = min(block, resamples - start)
+            drawn = rng.integers(0, len(pairs), size=(size, len(pairs)))
+            sample = pairs[drawn]
+            # give each resample its own range of n * n bins so one bincount counts them all
+            sample += (np.arange(size) * n * n)[:, None]
+            counts = np.bincount(sample.ravel(), minlength=size * n * n).reshape(size, n, n)
+            positives = positive[drawn].sum(axis=1) if positive is not None else None
+            for name, value in batch_metrics(counts, self.negative, positives).items():
+                values[name].append(value)
+        intervals = {}
+        tail = (1 - confidence) / 2 * 100
+        for name in METRICS:
+            value = np.concatenate(values[name])
+            if np.isnan(value).mean() > 1 - confidence:
+                intervals[name] = (None, None)
+            else:
+                low, high = np.nanpercentile(value, [tail, 100 - tail])
+                intervals[name] = (float(low), float(high))
+        return intervals
@@ -1,9 +1,16 @@
-from sklearn.feature_extraction.text import CountVectorizer
+import os
+import pickle
+import hashlib
+from itertools import islice
+import sklearn
+from sklearn.feature_extraction.text import CountVectorizer, HashingVectorizer
 from sklearn.feature_selection import VarianceThreshold
 from sklearn.svm import SVC
-from sklearn.linear_model import LogisticRegression # MaxEnt
+from sklearn.linear_model import LogisticRegression, SGDClassifier # MaxEnt, and linear models that can be trained incrementally
 from sklearn.tree import DecisionTreeClassifier
 from sklearn.ensemble import RandomForestClassifier, VotingClassifier
+import feature_store
+from config import MODEL_DIR, HASHED_FEATURES, HASHED_CHUNK_SIZE, MODEL_PROFILE, ML_JOBS
 
 '''
 Eli Miller
@@ -16,27 +23,109 @@ To do:
 - incorporate the metamap UMLS information into the data
 - decide what classifier(s) to use - do some testing on dev data
 - implement a voting system if I decide to use an ensemble
+
+train_hashed is an alternative to train for training data too big for memory:
+features are hashed, so there is no vocabulary, and lines are read and fitted
+a chunk at a time. test works the same on either kind of model.
+
+train builds the classifier of a named profile (see PROFILES), fitting the
+members of an ensemble and the trees of a forest on n_jobs processes.
+
+While the feature store is on (see feature_store.py), lines are vectorized
+through it, so lines vectorized before are loaded instead of tokenized again.
 '''
 
-def train(text):
+# Labels the ML classifier uses: 0 == no grade, 1 == has a grade
+LABELS = ["0", "1"]
+
+def full_classifier(n_jobs):
+    '''The original hard-voting ensemble'''
+    return VotingClassifier(estimators=[('svm', SVC()), ('maxent', LogisticRegression()), ('rf', RandomForestClassifier(n_jobs=n_jobs)), ('dt', DecisionTreeClassifier())], n_jobs=n_jobs)
+
+def fast_classifier(n_jobs):
+    '''A single linear model: fit and predict time grow linearly with the data, unlike the kernel SVM'''
+    return LogisticRegression()
+
+# Model profiles: name -> function taking n_jobs and returning an unfitted classifier
+PROFILES = {"full": full_classifier, "fast": fast_classifier}
+
+def train(text, profile=MODEL_PROFILE, n_jobs=ML_JOBS):
     '''
     Takes a list of (string, label) tuples. The labels must be parsable as numbers;
         they cannot be words. Pre-convert any named labels before passing them to
         this method. Each tuple is one training instance. The string is used to
         create a bag of words feature vector.
+    profile names the classifier to train (see PROFILES).
     Returns a fitted vectorizer and a trained classifier.
-    Currently creates a multinominal naive bayes classifier.
     '''
     count_vect = CountVectorizer()
-    selector = VarianceThreshold()
     labels = [x[1] for x in text]
     lines = [x[0] for x in text]
-    train_counts = count_vect.fit_transform(lines)
-    train_counts = selector.fit_transform(train_counts, labels)
-    eclf = VotingClassifier(estimators=[('svm', SVC()), ('maxent', LogisticRegression()), ('rf', RandomForestClassifier()), ('dt', DecisionTreeClassifier())])
-    classifier = eclf.fit(train_counts, labels)
+    store = feature_store.get_store()
+    if store is None:
+        train_counts = count_vect.fit_transform(lines)
+    else:
+        count_vect, train_counts = store.fit_transform(count_vect, lines)
+    selector, classifier = fit_counts(train_counts, labels, profile, n_jobs)
     return [count_vect, classifier, selector]
 
+def fit_counts(counts, labels, profile=MODEL_PROFILE, n_jobs=ML_JOBS):
+    '''
+    Fits the feature selector and the classifier of a profile to training lines that
+        are already vectorized (a matrix with a row per line), as train does.
+    Returns the fitted selector and classifier.
+    '''
+    selector = VarianceThreshold()
+    counts = selector.fit_transform(counts, labels)
+    return selector, PROFILES[profile](n_jobs).fit(counts, labels)
+
+def set_jobs(trained_objects, n_jobs):
+    '''
+    Sets the number of processes a trained classifier, and each member of an
+        ensemble, uses to predict (e.g. 1 inside a worker process).
+    '''
+    classifier = trained_objects[1]
+    for estimator in [classifier] + list(getattr(classifier, "estimators_", [])):
+        if "n_jobs" in estimator.get_params(deep=False):
+            estimator.set_params(n_jobs=n_jobs)
+
+def vectorize(vectorizer, lines):
+    '''Vectorizes a list of strings with a fitted vectorizer, through the feature store if it's on.'''
+    store = feature_store.get_store()
+    if store is None:
+        return vectorizer.transform(lines)
+    return store.transform(vectorizer, lines)
+
+def chunks(iterable, size):
+    '''Yields lists of up to size items from the iterable, in order.'''
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+def train_hashed(text, trained_objects=None, chunk_size=HASHED_CHUNK_SIZE):
+    '''
+    Takes an iterable of (string, label) tuples, with labels from LABELS, and
+        trains a linear classifier on hashed bag of words features, reading
+        chunk_size tuples at a time. Only one chunk is in memory at once, and
+        the text can be a generator. Lines should come in random order, since
+        each chunk moves the model towards the lines in it.
+    Pass trained_objects returned by this method to keep training that model
+        on more data instead of starting over.
+    Returns a vectorizer and a trained classifier, like train. There is no
+        feature selector, since hashed features have no vocabulary to prune.
+    '''
+    if trained_objects is None:
+        vectorizer = HashingVectorizer(n_features=HASHED_FEATURES, alternate_sign=False, norm=None)
+        classifier = SGDClassifier(random_state=0)
+    else:
+        vectorizer, classifier = trained_objects[0], trained_objects[1]
+    for chunk in chunks(text, chunk_size):
+        counts = vectorize(vectorizer, [x[0] for x in chunk])
+        classifier.partial_fit(counts, [x[1] for x in chunk], classes=LABELS)
+    return [vectorizer, classifier, None]
+
 def test(trained_objects, text):
     '''
     Takes a trained classifier, a fitted vectorizer, and a list of strings to classify.
@@ -45,14 +134,89 @@ def test(trained_objects, text):
         converted back to strings after receiving the output of this method if you wish
         to have named labels.
     '''
-    count_vect = trained_objects[0]
+    return classify_counts(trained_objects, vectorize(trained_objects[0], text))
+
+def classify_counts(trained_objects, counts):
+    '''
+    Like test, for strings already vectorized with the trained vectorizer.
+    '''
     classifier = trained_objects[1]
     selector = trained_objects[2]
-    counts = count_vect.transform(text)
-    counts = selector.transform(counts)
+    if selector is not None:
+        counts = selector.transform(counts)
     pred = classifier.predict(counts)
     return list(pred)
 
+def test_batch(trained_objects, documents):
+    '''
+    Takes the trained objects and a list of documents, each of which is a list of strings.
+    Vectorizes and classifies every string of every document in a single pass, then
+        splits the classifications back up by document.
+    Returns a list containing the list of classifications for each document, in the
+        same order as the given documents.
+    '''
+    lines = sum(len(document) for document in documents)
+    store = feature_store.get_store()
+    if store is None or lines == 0:
+        offsets = feature_store.offsets_of(documents)
+        pred = test(trained_objects, [line for document in documents for line in document]) if lines > 0 else []
+    else:
+        counts, offsets = store.transform_documents(trained_objects[0], documents)
+        pred = classify_counts(trained_objects, counts)
+    return [pred[offsets[i]:offsets[i + 1]] for i in range(len(documents))]
+
+def model_path(key):
+    '''
+    Returns the file a model with the given fingerprint is saved to.
+    The scikit-learn version is part of the name, since pickled models can't be
+        shared between versions.
+    '''
+    return os.path.join(MODEL_DIR, key + "-sklearn" + sklearn.__version__ + ".pickle")
+
+def save_model(key, trained_objects):
+    '''
+    Saves the [vectorizer, classifier, selector] list returned by train under the
+        given fingerprint of its training data.
+    '''
+    os.makedirs(MODEL_DIR, exist_ok=True)
+    save_model_file(model_path(key), trained_objects)
+
+def save_model_file(path, trained_objects):
+    '''
+    Saves the trained objects to the given file. The file is replaced atomically,
+        so a reader never sees a partly written model.
+    '''
+    with open(path + ".tmp", "wb") as out:
+        pickle.dump(trained_objects, out, pickle.HIGHEST_PROTOCOL)
+    os.replace(path + ".tmp", path)
+
+def artifact_id(path):
+    '''
+    Returns a hash of a saved model file, identifying the exact model in it.
+    '''
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def load_model(key):
+    '''
+    Returns the trained objects saved under the given fingerprint, or None if
+        no model has been saved for it.
+    '''
+    path = model_path(key)
+    if not os.path.exists(path):
+        return None
+    return load_model_file(path)
+
+def load_model_file(path):
+    '''
+    Returns the trained objects saved in the given file.
+    '''
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
 if __name__ == "__main__":
     import sys
     text = [("presidents senators vote bill law", "1"), ("keyboard RAM memory CPU", "0")]
@@ -1,7 +1,9 @@
 import os
 import sys
 import re
-from collections import defaultdict
+import mmap
+import locale
+from contextlib import ExitStack
 from record import Record
 from annotation_matcher import get_annotation
 
@@ -11,6 +13,11 @@ Krista Watkins
 Feb 10
 
 This doesn't promise a particular order for the patients. Is there any reason we'd care?
+
+Records are read through memory maps of the data files. A first pass finds
+where each record starts and ends and what its ID is, one record at a time;
+stream_records then yields the records in order, decoding each one only when
+it is needed, so the whole corpus never has to be in memory at once.
 '''
 #rx_tagged_section = re.compile("<(\\w+)>(.+?)</\\1>", re.DOTALL)
 rx_patient_id = re.compile("<(PATIENT_DISPLAY_ID)>(.+?)</PATIENT_DISPLAY_ID>", re.DOTALL)
@@ -41,40 +48,83 @@ def get_record_id(record):
 
     sys.stderr.write("No Id Found for record: " + record[0:160]  + "\n")
 
-def get_records(file_list, test):
-    all_patients = []
+def get_patient_id(record):
+    '''
+    Returns the PATIENT_DISPLAY_ID of a record's text, or None if it has none.
+    Unlike get_record_id, this is the same for every record of a patient.
+    '''
+    patient_id_match = rx_patient_id.search(record)
+    if patient_id_match:
+        id = patient_id_match.group(2).strip("\n")
+        if id != "":
+            return id
+    return None
 
-    for file_name in file_list:
-        records = split_records(file_name)
+RECORD_MARKER = b"**PROTECTED[begin]"
+
+def decode(data):
+    '''
+    Decodes bytes read from a data file the way open() in text mode would
+    (default encoding, universal newlines)
+    '''
+    text = data.decode(locale.getpreferredencoding(False))
+    return text.replace("\r\n", "\n").replace("\r", "\n")
 
+def index_file(file_name, data):
+    '''
+    Finds the records in a memory-mapped data file.
+    Returns a list of (record id, [(start, end), ...]) in order of each ID's first
+    appearance. The spans are byte offsets of each part of the record (the text
+    after a "**PROTECTED[begin]" line up to the next one); records with the same
+    ID have several.
+    '''
+    file_records = {}
+    pos = data.find(RECORD_MARKER)
+    while pos != -1:
+        start = pos + len(RECORD_MARKER)
+        pos = data.find(RECORD_MARKER, start)
+        end = len(data) if pos == -1 else pos
         # Get Record ID. (May be PAT or REC)
-        file_records = defaultdict(str)
-        for record in records:
-            _id = get_record_id(record)
-            if _id in file_records:
-                sys.stderr.write("Duplicate record ID: " + _id + "\n")
-            file_records[_id] += record
-
-        # get the name of the annotations file corresponding to this record file
-        file_version = "train" if not test else "test"
-        file_id = "_".join(file_name.split(os.sep)[-1].split("_")[1:3])
-        annot_file_name = os.sep.join(file_name.split(os.sep)[:-2] + ["Annotations"] + ["annotations_" + file_id + "_" + file_version + ".json"])
-
-        for _id in file_records.keys():
-            record = Record(_id, file_records[_id], file_name, get_annotation(_id, annot_file_name))
-            all_patients.append(record)
-
-    # Array of all patient strings. May be multiple records for each patient
-    return sorted(all_patients, key=lambda r: int(r.rid[3:]))
-
-def split_records(file_name):
-    file = open(file_name)
-    text = file.read()
-    text = "DUMMY " + text
-    file.close()
-
-    records = text.split("**PROTECTED[begin]")
-    return records[1:] # The first record is "DUMMY " Don't return that one
+        _id = get_record_id(decode(data[start:end]))
+        if _id in file_records:
+            sys.stderr.write("Duplicate record ID: " + _id + "\n")
+            file_records[_id].append((start, end))
+        else:
+            file_records[_id] = [(start, end)]
+    return list(file_records.items())
+
+def annotation_file_name(file_name, test):
+    ''' Returns the name of the annotations file corresponding to a record file '''
+    file_version = "train" if not test else "test"
+    file_id = "_".join(file_name.split(os.sep)[-1].split("_")[1:3])
+    return os.sep.join(file_name.split(os.sep)[:-2] + ["Annotations"] + ["annotations_" + file_id + "_" + file_version + ".json"])
+
+def stream_records(file_list, test):
+    '''
+    Yields a Record for every record ID in the files, sorted by ID number.
+    Parts of a record that share an ID within a file are joined in file order.
+    Only the record being yielded is decoded and held in memory.
+    '''
+    with ExitStack() as stack:
+        maps = {}
+        entries = []
+        for file_name in file_list:
+            with open(file_name, "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    continue
+                maps[file_name] = stack.enter_context(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+            annot_file_name = annotation_file_name(file_name, test)
+            for _id, spans in index_file(file_name, maps[file_name]):
+                entries.append((_id, spans, file_name, annot_file_name))
+
+        for _id, spans, file_name, annot_file_name in sorted(entries, key=lambda e: int(e[0][3:])):
+            data = maps[file_name]
+            text = "".join(decode(data[start:end]) for start, end in spans)
+            yield Record(_id, text, file_name, get_annotation(_id, annot_file_name))
+
+def get_records(file_list, test):
+    # Array of all patient records. May be multiple records for each patient
+    return list(stream_records(file_list, test))
 
 def load_records(dir, test=False):
     '''
@@ -85,14 +135,16 @@ def load_records(dir, test=False):
     '''
     return get_records(get_file_list(dir, test), test)
 
+def iter_records(dir, test=False):
+    '''
+    Same as load_records, but yields the record objects one at a time
+    instead of loading them all into a list
+    '''
+    return stream_records(get_file_list(dir, test), test)
+
 if __name__ == "__main__":
-    # Usage: python3 patientSplitter.py dir_name output_file
-    files = get_file_list(sys.argv[1])
-    # List of Patient strings. The method splits on the opening line,
-    # so "**PROTECTED[begin]" is deleted. It'd be easy enough to add back in if necessary
-    records = get_records(files, False)
+    # Usage: python3 patient_splitter.py dir_name output_file
+    # Writes the text of every training record to output_file, in ID order
     with open(sys.argv[2], "w") as out_file:
-        print(records[0].record)
-        for record in records:
-            parse = record.parse()
+        for record in iter_records(sys.argv[1]):
             record.dump(out_file)
@@ -0,0 +1,259 @@
+import sys
+import time
+import hashlib
+import heapq
+from random import Random
+import annotation_matcher
+import classification
+import ml_classifier
+import instrumentation
+import record as record_module
+from config import NEGATIVE_SAMPLING_SEED, MODEL_PROFILE, CONCEPT_BACKEND
+
+'''
+Importable grading pipeline: everything main.py does to train the system and
+grade records, without the command line handling and printing.
+
+    p = Pipeline(use_metamap=False)
+    p.fit(patient_splitter.load_records(data_dir))   # or p.load(model_file)
+    p.classify_record(text)      # -> {"grade": 2, "rule_grade": 2, ...}
+    p.classify_batch(texts)      # -> list of the same, one per text
+    p.evaluate(test_records)     # -> classification.ClassificationResult
+
+compare_profiles trains every model profile (see ml_classifier.PROFILES) on
+the same training lines and reports their fit time, predict time and accuracy.
+
+Once fitted or loaded, a Pipeline keeps its model in memory, so grading a
+record only costs the classification itself (see service.py).
+'''
+
+class NegativeSampler:
+    '''
+    Picks a seeded random sample of up to size distinct lines from a stream of lines,
+    keeping only the sample in memory. Each occurrence of a line gets its own random
+    priority, a line's priority is the lowest of its occurrences', and the size lines
+    with the lowest priorities are kept (bottom-k sampling). A line that appears more
+    often is more likely to be picked, in proportion to how often it appears, as when
+    drawing occurrences at random until size distinct lines have been drawn. Each line
+    costs O(log size); if there are fewer distinct lines than size, all of them are
+    returned. The sample depends on the seed and the order of the lines.
+    '''
+    def __init__(self, size, seed):
+        self.size = size
+        self.rng = Random(seed)
+        self.heap = [] # (-priority, line) for the sampled lines; the root has the highest priority.
+                       # A line whose priority went down keeps its old entry until it reaches the root
+        self.sampled = {} # line -> priority, for the sampled lines
+        self.seen = 0 # lines offered
+
+    def _drop_stale(self):
+        while self.heap and self.sampled.get(self.heap[0][1]) != -self.heap[0][0]:
+            heapq.heappop(self.heap)
+
+    def add(self, line):
+        self.seen += 1
+        priority = self.rng.random()
+        if self.size <= 0:
+            return
+        if line in self.sampled:
+            if priority < self.sampled[line]:
+                self.sampled[line] = priority
+                heapq.heappush(self.heap, (-priority, line))
+            return
+        if len(self.sampled) < self.size:
+            self.sampled[line] = priority
+            heapq.heappush(self.heap, (-priority, line))
+            return
+        self._drop_stale()
+        if priority < -self.heap[0][0]:
+            del self.sampled[heapq.heapreplace(self.heap, (-priority, line))[1]]
+            self.sampled[line] = priority
+
+    def sample(self):
+        '''Returns the sampled lines, lowest priority first.'''
+        return sorted(self.sampled, key=self.sampled.get)
+
+def build_training_lines(train_records, use_metamap, seed=NEGATIVE_SAMPLING_SEED):
+    '''
+    Builds the ML classifier's training data from the training records.
+    labels: 0 == no grade, 1 == has a grade
+    seed seeds the random choice of negative lines.
+    Returns a list of (line, label) tuples.
+    '''
+    positive_lines = []
+    for record in train_records:
+        for grade in annotation_matcher.search_annotation(record.annotation, "Histologic Grade Text").split("~"):
+            if grade != "":
+                positive_lines.append(grade)
+    # randomly sample as many distinct negative examples as there are positive ones, for a 50:50 split of
+    # training data. The negatives of a record are its lines without its last grade text, so records
+    # without one have none
+    with instrumentation.stage("negative_sampling") as counts:
+        sampler = NegativeSampler(len(positive_lines), seed)
+        for record in train_records:
+            grade = annotation_matcher.search_annotation(record.annotation, "Histologic Grade Text").split("~")[-1]
+            if grade == "":
+                continue
+            for line in record.text.split("\n"):
+                if grade not in line:
+                    sampler.add(line)
+        culled_negatives = sampler.sample()
+        counts.records = len(train_records)
+        counts.lines = sampler.seen
+    if len(culled_negatives) < len(positive_lines):
+        print("Only %d distinct negative training lines for %d positive ones" % (len(culled_negatives), len(positive_lines)), file=sys.stderr)
+    # add the UMLS terms and concepts to the training lines, tagging all of them in a few large batches
+    if use_metamap:
+        with instrumentation.stage("metamap") as counts:
+            positive_lines = record_module.append_UMLS_tags(positive_lines)
+            culled_negatives = record_module.append_UMLS_tags(culled_negatives)
+            counts.lines = len(positive_lines) + len(culled_negatives)
+    if use_metamap and record_module.concept_extractors.get_extractor().cached and record_module.umls_cache.get_cache() is not None:
+        umls_stats = record_module.umls_cache.get_cache().stats()
+        print("UMLS cache: %d hits, %d misses, %d entries" % (umls_stats["hits"], umls_stats["misses"], umls_stats["entries"]), file=sys.stderr)
+    return [(x, "1") for x in positive_lines] + [(x, "0") for x in culled_negatives]
+
+def model_fingerprint(train_records, seed, use_metamap, hashed=False, profile=MODEL_PROFILE):
+    '''
+    Returns a hash identifying the training data a model would be built from:
+    the training records and their annotations, the negative sampling seed,
+    whether MetaMap Lite (or another concept extractor, with its term table) is used, and the kind of
+    model (hashed, or the profile).
+    '''
+    h = hashlib.sha256()
+    h.update(("seed=%s sampler=weighted-bottom-k metamap=%s\n" % (seed, use_metamap)).encode())
+    if use_metamap and CONCEPT_BACKEND != "metamap":
+        h.update(("concepts=%s\n" % record_module.concept_extractors.get_extractor().fingerprint()).encode())
+    h.update(b"hashed\n" if hashed else ("profile=%s\n" % profile).encode())
+    for record in train_records:
+        grade_text = annotation_matcher.search_annotation(record.annotation, "Histologic Grade Text")
+        for part in (record.rid, record.text, grade_text):
+            h.update(part.encode())
+            h.update(b"\0")
+    return h.hexdigest()
+
+def reported_grade(grades):
+    '''
+    classification.best_grade, but 0 (no grade) when no grades were found. best_grade breaks
+    the all-zero tie of an empty list towards 1; evaluation keeps that, so results stay comparable.
+    '''
+    return classification.best_grade(grades) if grades else 0
+
+class Pipeline:
+    '''
+    The rule-based and ML classifiers together, with the trained model kept in memory.
+    '''
+    def __init__(self, use_metamap=False, seed=NEGATIVE_SAMPLING_SEED, prefilter=False, hashed=False, profile=MODEL_PROFILE):
+        self.use_metamap = use_metamap
+        self.seed = seed
+        self.profile = profile # ml_classifier.PROFILES entry to train
+        self.hashed = hashed # train with ml_classifier.train_hashed instead of ml_classifier.train
+        self.prefilter = prefilter # only send lines that could carry a grade to the ML classifier
+        self.trained_objects = None
+        self.model_key = None # fingerprint of the training data, if fitted
+        self.model_id = None # artifact id of the model file, keys the prediction cache
+
+    def fit(self, train_records, retrain=False):
+        '''
+        Trains the ML classifier on the training records. A model saved for the same
+        training data is loaded instead of being retrained, unless retrain is set.
+        Returns the pipeline.
+        '''
+        self.model_key = model_fingerprint(train_records, self.seed, self.use_metamap, self.hashed, self.profile)
+        with instrumentation.stage("load_model"):
+            self.trained_objects = None if retrain else ml_classifier.load_model(self.model_key)
+        if self.trained_objects is None:
+            training_lines = build_training_lines(train_records, self.use_metamap, self.seed)
+            with instrumentation.stage("train") as counts:
+                if self.hashed:
+                    # the hashed model learns a chunk at a time, so mix the positive and negative lines
+                    Random(self.seed).shuffle(training_lines)
+                    self.trained_objects = ml_classifier.train_hashed(training_lines)
+                else:
+                    self.trained_objects = ml_classifier.train(training_lines, self.profile)
+                counts.lines = len(training_lines)
+            with instrumentation.stage("save_model"):
+                ml_classifier.save_model(self.model_key, self.trained_objects)
+        self.model_id = ml_classifier.artifact_id(ml_classifier.model_path(self.model_key))
+        return self
+
+    def load(self, path):
+        '''
+        Loads a model file saved by fit (see ml_classifier.model_path). Returns the pipeline.
+        '''
+        self.trained_objects = ml_classifier.load_model_file(path)
+        self.model_key = None
+        self.model_id = ml_classifier.artifact_id(path)
+        return self
+
+    def save(self, path):
+        ml_classifier.save_model_file(path, self.trained_objects)
+        self.model_id = ml_classifier.artifact_id(path)
+
+    def classify_record(self, record):
+        '''
+        Grades one record, given as a Record or as its text.
+        Returns a dict with the combined "grade", the "rule_grade" and "ml_grade"
+        each classifier alone would give, and the grades each one found
+        ("rule_grades", "ml_grades"). 0 means no grade.
+        '''
+        return self.classify_batch([record])[0]
+
+    def classify_batch(self, records):
+        '''
+        Grades a list of records (Records or texts) in one pass.
+        Returns a list of dicts as described in classify_record, in order.
+        '''
+        texts = [r.text if isinstance(r, record_module.Record) else r for r in records]
+        grades = []
+        for rb_grade, ml_grade in classification.grade_texts(texts, self.trained_objects, self.prefilter, self.model_id):
+            grades.append({"grade": reported_grade(rb_grade + ml_grade),
+                           "rule_grade": reported_grade(rb_grade),
+                           "ml_grade": reported_grade(ml_grade),
+                           "rule_grades": rb_grade,
+                           "ml_grades": ml_grade})
+        return grades
+
+    def evaluate(self, records_list, parallel=False):
+        '''
+        Classifies records that have gold grades and scores the results.
+        Returns a classification.ClassificationResult.
+        '''
+        if parallel:
+            return classification.classify_parallel(records_list, self.trained_objects, prefilter=self.prefilter, model_id=self.model_id)
+        return classification.classify_records(records_list, self.trained_objects, self.prefilter, self.model_id)
+
+    def prefilter_recall(self, records):
+        '''
+        Checks the prefilter against the unfiltered ML classifier on a list of records
+        (Records or texts). See classification.prefilter_recall.
+        '''
+        texts = [r.text if isinstance(r, record_module.Record) else r for r in records]
+        return classification.prefilter_recall(texts, self.trained_objects)
+
+def compare_profiles(train_records, test_records, profiles=None, use_metamap=False, seed=NEGATIVE_SAMPLING_SEED):
+    '''
+    Trains each model profile on the same training lines and grades the test records with it.
+    profiles defaults to every profile in ml_classifier.PROFILES.
+    Returns {profile: stats}, where stats has "fit_seconds", "predict_seconds" (ML classifier
+    over every test line), "predict_ms_per_line", and the specific "accuracy" of the
+    system as a whole and "ml_accuracy" of the ML classifier alone on the test records.
+    '''
+    training_lines = build_training_lines(train_records, use_metamap, seed)
+    test_lines = classification.lines_for_ml([record.text for record in test_records])
+    line_count = sum(len(lines) for lines in test_lines)
+    comparison = {}
+    for profile in profiles or list(ml_classifier.PROFILES):
+        start = time.perf_counter()
+        trained_objects = ml_classifier.train(training_lines, profile)
+        fit_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        ml_classifier.test_batch(trained_objects, test_lines)
+        predict_seconds = time.perf_counter() - start
+        result = classification.classify_records(test_records, trained_objects)
+        comparison[profile] = {"fit_seconds": fit_seconds,
+                               "predict_seconds": predict_seconds,
+                               "predict_ms_per_line": predict_seconds * 1000 / line_count if line_count > 0 else 0.0,
+                               "accuracy": result.combo_matrix.metrics()["specific_accuracy"] or 0.0,
+                               "ml_accuracy": result.ml_matrix.metrics()["specific_accuracy"] or 0.0}
+    return comparison
@@ -0,0 +1,99 @@
+"""
+Persistent cache of per-record predictions
+
+Keeps two entries per record:
+- the rule-based grades, keyed by a hash of (rule-based classifier source, record text)
+- the lines the ML classifier found a grade in, keyed by a hash of (model artifact
+  id, prefilter setting and regex, record text)
+so a run after changing a rule only reruns the rules, and a run with a new
+model (see ml_classifier.artifact_id) only reruns the ML classifier. Entries
+are kept in an SQLite file and evicted least-recently-used first once the
+cache grows past its maximum number of entries (see sqlite_cache.py).
+"""
+import hashlib
+import json
+import rule_based_classifier
+import sqlite_cache
+from config import PREDICTION_CACHE_FILE, PREDICTION_CACHE_MAX_ENTRIES
+
+
+def rules_fingerprint():
+    """
+    Hashes the source of the rule-based classifier
+
+    :return: hex digest identifying the current rules
+    """
+    with open(rule_based_classifier.__file__, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class PredictionCache(sqlite_cache.SQLiteCache):
+    table = "predictions"
+    value_type = "TEXT"
+
+    def __init__(self, path, max_entries=PREDICTION_CACHE_MAX_ENTRIES):
+        """
+        Opens (or creates) a cache file
+
+        :param path: location of the SQLite cache file
+        :param max_entries: number of entries kept before the least recently used are evicted
+        """
+        super().__init__(path, max_entries)
+        self.fingerprint = rules_fingerprint()
+
+    def dumps(self, value):
+        return json.dumps(value)
+
+    def loads(self, stored):
+        return json.loads(stored)
+
+    def rules_key(self, text):
+        """
+        :param text: record text
+        :return: key of the record's rule-based grades under the current rules
+        """
+        return hashlib.sha256(("rules\0%s\0%s" % (self.fingerprint, text)).encode()).hexdigest()
+
+    def ml_key(self, text, model_id, prefilter):
+        """
+        :param text: record text
+        :param model_id: artifact id of the model
+        :param prefilter: whether the ML classifier only sees prefiltered lines
+        :return: key of the lines of the record the model finds a grade in. With prefilter set,
+                 the prefilter regex is part of the key, since it decides which lines the model sees
+        """
+        if prefilter:
+            prefilter = "%s\0%d" % (rule_based_classifier.prefilter_rx.pattern, rule_based_classifier.prefilter_rx.flags)
+        return hashlib.sha256(("ml\0%s\0%s\0%s" % (model_id, prefilter or False, text)).encode()).hexdigest()
+
+    def get_many(self, keys):
+        """
+        :param keys: keys made by rules_key or ml_key
+        :return: the value stored under each key, or None where nothing is
+        """
+        return self.lookup(keys)
+
+    def put_many(self, keys, values):
+        """
+        Stores a JSON-serializable value (a list of grades or line numbers) under each key
+
+        :param keys: keys made by rules_key or ml_key
+        :param values: value for each key
+        """
+        self.store(keys, values)
+
+
+_shared = sqlite_cache.Shared(lambda: PredictionCache(PREDICTION_CACHE_FILE) if PREDICTION_CACHE_FILE is not None else None)
+
+
+def get_cache():
+    """
+    Returns the process-wide cache, opening it on first use.
+
+    :return: the PredictionCache, or None if caching is turned off in config.py
+    """
+    return _shared.get()
+
+
+def close_cache():
+    _shared.close()
@@ -5,30 +5,150 @@ Record object - Stores patient record information
 """
 import re
 from annotation_matcher import search_annotation
-from collections import defaultdict
-from config import METAMAP_DIR
-from subprocess import Popen, PIPE, STDOUT
-import sys
+from collections.abc import Mapping
+import concept_extractors
+import umls_cache
+
+# Tags that open and close record sections
+OPEN_TAG_RX = re.compile(r"<(\w+)>")
+CLOSED_TAG_RX = re.compile(r"</(\w+]?)>")
+
+
+def section_spans(text):
+    """
+    Finds the lines belonging to each section of a record in a single pass, without copying them.
+    A line with an opening tag starts that tag's section, lines with a closing tag are skipped,
+    and every other line belongs to the most recently opened section.
+
+    :param text: input XML text with unclosed tags
+    :return: list of (tag, start, end) spans into the text, one per line, in order
+    """
+    spans = []
+    curr_tag = None
+    start = 0
+    while True:
+        end = text.find("\n", start)
+        if end == -1:
+            end = len(text)
+        has_tag = text.find("<", start, end) != -1
+        open_tag = OPEN_TAG_RX.search(text, start, end) if has_tag else None
+        if open_tag is not None:
+            curr_tag = open_tag.group(1)
+        elif has_tag and CLOSED_TAG_RX.search(text, start, end) is not None:
+            pass
+        elif curr_tag:
+            spans.append((curr_tag, start, end))
+        if end == len(text):
+            return spans
+        start = end + 1
+
+
+class Sections(Mapping):
+
+    __slots__ = ("text", "spans")
+
+    def __init__(self, text, spans):
+        """
+        Record sections, stored as spans into the record text. A section's text is only
+        built when it is asked for: each of its lines followed by a space.
+        Like the defaultdict this used to be, a tag with no section gives "".
+
+        :param text: the record text
+        :param spans: (tag, start, end) line spans, as returned by section_spans
+        """
+        self.text = text
+        self.spans = {}
+        for tag, start, end in spans:
+            self.spans.setdefault(tag, []).append((start, end))
+
+    def __getitem__(self, tag):
+        return "".join(self.text[start:end] + " " for start, end in self.spans.get(tag, ()))
+
+    def __contains__(self, tag):
+        return tag in self.spans
+
+    def __iter__(self):
+        return iter(self.spans)
+
+    def __len__(self):
+        return len(self.spans)
+
+    def lines(self, tag):
+        """
+        :param tag: section tag
+        :return: generator of the section's lines, sliced from the record text one at a time
+        """
+        return (self.text[start:end] for start, end in self.spans.get(tag, ()))
 
 
 class Record:
 
+    __slots__ = ("rid", "text", "file", "annotation", "_sections", "_gold", "_umls_tags")
+
+    # The only annotation fields the pipeline reads. Everything else is dropped to save memory
+    ANNOTATION_FIELDS = ("Grade Category", "Histologic Grade Text")
+
     def __init__(self, rid, record, file, annotation):
         """
-        Stores patient record
+        Stores patient record. Sections, gold grades and UMLS tags are worked out
+        the first time they are used.
 
         :param rid: record id number
         :param record: free text note
         :param file: filename
-        :param annotation:
+        :param annotation: the record's annotations section, as returned by annotation_matcher.get_annotation
         """
         self.rid = rid
         self.text = record
-        self.sections = self.close_tags(record)
         self.file = file
-        self.annotation = annotation
-        self.gold = self._get_grades()
-        self.umls_tags = []
+        self.annotation = self.reduce_annotation(annotation)
+        self._sections = None
+        self._gold = None
+        self._umls_tags = None
+
+    @staticmethod
+    def reduce_annotation(annotation):
+        """
+        Copies the annotation fields the pipeline reads out of a record's annotations
+
+        :param annotation: dictionary of annotation number -> fields
+        :return: the same dictionary with only ANNOTATION_FIELDS kept
+        """
+        if annotation is None:
+            return None
+        return {n: {field: fields[field] for field in Record.ANNOTATION_FIELDS if field in fields}
+                for n, fields in annotation.items()}
+
+    @property
+    def sections(self):
+        """
+        Dictionary of record sections (see close_tags), built on first access
+        """
+        if self._sections is None:
+            self._sections = self.close_tags(self.text)
+        return self._sections
+
+    @property
+    def gold(self):
+        """
+        Annotated grades, parsed on first access
+        """
+        if self._gold is None:
+            self._gold = self._get_grades()
+        return self._gold
+
+    @property
+    def umls_tags(self):
+        """
+        UMLS terms for the record text. Metamap Lite is only run the first time they are used
+        """
+        if self._umls_tags is None:
+            self._umls_tags = get_UMLS_tags(self.text)
+        return self._umls_tags
+
+    @umls_tags.setter
+    def umls_tags(self, tags):
+        self._umls_tags = tags
 
     def _get_grades(self):
         annots_string = search_annotation(self.annotation, "Grade Category")
@@ -40,31 +160,16 @@ class Record:
         Method to create a dictionary of record sections from XML
 
         :param text: input XML text with unclosed tags
-        :return: return a dictionary of with XML tag keys and values being the inner text
-        """
-        stack = []
-        cleaned = defaultdict(str)
-        curr_tag = None
-        for line in text.split("\n"):
-            open_tag = re.search(r"<(\w+)>", line)
-            closed_tag = re.search(r"</(\w+]?)>", line)
-            if open_tag is not None:
-                curr_tag = open_tag.expand(r"\1")
-                stack.append(open_tag.expand(r"\1"))
-            elif closed_tag is not None:
-                stack.pop()
-            elif curr_tag:
-                cleaned[curr_tag] += line + " "
-        return cleaned
+        :return: a Sections mapping with XML tag keys and values being the inner text
+        """
+        return Sections(text, section_spans(text))
 
     def get_umls_tags(self):
         """
-        Runs Metamap Lite over the record text
+        Runs Metamap Lite over the record text, unless it has already been run
 
         :return: a list of terms extracted from the text along with their associated concepts
         """
-        tags = metamap_pipeline(self.text)
-        self.umls_tags = parse_umls_terms(tags)
         return self.umls_tags
 
     def get_tumor_mentions(self):
@@ -77,24 +182,6 @@ class Record:
         output_file.write(self.text)
 
 
-def metamap_pipeline(text):
-    if "win" in sys.platform:
-        metamap_path = METAMAP_DIR + r"/metamaplite.bat"
-        p = Popen([metamap_path, "--pipe",
-                   "--indexdir=" + METAMAP_DIR + r"/data/ivf/strict",
-                   "--modelsdir=" + METAMAP_DIR + "/data/models",
-                   "--specialtermsfile=" + METAMAP_DIR + "/data/specialterms.txt",
-                   "--brat"], stdin=PIPE, stdout=PIPE, stderr=STDOUT, shell=True)
-    else:
-        metamap_path = METAMAP_DIR + r"/metamaplite.sh"
-        p = Popen([metamap_path, "--pipe",
-                   "--indexdir=" + METAMAP_DIR + r"/data/ivf/strict",
-                   "--modelsdir=" + METAMAP_DIR + "/data/models",
-                   "--specialtermsfile=" + METAMAP_DIR + "/data/specialterms.txt",
-                   "--brat"], stdin=PIPE, stdout=PIPE, stderr=STDOUT)
-    return p.communicate(input=text.encode())[0]
-
-
 def parse_umls_terms(metamap_output):
     """
     Generates Term/Concept objects from parsing the metamap raw output
@@ -116,13 +203,68 @@ def parse_umls_terms(metamap_output):
 
 def get_UMLS_tags(text):
     """
-           Runs Metamap Lite over a given input string
+           Runs the concept extractor chosen by CONCEPT_BACKEND (config.py) over a given input string.
+           MetaMap Lite results are looked up in, and saved to, the UMLS cache when it is enabled.
 
-           :param text: text to run NER using the UMLS terms within Metamap Lite
+           :param text: text to run NER using the UMLS terms within the concept extractor
            :return: a list of terms extracted from the text along with their associated concepts
            """
-    tags = metamap_pipeline(text)
-    return parse_umls_terms(tags)
+    extractor = concept_extractors.get_extractor()
+    cache = umls_cache.get_cache() if extractor.cached else None
+    if cache is not None:
+        terms = cache.get(text)
+        if terms is not None:
+            return terms
+    terms = extractor.tag(text)
+    if cache is not None:
+        cache.put(text, terms)
+    return terms
+
+def get_UMLS_tags_batch(texts):
+    """
+    Runs the concept extractor over many strings at once. Each distinct string that isn't
+    in the UMLS cache is tagged once, in one call to the extractor's tag_batch (for MetaMap
+    Lite, see concept_extractors.MetaMapLiteExtractor.tag_batch).
+
+    :param texts: list of strings
+    :return: a list of Terms for each string, in the same order, with offsets relative to that string
+    """
+    extractor = concept_extractors.get_extractor()
+    cache = umls_cache.get_cache() if extractor.cached else None
+    tagged = {}
+    for text in texts:
+        if text in tagged:
+            continue
+        if text.strip() == "":
+            tagged[text] = []
+        else:
+            tagged[text] = cache.get(text) if cache is not None else None
+    untagged = [text for text in tagged if tagged[text] is None]
+
+    found = extractor.tag_batch(untagged)
+    for text, terms in zip(untagged, found):
+        tagged[text] = terms
+    if cache is not None:
+        cache.put_many(untagged, found)
+    return [list(tagged[text]) for text in texts]
+
+
+def append_UMLS_tags(texts):
+    """
+    Appends the names of the UMLS terms and concepts found in each string to that string
+
+    :param texts: list of strings
+    :return: list of the enriched strings, in the same order
+    """
+    enriched = []
+    for text, terms in zip(texts, get_UMLS_tags_batch(texts)):
+        for term in terms:
+            text += " " + term.tag
+            for concept in term.concepts:
+                text += " " + concept.concept
+        enriched.append(text)
+    return enriched
+
 
 class Term:
 
@@ -1,4 +1,7 @@
 import re
+import json
+import math
+import time
 
 '''
 Krista Watkins
@@ -10,6 +13,9 @@ Usage: call classify_record(record.text, diff_option)
 
 Returns array of integers 0-4
     0 for unknown (default)
+
+Profiling: call enable_profiling() before classifying, then profile_report()
+or write_profile_report(file_name) for per-rule counts and timings.
 '''
 
 # Rexeges
@@ -35,113 +41,153 @@ diff_rx = re.compile("(poorly|moderately|moderate|well)(\\s+(to|and)\\s+(poorly|
 word_rx = re.compile("(low|intermediate|moderate|high)(\\s+(to|and)\\s+(low|intermediate|moderate|high))?", re.IGNORECASE)
 num_rx = re.compile("(at\\s*least\\s*)?(grade|g)?\\s*((\\d+|I+[XV]?|VI*|%s)\\s*((/|of|out of|to|-)\\s*(\\d+|I+[XV]?|VI*|%s))?)"%(num_str, num_str), re.IGNORECASE)
 
-def classify_record(rec, use_diff):
-    '''
-    For each record, assign attempt to assign tumor grades. The first trail
-    to successfully find at least one grade wins
-    
-    Most of the trials are based on finding a grade following a specific header
-    Later trials search for all instances of a specific type of grade indicator.
-    '''
-    
+# Header trials, in the order classify_record tries them, as
+# (rule name, header regex, keyword the header can't match without)
+header_rules = [
     # Histologic Grade:
-    grades = header_trial(rec, "histologic\\s+(grade|score)\\s*:\\s*")
-    if len(grades) > 0:
-        return grades
-    
+    ("histologic_grade", re.compile("histologic\\s+(grade|score)\\s*:\\s*", re.IGNORECASE), "histologic"),
     # Histologic Grade: (Nottingham histologic score)
     # Histologic Grade: Nottingham:
-    grades = header_trial(rec, "histologic\\s+grade\\s*:?\\s*\(?nottingham\\s*(histologic)?\\s*(grade|score)?\)?\\s*:?\\s*")
-    if len(grades) > 0:
-        return grades
-    
+    ("histologic_grade_nottingham", re.compile("histologic\\s+grade\\s*:?\\s*\(?nottingham\\s*(histologic)?\\s*(grade|score)?\)?\\s*:?\\s*", re.IGNORECASE), "histologic"),
     # Histologic Grade: Bloom-richardson score
-    grades = header_trial(rec, "histologic\\s+grade\\s*:\\s*bloom-richardson\\s+score\\s*")
-    if len(grades) > 0:
-        return grades
-    
+    ("histologic_grade_bloom_richardson", re.compile("histologic\\s+grade\\s*:\\s*bloom-richardson\\s+score\\s*", re.IGNORECASE), "histologic"),
     # Histologic Grade (MBR):
     # Histologic Grade (if applicable):
-    grades = header_trial(rec, "histologic\\s+grade\\s*\((MBR|if\\s+applicable)\)\\s*:?\\s*")
-    if len(grades) > 0:
-        return grades
-    
+    ("histologic_grade_qualified", re.compile("histologic\\s+grade\\s*\((MBR|if\\s+applicable)\)\\s*:?\\s*", re.IGNORECASE), "histologic"),
     # Histologic grade
-    grades = header_trial(rec, "histologic\\s+grade\\s*")
-    if len(grades) > 0:
-        return grades
-    
+    ("histologic_grade_no_colon", re.compile("histologic\\s+grade\\s*", re.IGNORECASE), "histologic"),
     # Nottingham Histologic Grade:
-    grades = header_trial(rec, "\(?nottingham\\s+(histologic)?\\s*(grade|score)\)?\\s*:?\\s*")
-    if len(grades) > 0:
-        return grades
-    
+    ("nottingham_grade", re.compile("\(?nottingham\\s+(histologic)?\\s*(grade|score)\)?\\s*:?\\s*", re.IGNORECASE), "nottingham"),
     # Bloom-Richardson score
-    grades = header_trial(rec, "\(?\\s*bloom-richardson\\s*(score)?\\s*\)?\\s*:?\\s*")
-    if len(grades) > 0:
-        return grades
-    
+    ("bloom_richardson_score", re.compile("\(?\\s*bloom-richardson\\s*(score)?\\s*\)?\\s*:?\\s*", re.IGNORECASE), "bloom-richardson"),
     # Overall grade:
-    grades = header_trial(rec, "overall\\s+grade\\s*:\\s*")
-    if len(grades) > 0:
-        return grades
-    
+    ("overall_grade", re.compile("overall\\s+grade\\s*:\\s*", re.IGNORECASE), "overall"),
     # Nuclear grade:
-    grades = header_trial(rec, "nuclear\\s+grade\\s*:(\\s*nuclear\\s+grade)?\\s*")
-    if len(grades) > 0:
-        return grades
+    ("nuclear_grade", re.compile("nuclear\\s+grade\\s*:(\\s*nuclear\\s+grade)?\\s*", re.IGNORECASE), "nuclear"),
+]
+# Regexes for the searches that follow the header trials
+nuclear_trial_rx = re.compile("(low|intermediate|moderate|high)(\\s*to\\s+(low|intermediate|moderate|high))?\\s+nuclear\\s+grade")
+grade_trial_rx = re.compile("(low|intermediate|moderate|high)(\\s*to\\s+(low|intermediate|moderate|high))?\\s+grade")
+undifferentiated_rx = re.compile("undifferentiated", re.IGNORECASE)
+# Every keyword some rule needs, one group each. The lookahead finds overlapping occurrences too,
+# and checking the first letter before trying the keywords keeps the scan fast
+rule_keywords = ["histologic", "nottingham", "bloom-richardson", "overall", "nuclear", "grade", "differentiated"]
+keyword_rx = re.compile("(?=[%s])(?=%s)" % ("".join(sorted(set(k[0] for k in rule_keywords))), "|".join("(%s)" % k for k in rule_keywords)), re.IGNORECASE)
+
+# Prefilter for the ML classifier: a line with none of these can't state a grade the
+# way any rule reads one, so it doesn't need to be classified. The words are the rules'
+# vocabulary, the patterns are scores (3+2+2=7, 7/9, 2 of 3) and roman numeral grades
+prefilter_words = ["grade", "differentiat", "histologic", "nottingham", "bloom", "richardson", "nuclear", "score", "overall"]
+prefilter_patterns = ["\\d\\s*\\+\\s*\\d", "\\d\\s*(/|of|out of)\\s*\\d", "\\b(?-i:I{1,3}|IV)\\b"]
+prefilter_rx = re.compile("|".join(prefilter_words + prefilter_patterns), re.IGNORECASE)
+
+def is_candidate_line(line):
+    '''
+    Returns True if the line could carry a grade (see prefilter_rx)
+    '''
+    return prefilter_rx.search(line) is not None
+
+class RecordScan:
+    '''
+    The rule keywords found in one record, from a single scan of the text.
+    A rule's regex can only match where its keyword occurs, so the cascade
+    skips every rule whose keyword isn't in the record without running it.
+    The rules that do run still search the whole record.
+    '''
+    def __init__(self, rec):
+        self.found = set()
+        for match in keyword_rx.finditer(rec):
+            self.found.add(rule_keywords[match.lastindex - 1])
+            if len(self.found) == len(rule_keywords):
+                break
+
+    def has(self, keyword):
+        return keyword in self.found
+
+def classify_record(rec, use_diff):
+    '''
+    For each record, assign attempt to assign tumor grades. The first trail
+    to successfully find at least one grade wins
+    
+    Most of the trials are based on finding a grade following a specific header
+    Later trials search for all instances of a specific type of grade indicator.
+    '''
+    if _profile is None:
+        return cascade(rec, use_diff)
+    return _run("classify_record", cascade, rec, use_diff)
+
+def cascade(rec, use_diff):
+    '''
+    The trials of classify_record, in order. Trials whose keyword isn't
+    in the record are skipped.
+    '''
+    scan = _run("record_scan", RecordScan, rec)
+
+    for name, header_rx, keyword in header_rules:
+        grades = _trial(scan, keyword, name, header_trial, rec, header_rx)
+        if len(grades) > 0:
+            return grades
     
     # low/intermediate/high nuclear grade search
-    grades = nuclear_trial(rec)
+    grades = _trial(scan, "nuclear", "nuclear_trial", nuclear_trial, rec)
     if len(grades) > 0:
         return grades
     
     # low/intermediate/high grade search
-    grades = grade_trial(rec)
+    grades = _trial(scan, "grade", "grade_trial", grade_trial, rec)
     if len(grades) > 0:
         return grades
     
     if use_diff > 0:
         # Search for differentiation strings
         if use_diff == 1:
-            grades = diff_trial1(rec)
+            grades = _trial(scan, "differentiated", "diff_trial1", diff_trial1, rec)
             if len(grades) > 0:
                 return grades
         elif use_diff == 2:
-            grades = diff_trial2(rec)
+            grades = _trial(scan, "differentiated", "diff_trial2", diff_trial2, rec)
             if len(grades) > 0:
                 return grades
     
+    if _profile is not None:
+        _rule_stats("no_grade")["wins"] += 1
     return [0]
 
+def _trial(scan, keyword, name, trial, *args):
+    '''
+    Runs a trial if the record has its keyword. A skipped trial finds no grades.
+    '''
+    if scan.has(keyword):
+        return _run(name, trial, *args)
+    if _profile is not None:
+        _rule_stats(name)["skipped"] += 1
+    return []
+
 def header_trial(rec, regex):
     '''
     Given a regular expression representing a header (i.e. histologic grade:),
     Find all occurances of the header, and divide the record into sections
     
-    Attempt to find a grade in each section
+    Attempt to find a grade in each section. Sections are searched in place,
+    without copying them out of the record.
     '''
-    # Find sections with the given header
-    histology_headers = re.finditer(regex, rec, re.IGNORECASE)
-    starts = []
+    if isinstance(regex, str):
+        regex = re.compile(regex, re.IGNORECASE)
+    # Each section runs from the end of its header to the start of the next header
+    section_starts = []
     ends = []
-    # Headers may match regex but not be identical. Store variations
-    headers = []
-    count = 0
-    for header_match in histology_headers:
-        count += 1
-        starts.append(header_match.start())
-        headers.append(header_match.group())
-        if count > 1:
+    for header_match in regex.finditer(rec):
+        if len(section_starts) > 0:
             ends.append(header_match.start())
+        section_starts.append(header_match.end())
+    count = len(section_starts)
     if count > 0:
         ends.append(len(rec))
     
     # Attempt to find one grade per section
     grades = []
-    for i in range(0, len(starts)):
-        section = rec[starts[i] + len(headers[i]):ends[i]]
-        grade = classify_section(section)
+    for i in range(0, count):
+        grade = classify_span(rec, section_starts[i], ends[i])
         if grade > 0:
             grades.append(grade)
             
@@ -162,7 +208,7 @@ def diff_trial1(rec):
     histologic grade
     '''
     diff_matches = diff_anywhere_rx.finditer(rec)
-    undiff_matches = re.finditer("undifferentiated", rec, re.IGNORECASE)
+    undiff_matches = undifferentiated_rx.finditer(rec)
     grades = []
     
     for match in diff_matches:
@@ -188,7 +234,7 @@ def diff_trial2(rec):
     many records with no annotated histologic grade
     '''
     diff_matches = diff_anywhere_rx.finditer(rec)
-    undiff_matches = re.finditer("undifferentiated", rec, re.IGNORECASE)
+    undiff_matches = undifferentiated_rx.finditer(rec)
     grades = []
     
     for match in diff_matches:
@@ -207,7 +253,7 @@ def nuclear_trial(rec):
     '''
     Searches the record for instances of low/moderate/high nuclear grade
     '''
-    matches = re.finditer("(low|intermediate|moderate|high)(\\s*to\\s+(low|intermediate|moderate|high))?\\s+nuclear\\s+grade", rec)
+    matches = nuclear_trial_rx.finditer(rec)
     grades = []
     
     for match in matches:
@@ -219,7 +265,7 @@ def grade_trial(rec):
     '''
     Searches the record for instances of low/moderate/high grade
     '''
-    matches = re.finditer("(low|intermediate|moderate|high)(\\s*to\\s+(low|intermediate|moderate|high))?\\s+grade", rec)
+    matches = grade_trial_rx.finditer(rec)
     grades = []
     
     for match in matches:
@@ -232,33 +278,41 @@ def classify_section(section):
     Search through the section to find a grade. Preference is given to grades
     found at the beginning of the section
     '''
+    return classify_span(section, 0, len(section))
+
+def classify_span(rec, start, end):
+    '''
+    Same as classify_section(rec[start:end]), but searches the record in place.
+    A "^" pattern doesn't match at a search's start position, so the checks for a
+    grade at the beginning of the section use match() with the unanchored regexes.
+    '''
     # Special Case for nottingham a+b+c=y
-    sum_found = re.search("\\d\\s*\+\\s*\\d\\s*\+\\s*\\d\\s*=\\s*(\\d)", section)
+    sum_found = _run("section_sum", sum_rx.search, rec, start, end)
     if sum_found:
         return extract_number_grade(sum_found, 1, None, None)
 
     # Find differentiation at the beginning of the section
-    differentiation_found = differentiation_rx.search(section)
+    differentiation_found = _run("section_differentiation", diff_rx.match, rec, start, end)
     if differentiation_found:
         return extract_word_grade(differentiation_found, 1, 4)
     
     # Low/medium/high grade at section beginning
-    word_grade_found = word_grade_rx.search(section)
+    word_grade_found = _run("section_word_grade", word_rx.match, rec, start, end)
     if word_grade_found:
         return extract_word_grade(word_grade_found, 1, 4)
     
     # Find numerical grade at the beginning of the section
-    number_found = number_grade_rx.search(section)
+    number_found = _run("section_number_grade", num_rx.match, rec, start, end)
     if number_found:
         return extract_number_grade(number_found, 4, 7, 6)
 
     # Look for the overall grade farther along in the section
-    overall_grade_found = overall_grade_rx.search(section)
+    overall_grade_found = _run("section_overall_grade", overall_grade_rx.search, rec, start, end)
     if overall_grade_found:
         return extract_number_grade(overall_grade_found, 6, 9, 8)
 
     # Look for grade in form format: Overall Grade: __x__
-    form_grade_found = form_grade_rx.search(section)
+    form_grade_found = _run("section_form_grade", form_grade_rx.search, rec, start, end)
     if form_grade_found:
         return extract_number_grade(form_grade_found, 1, None, None)
 
@@ -270,33 +324,33 @@ def classify_string(string):
     The first regex to determine a grade wins
     '''
     # Special Case for nottingham a+b+c=y
-    sum_found = sum_rx.search(string)
+    sum_found = _run("string_sum", sum_rx.search, string)
     if sum_found:
         return extract_number_grade(sum_found, 1, None, None)
 
     # Find differentiation at the beginning of the section
-    differentiation_found = diff_rx.search(string)
+    differentiation_found = _run("string_differentiation", diff_rx.search, string)
     if differentiation_found:
         return extract_word_grade(differentiation_found, 1, 4)
     
     # Low/medium/high grade at section beginning
-    word_grade_found = word_rx.search(string)
+    word_grade_found = _run("string_word_grade", word_rx.search, string)
     if word_grade_found:
         return extract_word_grade(word_grade_found, 1, 4)
     
     # Find numerical grade at the beginning of the section
-    number_found = num_rx.search(string)
+    number_found = _run("string_number_grade", num_rx.search, string)
     if number_found:
         return extract_number_grade(number_found, 4, 7, 6)
 
 
     # Look for the overall grade farther along in the section
-    overall_grade_found = overall_grade_rx.search(string)
+    overall_grade_found = _run("string_overall_grade", overall_grade_rx.search, string)
     if overall_grade_found:
         return extract_number_grade(overall_grade_found, 6, 9, 8)
 
     # Look for grade in form format: Overall Grade: __x__
-    form_grade_found = form_grade_rx.search(string)
+    form_grade_found = _run("string_form_grade", form_grade_rx.search, string)
     if form_grade_found:
         return extract_number_grade(form_grade_found, 1, None, None)
 
@@ -427,3 +481,93 @@ def diff_to_num(word):
     if word == "well" or word == "low":
         return 1
     return 0
+
+'''
+Profiling of the rules. Off unless enable_profiling() is called
+'''
+
+_profile = None # rule name -> run/win/skip counts and run times, while profiling
+
+def enable_profiling():
+    '''
+    Starts recording counts and timings for every rule. Clears earlier results
+    '''
+    global _profile
+    _profile = {}
+
+def disable_profiling():
+    global _profile
+    _profile = None
+
+def get_profile():
+    '''
+    Returns the raw profile being recorded, or None if profiling is off
+    '''
+    return _profile
+
+def merge_profile(other):
+    '''
+    Adds a raw profile recorded elsewhere (e.g. in a worker process) to this one
+    '''
+    for name, other_stats in other.items():
+        stats = _rule_stats(name)
+        for key in ("runs", "wins", "skipped"):
+            stats[key] += other_stats[key]
+        stats["times"].extend(other_stats["times"])
+
+def _rule_stats(name):
+    if name not in _profile:
+        _profile[name] = {"runs": 0, "wins": 0, "skipped": 0, "times": []}
+    return _profile[name]
+
+def _run(name, rule, *args):
+    '''
+    Calls rule(*args). While profiling, times the call and counts it as a win
+    if it found something (a non-empty list of grades or a match)
+    '''
+    if _profile is None:
+        return rule(*args)
+    start = time.perf_counter()
+    result = rule(*args)
+    elapsed = time.perf_counter() - start
+    stats = _rule_stats(name)
+    stats["runs"] += 1
+    stats["times"].append(elapsed)
+    if result:
+        stats["wins"] += 1
+    return result
+
+def percentile(sorted_values, p):
+    '''
+    Nearest-rank percentile of an already sorted list
+    '''
+    if len(sorted_values) == 0:
+        return 0.0
+    rank = max(0, math.ceil(p * len(sorted_values) / 100) - 1)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+def profile_report():
+    '''
+    Returns a JSON-serializable dict with, for each rule, how many times it ran,
+    won (decided the result) and was skipped, and its total and percentile times
+    in seconds. "no_grade" counts records no trial could grade
+    '''
+    report = {}
+    for name, stats in sorted((_profile or {}).items()):
+        times = sorted(stats["times"])
+        report[name] = {
+            "runs": stats["runs"],
+            "wins": stats["wins"],
+            "skipped": stats["skipped"],
+            "total_seconds": sum(times),
+            "mean_seconds": sum(times) / len(times) if times else 0.0,
+            "p50_seconds": percentile(times, 50),
+            "p90_seconds": percentile(times, 90),
+            "p99_seconds": percentile(times, 99),
+            "max_seconds": times[-1] if times else 0.0,
+        }
+    return report
+
+def write_profile_report(file_name):
+    with open(file_name, "w") as out:
+        json.dump(profile_report(), out, indent=2, sort_keys=True)
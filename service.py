@@ -0,0 +1,131 @@
+import sys
+import os
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import patient_splitter
+import concept_extractors
+from pipeline import Pipeline
+
+'''
+Long-running grading service. Loads (or trains) the model once, then grades
+records as they arrive, so each request only pays for its own classification.
+
+USAGE: python(3) service.py model no-metamap prefilter http port
+
+model is either a model file saved by main.py (in MODEL_DIR, see config.py)
+    or a data directory to train on, as for main.py.
+no-metamap is an optional string. If it is present and model is a data
+    directory, MetaMap Lite will not be used for training.
+prefilter is an optional string. If it is present, only lines that could
+    carry a grade are given to the ML classifier (as for main.py).
+http is an optional string. If it is present, the service listens on
+    127.0.0.1 (port 8575 unless a port number follows "http"):
+        POST /classify  {"text": "..."}         -> {"grade": 2, ...}
+                        {"texts": ["...", ...]} -> {"results": [...]}
+        GET  /health                            -> {"status": "ok"}
+    Otherwise it reads one JSON object per line from standard in, e.g.
+    {"id": "REC1", "text": "..."}, and writes one JSON result per line to
+    standard out, with the same "id".
+
+Results are the dicts returned by Pipeline.classify_record. A record in which
+neither classifier finds a grade gets grade 0 (see pipeline.reported_grade);
+main.py's evaluation counts such a record as grade 1, as it always has, so the
+two differ on those records only. A request without a string "text" (or a
+list of strings in "texts") gets {"error": "bad request: ..."}, with status
+400 over http.
+'''
+
+def check_text(text):
+    '''Returns text if it's a string, which is all the classifiers accept, otherwise raises TypeError.'''
+    if not isinstance(text, str):
+        raise TypeError("text must be a string, not %s" % type(text).__name__)
+    return text
+
+def check_texts(texts):
+    '''Returns texts if it's a list of strings, otherwise raises TypeError.'''
+    if not isinstance(texts, list):
+        raise TypeError("texts must be a list, not %s" % type(texts).__name__)
+    return [check_text(text) for text in texts]
+
+def load_pipeline(model, use_metamap, prefilter=False):
+    '''Loads the model file, or trains on the data directory, given on the command line.'''
+    if os.path.isdir(model):
+        if use_metamap and not concept_extractors.get_extractor().available():
+            print(concept_extractors.get_extractor().missing + " Running without concept tags.", file=sys.stderr)
+            use_metamap = False
+        return Pipeline(use_metamap, prefilter=prefilter).fit(patient_splitter.load_records(model))
+    return Pipeline(prefilter=prefilter).load(model)
+
+def serve_stdin(pipeline, stdin=sys.stdin, stdout=sys.stdout):
+    '''Grades one JSON record per input line until the input ends.'''
+    for line in stdin:
+        if line.strip() == "":
+            continue
+        try:
+            request = json.loads(line)
+            result = pipeline.classify_record(check_text(request["text"]))
+            if "id" in request:
+                result["id"] = request["id"]
+        except (ValueError, KeyError, TypeError) as e:
+            result = {"error": "bad request: " + repr(e)}
+        stdout.write(json.dumps(result) + "\n")
+        stdout.flush()
+
+def make_handler(pipeline):
+    class Handler(BaseHTTPRequestHandler):
+        def send_json(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self.send_json(200, {"status": "ok"})
+            else:
+                self.send_json(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path != "/classify":
+                self.send_json(404, {"error": "not found"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length))
+                if "texts" in request:
+                    body = {"results": pipeline.classify_batch(check_texts(request["texts"]))}
+                else:
+                    body = pipeline.classify_record(check_text(request["text"]))
+            except (ValueError, KeyError, TypeError) as e:
+                self.send_json(400, {"error": "bad request: " + repr(e)})
+                return
+            self.send_json(200, body)
+
+        def log_message(self, format, *args):
+            # keep standard error quiet; one line per request adds up
+            pass
+    return Handler
+
+def serve_http(pipeline, port=8575):
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(pipeline))
+    print("Listening on http://127.0.0.1:%d" % port, file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+def main():
+    pipeline = load_pipeline(sys.argv[1], "no-metamap" not in sys.argv, "prefilter" in sys.argv)
+    if "http" in sys.argv:
+        i = sys.argv.index("http")
+        port = int(sys.argv[i + 1]) if i + 1 < len(sys.argv) and sys.argv[i + 1].isdigit() else 8575
+        serve_http(pipeline, port)
+    else:
+        serve_stdin(pipeline)
+
+if __name__ == "__main__":
+    main()
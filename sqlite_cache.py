@@ -0,0 +1,166 @@
+"""
+Least-recently-used key/value cache in an SQLite file
+
+The base of the persistent caches (umls_cache.py, prediction_cache.py). A
+subclass names its table, turns its values into something SQLite can store
+(dumps/loads), and builds its own keys. Lookups record when each entry was last
+used, in memory, and write the times back a thousand at a time. Once the cache
+grows past its maximum number of entries, the least recently used are evicted.
+
+The number of entries is kept in memory, so storing values costs no more than
+the insert; the table is only counted when the cache is opened and when the
+kept count says it's over the limit.
+"""
+import atexit
+import sqlite3
+import threading
+import time
+
+# Keys looked up per query by lookup
+QUERY_SIZE = 500
+
+
+class SQLiteCache:
+    # name of the table the entries are kept in, and the name and SQL type of its value column
+    table = None
+    value_column = "value"
+    value_type = "BLOB"
+
+    def __init__(self, path, max_entries):
+        """
+        Opens (or creates) a cache file
+
+        :param path: location of the SQLite cache file
+        :param max_entries: number of entries kept before the least recently used are evicted
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.touched = {} # key -> last use time, not yet written to disk
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, timeout=60)
+        self.db.execute("CREATE TABLE IF NOT EXISTS %s (key TEXT PRIMARY KEY, %s %s, used REAL)"
+                        % (self.table, self.value_column, self.value_type))
+        self.db.execute("CREATE INDEX IF NOT EXISTS %s_used ON %s (used)" % (self.table, self.table))
+        self.db.commit()
+        self.count = self._count()
+
+    def dumps(self, value):
+        """
+        :param value: value to store
+        :return: the value as stored in the table
+        """
+        raise NotImplementedError
+
+    def loads(self, stored):
+        """
+        :param stored: a value as stored in the table
+        :return: the value
+        """
+        raise NotImplementedError
+
+    def lookup(self, keys):
+        """
+        :param keys: list of keys
+        :return: the value stored under each key, or None where nothing is
+        """
+        found = {}
+        with self.lock:
+            for i in range(0, len(keys), QUERY_SIZE):
+                query = keys[i:i + QUERY_SIZE]
+                rows = self.db.execute("SELECT key, %s FROM %s WHERE key IN (%s)"
+                                       % (self.value_column, self.table, ",".join("?" * len(query))), query)
+                found.update(rows.fetchall())
+            now = time.time()
+            for key in found:
+                self.touched[key] = now
+            self.hits += sum(1 for key in keys if key in found)
+            self.misses += sum(1 for key in keys if key not in found)
+            if len(self.touched) >= 1000:
+                self._flush()
+        return [self.loads(found[key]) if key in found else None for key in keys]
+
+    def store(self, keys, values):
+        """
+        Stores each value under its key, in one transaction
+
+        :param keys: list of keys
+        :param values: value for each key
+        """
+        now = time.time()
+        rows = [(key, self.dumps(value), now) for key, value in zip(keys, values)]
+        with self.lock:
+            added = self.db.executemany("INSERT OR IGNORE INTO %s VALUES (?, ?, ?)" % self.table, rows).rowcount
+            if added < len(rows):
+                # some keys were already there; store their new values too
+                self.db.executemany("UPDATE %s SET %s = ?, used = ? WHERE key = ?" % (self.table, self.value_column),
+                                    [(value, used, key) for key, value, used in rows])
+            self.count += added
+            if self.count > self.max_entries:
+                self._evict()
+            self.db.commit()
+
+    def _count(self):
+        return self.db.execute("SELECT COUNT(*) FROM %s" % self.table).fetchone()[0]
+
+    def _flush(self):
+        self.db.executemany("UPDATE %s SET used = ? WHERE key = ?" % self.table,
+                            [(used, key) for key, used in self.touched.items()])
+        self.db.commit()
+        self.touched = {}
+
+    def _evict(self):
+        # other processes may have added or evicted entries too, so count them again
+        self.count = self._count()
+        if self.count > self.max_entries:
+            self._flush()
+            self.db.execute("DELETE FROM %s WHERE key IN (SELECT key FROM %s ORDER BY used LIMIT ?)"
+                            % (self.table, self.table), (self.count - self.max_entries,))
+            self.count = self.max_entries
+
+    def __len__(self):
+        with self.lock:
+            return self._count()
+
+    def stats(self):
+        """
+        :return: dictionary of hit/miss counts, hit rate and number of stored entries
+        """
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self)}
+
+    def close(self):
+        with self.lock:
+            self._flush()
+            self.db.close()
+
+
+class Shared:
+    """
+    The process-wide cache of one kind, opened on first use and closed at exit
+    """
+
+    def __init__(self, open_cache):
+        """
+        :param open_cache: function that opens the cache, or returns None if it's turned off
+        """
+        self.open_cache = open_cache
+        self.cache = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        with self.lock:
+            if self.cache is None:
+                self.cache = self.open_cache()
+                if self.cache is not None:
+                    atexit.register(self.close)
+            return self.cache
+
+    def close(self):
+        with self.lock:
+            if self.cache is not None:
+                self.cache.close()
+                self.cache = None
@@ -0,0 +1,145 @@
+import os
+import sys
+import json
+from random import Random
+
+'''
+Writes synthetic pathology report corpora in the same layout as the real data,
+so the pipeline can be run and timed without the clinical records:
+
+    out_dir/data/notes_synth_<n>_train.txt          records, split over files
+    out_dir/data/notes_synth_<n>_test.txt
+    out_dir/Annotations/annotations_synth_<n>_train.json
+    out_dir/Annotations/annotations_synth_<n>_test.json
+
+Each record starts with a "**PROTECTED[begin]" line and has a
+RECORD_DOCUMENT_ID (REC<n>) or only a PATIENT_DISPLAY_ID (PAT<n>), with ids
+numbered across the whole corpus. Records are written one at a time, so the
+corpus can be any size.
+
+USAGE: python(3) synthetic_corpus.py out_dir records files seed
+
+records is the number of records in each of the training and test sets.
+files (default 2) is the number of files each set is split over.
+seed (default 0) seeds the random choices; the same arguments always write
+    the same corpus.
+Prints the data directory, to pass to main.py.
+'''
+
+# Statements of a grade, as (line, grade). The whole line is the annotated grade text
+GRADE_STATEMENTS = [
+    ("Histologic grade: 1", 1), ("Histologic grade: 2", 2), ("Histologic grade: 3", 3),
+    ("Histologic Grade: Nottingham score 3+1+1=5, grade 1", 1),
+    ("Histologic Grade: Nottingham score 3+2+2=7, grade 2", 2),
+    ("Histologic Grade: Nottingham score 3+3+2=8, grade 3", 3),
+    ("Nottingham histologic grade: I", 1), ("Nottingham histologic grade: II", 2), ("Nottingham histologic grade: III", 3),
+    ("Bloom-Richardson score: 5/9", 1), ("Bloom-Richardson score: 7/9", 2), ("Bloom-Richardson score: 9/9", 3),
+    ("Overall grade: 1 of 3", 1), ("Overall grade: 2 of 3", 2), ("Overall grade: 3 of 3", 3),
+    ("Nuclear grade: low", 1), ("Nuclear grade: intermediate", 2), ("Nuclear grade: high", 3),
+    ("Invasive ductal carcinoma, well differentiated.", 1),
+    ("Invasive ductal carcinoma, moderately differentiated.", 2),
+    ("Invasive ductal carcinoma, poorly differentiated.", 3),
+    ("Ductal carcinoma in situ, intermediate nuclear grade.", 2),
+]
+# Section headers within a report
+HEADERS = ["CLINICAL HISTORY:", "SPECIMEN:", "GROSS DESCRIPTION:", "MICROSCOPIC DESCRIPTION:",
+           "FINAL DIAGNOSIS:", "COMMENT:", "SYNOPTIC REPORT:"]
+# Filler lines, with {} filled in from the lists below
+FILLER = [
+    "The specimen is received in formalin labeled with the patient's name and {site}.",
+    "It consists of a {size} x {size} x {size} cm portion of fibrofatty tissue.",
+    "Sectioning reveals a firm tan-white mass measuring {size} cm.",
+    "The mass is {size} cm from the nearest ({side}) margin.",
+    "Margins are free of tumor; closest margin is {size} cm.",
+    "Lymph nodes: {count}/{total} positive for metastatic carcinoma.",
+    "Lymphovascular invasion: {presence}.",
+    "Estrogen receptor: {presence}, {count}0% of cells.",
+    "Progesterone receptor: {presence}.",
+    "HER2 by immunohistochemistry: {count}+.",
+    "Representative sections are submitted in cassettes A1-A{count}.",
+    "{site}, needle core biopsy.",
+    "History of {site} mass on screening mammogram.",
+    "Microcalcifications are {presence}.",
+    "Ki-67 proliferation index: {count}{count}%.",
+    "Tumor size: {size} cm.",
+    "Pathologic stage: pT{stage} pN{count}.",
+    "Findings were discussed with Dr. {name} on the day of reporting.",
+    "Electronically signed by {name}, MD.",
+    "Slides reviewed in intradepartmental consultation.",
+    "Grade and stage are given in the synoptic report.",
+    "Histologic grade: not applicable, no residual invasive carcinoma.",
+    "Compared with the prior biopsy, which was {presence} for high grade dysplasia.",
+]
+SITES = ["left breast", "right breast", "left breast, upper outer quadrant", "right breast, lower inner quadrant",
+         "left axillary lymph node", "right axilla"]
+SIDES = ["superior", "inferior", "medial", "lateral", "anterior", "posterior", "deep"]
+PRESENCES = ["present", "not identified", "positive", "negative", "focal"]
+NAMES = ["Adams", "Baker", "Chen", "Diaz", "Evans", "Fischer", "Garcia", "Huang", "Ito", "Jones"]
+
+def filler_line(rng):
+    return rng.choice(FILLER).format(site=rng.choice(SITES), side=rng.choice(SIDES),
+                                     size="%.1f" % rng.uniform(0.1, 9.9), count=rng.randint(0, 9),
+                                     total=rng.randint(9, 19), presence=rng.choice(PRESENCES),
+                                     stage=rng.randint(1, 4), name=rng.choice(NAMES))
+
+def make_record(rng, number):
+    '''
+    Makes one record.
+    Returns (record id, text after the "**PROTECTED[begin]" line, annotations section).
+    '''
+    if rng.random() < 0.8:
+        rid = "REC%d" % number
+        ids = "<RECORD_DOCUMENT_ID>\n%s\n</RECORD_DOCUMENT_ID>\n<PATIENT_DISPLAY_ID>\nPAT%d\n</PATIENT_DISPLAY_ID>\n" % (rid, number)
+    else:
+        rid = "PAT%d" % number
+        ids = "<PATIENT_DISPLAY_ID>\n%s\n</PATIENT_DISPLAY_ID>\n" % rid
+    lines = []
+    for header in rng.sample(HEADERS, rng.randint(3, len(HEADERS))):
+        lines.append(header)
+        lines.extend(filler_line(rng) for _ in range(rng.randint(2, 8)))
+    annotation = {"Laterality": rng.choice(["Left", "Right"]), "Tumor Site": "Breast"}
+    if rng.random() < 0.7:
+        statement, grade = rng.choice(GRADE_STATEMENTS)
+        lines.insert(rng.randint(1, len(lines)), statement)
+        annotation["Grade Category"] = str(grade)
+        annotation["Histologic Grade Text"] = statement
+    text = "\n" + ids + "<REPORT_TEXT>\n" + "\n".join(lines) + "\n</REPORT_TEXT>\n"
+    return rid, text, {"1": annotation}
+
+def write_file(notes_path, annotations_path, rng, numbers):
+    ''' Writes the records with the given id numbers to one notes file and its annotations file. '''
+    with open(notes_path, "w") as notes, open(annotations_path, "w") as annotations:
+        notes.write("Synthetic pathology reports. Not real patient data.\n")
+        annotations.write("{")
+        for i, number in enumerate(numbers):
+            rid, text, annotation = make_record(rng, number)
+            notes.write("**PROTECTED[begin]" + text)
+            annotations.write(("," if i > 0 else "") + "\n" + json.dumps(rid) + ": " + json.dumps({"Annotations": annotation}))
+        annotations.write("\n}\n")
+
+def generate(out_dir, records, files=2, seed=0):
+    '''
+    Writes a corpus of records training and records test records, each set split over files files.
+    Returns the data directory.
+    '''
+    rng = Random(seed)
+    data_dir = os.path.join(out_dir, "data")
+    annotations_dir = os.path.join(out_dir, "Annotations")
+    os.makedirs(data_dir, exist_ok=True)
+    os.makedirs(annotations_dir, exist_ok=True)
+    number = 1
+    for split in ("train", "test"):
+        for f in range(files):
+            count = records // files + (1 if f < records % files else 0)
+            write_file(os.path.join(data_dir, "notes_synth_%d_%s.txt" % (f, split)),
+                       os.path.join(annotations_dir, "annotations_synth_%d_%s.json" % (f, split)),
+                       rng, range(number, number + count))
+            number += count
+    return data_dir
+
+if __name__ == "__main__":
+    out_dir = sys.argv[1]
+    records = int(sys.argv[2])
+    files = int(sys.argv[3]) if len(sys.argv) > 3 else 2
+    seed = int(sys.argv[4]) if len(sys.argv) > 4 else 0
+    print(generate(out_dir, records, files, seed))
@@ -0,0 +1,25 @@
+'''
+Stands in for MetaMap Lite in pipe mode, for tests/test_metamap_pool.py. Reads
+documents ended by a blank line and prints BRAT annotations for "tumor",
+"grade" and "carcinoma", then a blank line. Like MetaMap Lite may, it prints
+nothing at all, not even the blank line, for a document without terms.
+'''
+import re
+import sys
+
+lines = []
+for line in sys.stdin:
+    line = line.rstrip("\n")
+    if line != "":
+        lines.append(line)
+        continue
+    document = " ".join(lines)
+    lines = []
+    matches = list(re.finditer("tumor|grade|carcinoma", document))
+    if len(matches) == 0:
+        continue
+    for n, match in enumerate(matches, 1):
+        sys.stdout.write("T%d\tDisorder %d %d\t%s\n" % (n, match.start(), match.end(), match.group()))
+        sys.stdout.write("N%d\tReference T%d ConceptId:C%07d\t%s\n" % (n, n, n, match.group()))
+    sys.stdout.write("\n")
+    sys.stdout.flush()
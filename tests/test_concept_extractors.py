@@ -0,0 +1,54 @@
+import os
+import shutil
+import tempfile
+import unittest
+import concept_extractors
+import record
+
+TABLE = """# concept id\tterm\tpreferred name
+C0007124\tductal carcinoma in situ\tNoninfiltrating Intraductal Carcinoma
+C1134719\tinvasive ductal carcinoma\tInvasive Ductal Breast Carcinoma
+C0007097\tcarcinoma\tCarcinoma
+C0024204\tlymph node\tLymph node
+"""
+
+
+class DictionaryExtractorTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.table = os.path.join(self.directory, "concepts.tsv")
+        with open(self.table, "w", encoding="utf-8") as f:
+            f.write(TABLE)
+
+    def test_longest_match(self):
+        text = "Invasive ductal carcinoma, 2 of 14 lymph nodes; carcinoma"
+        terms = concept_extractors.DictionaryExtractor(self.table).tag(text)
+        self.assertEqual([(text[int(t.start):int(t.stop)], t.concepts[0].concept_id) for t in terms],
+                         [("Invasive ductal carcinoma", "C1134719"), ("carcinoma", "C0007097")])
+        self.assertEqual(terms[0].tag, "Invasive")
+        self.assertEqual(terms[0].concepts[0].concept, "Invasive")
+
+    def test_falls_back_to_a_shorter_term(self):
+        # "ductal carcinoma" isn't a term, but "carcinoma" is
+        terms = concept_extractors.DictionaryExtractor(self.table).tag("ductal carcinoma in the lymph node")
+        self.assertEqual([(t.start, t.stop) for t in terms], [("7", "16"), ("24", "34")])
+
+    def test_fingerprint_follows_the_table(self):
+        before = concept_extractors.DictionaryExtractor(self.table).fingerprint()
+        self.assertEqual(before, concept_extractors.DictionaryExtractor(self.table).fingerprint())
+        with open(self.table, "a", encoding="utf-8") as f:
+            f.write("C0006826\ttumor\tMalignant Neoplasms\n")
+        self.assertNotEqual(before, concept_extractors.DictionaryExtractor(self.table).fingerprint())
+
+
+class SplitTermsTest(unittest.TestCase):
+    def test_rebases_offsets_and_drops_spanning_terms(self):
+        terms = [record.Term("T1", "0", "5", "tumor"), record.Term("T2", "8", "13", "grade"),
+                 record.Term("T3", "4", "9", "x")]
+        split = concept_extractors.split_terms(terms, [0, 8], [5, 5])
+        self.assertEqual([[(t.start, t.stop) for t in terms] for terms in split], [[("0", "5")], [("0", "5")]])
+
+
+if __name__ == "__main__":
+    unittest.main()
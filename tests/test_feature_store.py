@@ -0,0 +1,65 @@
+import os
+import shutil
+import tempfile
+import unittest
+from sklearn.feature_extraction.text import CountVectorizer
+import feature_store
+
+
+class FeatureStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_transform_is_saved_and_loaded(self):
+        store = feature_store.FeatureStore(self.directory)
+        vectorizer = CountVectorizer().fit(["grade two", "grade three tumor"])
+        lines = ["grade two", "tumor", "grade three"]
+        first = store.transform(vectorizer, lines)
+        second = store.transform(vectorizer, lines)
+        self.assertEqual(store.stats(), {"hits": 1, "misses": 1})
+        self.assertEqual((first != second).nnz, 0)
+
+    def test_fit_transform_returns_the_saved_vectorizer(self):
+        store = feature_store.FeatureStore(self.directory)
+        lines = ["grade two", "grade three tumor"]
+        fitted, matrix = store.fit_transform(CountVectorizer(), lines)
+        loaded, loaded_matrix = store.fit_transform(CountVectorizer(), lines)
+        self.assertEqual(loaded.vocabulary_, fitted.vocabulary_)
+        self.assertEqual((matrix != loaded_matrix).nnz, 0)
+        self.assertEqual(store.hits, 1)
+
+    def test_documents_key_depends_on_the_split(self):
+        self.assertNotEqual(feature_store.documents_key("v", [["a", "b"]]), feature_store.documents_key("v", [["a"], ["b"]]))
+        self.assertNotEqual(feature_store.documents_key("v", [["a"]]), feature_store.documents_key("v", [["a"]], "fit"))
+
+    def test_least_recently_used_entries_are_removed(self):
+        vectorizer = CountVectorizer().fit(["a line of text"])
+        store = feature_store.FeatureStore(self.directory)
+        store.transform(vectorizer, ["a line"])
+        entry_size = store.entries()[0][1]
+        store.max_bytes = entry_size * 2
+        store.transform(vectorizer, ["of text"])
+        # use the first entry again, so the second is the least recently used
+        first = store.entries()[0][2]
+        os.utime(store.path(first), (0, 0))
+        store.transform(vectorizer, ["a line"])
+        store.transform(vectorizer, ["text"])
+        keys = [key for used, size, key in store.entries()]
+        self.assertEqual(len(keys), 2)
+        self.assertIn(feature_store.documents_key(feature_store.fingerprint(vectorizer), [["a line"]]), keys)
+        self.assertIn(feature_store.documents_key(feature_store.fingerprint(vectorizer), [["text"]]), keys)
+        self.assertLessEqual(sum(size for used, size, key in store.entries()), store.max_bytes)
+
+    def test_a_removed_entry_is_a_miss(self):
+        vectorizer = CountVectorizer().fit(["a line"])
+        store = feature_store.FeatureStore(self.directory)
+        store.transform(vectorizer, ["a line"])
+        store.max_bytes = 0
+        self.assertEqual(store.prune(), 1)
+        store.transform(vectorizer, ["a line"])
+        self.assertEqual(store.stats(), {"hits": 0, "misses": 2})
+
+
+if __name__ == "__main__":
+    unittest.main()
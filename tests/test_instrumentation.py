@@ -0,0 +1,42 @@
+import unittest
+import instrumentation
+
+
+class StageTest(unittest.TestCase):
+    def setUp(self):
+        instrumentation.enable()
+
+    def tearDown(self):
+        instrumentation.disable()
+
+    def test_nested_stage_names(self):
+        with instrumentation.stage("outer"):
+            with instrumentation.stage("inner") as counts:
+                counts.lines = 3
+        stages = instrumentation.report()["stages"]
+        self.assertEqual(list(stages), ["outer/inner", "outer"])
+        self.assertEqual(stages["outer/inner"]["lines"], 3)
+        self.assertIsNone(stages["outer"]["lines"])
+
+    def test_repeated_stage_is_added_up(self):
+        for fold in range(3):
+            with instrumentation.stage("train") as counts:
+                counts.records = 10
+                counts.lines = 100 if fold else None
+        train = instrumentation.report()["stages"]["train"]
+        self.assertEqual(train["calls"], 3)
+        self.assertEqual(train["records"], 30)
+        self.assertEqual(train["lines"], 200)
+        self.assertGreaterEqual(train["wall_seconds"], 0)
+        if train["wall_seconds"] > 0:
+            self.assertAlmostEqual(train["records_per_second"], 30 / train["wall_seconds"])
+
+    def test_off_records_nothing(self):
+        instrumentation.disable()
+        with instrumentation.stage("train") as counts:
+            counts.records = 1
+        self.assertEqual(instrumentation.report()["stages"], {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+import os
+import sys
+import time
+import unittest
+from unittest import mock
+import metamap_pool
+import record
+
+FAKE_METAMAP = [sys.executable, os.path.join(os.path.dirname(__file__), "fake_metamaplite.py")]
+
+
+class DropTermsAfterTest(unittest.TestCase):
+    def test_drops_late_terms_and_their_concepts(self):
+        output = (b"T1\tDisorder 0 5\ttumor\nN1\tReference T1 ConceptId:C1\ttumor\n"
+                  b"T2\tDisorder 8 17\tcarcinoma\nN2\tReference T2 ConceptId:C2\tcarcinoma\n")
+        self.assertEqual(metamap_pool.drop_terms_after(output, 5),
+                         b"T1\tDisorder 0 5\ttumor\nN1\tReference T1 ConceptId:C1\ttumor\n")
+        self.assertEqual(metamap_pool.drop_terms_after(output, 4), b"")
+
+
+class WorkerTest(unittest.TestCase):
+    def setUp(self):
+        patch = mock.patch.object(metamap_pool, "metamap_command", lambda: (FAKE_METAMAP, False))
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.pool = metamap_pool.MetaMapPool(size=1, timeout=30)
+        self.addCleanup(self.pool.close)
+
+    def test_terms_with_their_offsets(self):
+        terms = record.parse_umls_terms(self.pool.tag("a tumor of\ngrade 2"))
+        self.assertEqual([(t.start, t.stop, t.tag) for t in terms], [("2", "7", "tumor"), ("11", "16", "grade")])
+
+    def test_string_without_terms_does_not_wait_for_the_timeout(self):
+        start = time.perf_counter()
+        self.assertEqual(self.pool.tag("no"), b"")
+        self.assertEqual(self.pool.tag("nothing here either"), b"")
+        self.assertLess(time.perf_counter() - start, 10)
+        # the worker is still in step with its input
+        self.assertEqual(len(record.parse_umls_terms(self.pool.tag("tumor"))), 1)
+
+    def test_map_keeps_the_order(self):
+        outputs = self.pool.map(["tumor", "", "none", "grade grade"])
+        self.assertEqual([len(record.parse_umls_terms(output)) for output in outputs], [1, 0, 0, 2])
+
+
+if __name__ == "__main__":
+    unittest.main()
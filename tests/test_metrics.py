@@ -0,0 +1,96 @@
+import unittest
+from random import Random
+import numpy as np
+import metrics
+
+
+def matrix_of(pairs):
+    matrix = metrics.ConfusionMatrix()
+    for assigned, gold in pairs:
+        matrix.add(assigned, gold)
+    return matrix
+
+
+class ConfusionMatrixTest(unittest.TestCase):
+    def setUp(self):
+        # (assigned, gold): 2 true negatives, 1 false negative, 1 false positive,
+        # 3 right grades and 1 wrong one
+        self.pairs = [(0, 0), (0, 0), (0, 2), (1, 0), (1, 1), (2, 2), (3, 3), (3, 2)]
+        self.matrix = matrix_of(self.pairs)
+
+    def test_binary_counts(self):
+        self.assertEqual(self.matrix.binary(), (4, 1, 2, 1))
+        self.assertEqual(self.matrix.seen, 8)
+        self.assertEqual(self.matrix[3][2], 1)
+
+    def test_metrics(self):
+        scores = self.matrix.metrics()
+        self.assertAlmostEqual(scores["binary_accuracy"], 6 / 8)
+        self.assertAlmostEqual(scores["binary_precision"], 4 / 5)
+        self.assertAlmostEqual(scores["binary_recall"], 4 / 5)
+        self.assertAlmostEqual(scores["specific_accuracy"], 5 / 8)
+        self.assertAlmostEqual(scores["specific_accuracy_excluding_negatives"], 3 / 5)
+        self.assertAlmostEqual(scores["specific_accuracy_given_label"], 3 / 5)
+        # a different number of records that should have a grade changes the recall denominators
+        self.assertAlmostEqual(self.matrix.metrics(positives=8)["binary_recall"], 4 / 8)
+
+    def test_undefined_metrics_are_none(self):
+        scores = matrix_of([(0, 0)]).metrics()
+        self.assertIsNone(scores["binary_precision"])
+        self.assertEqual(scores["binary_accuracy"], 1.0)
+
+    def test_add_many_and_merge_match_add(self):
+        other = metrics.ConfusionMatrix()
+        other.add_many([a for a, g in self.pairs[:5]], [g for a, g in self.pairs[:5]])
+        other.merge(matrix_of(self.pairs[5:]))
+        self.assertTrue((other.counts == self.matrix.counts).all())
+        self.assertEqual(other.pairs, self.matrix.pairs)
+
+    def test_merge_needs_the_same_labels(self):
+        with self.assertRaises(ValueError):
+            self.matrix.merge(metrics.ConfusionMatrix(labels=(0, 1)))
+
+    def test_per_label(self):
+        per_label = self.matrix.per_label()
+        self.assertEqual(per_label[2], {"precision": 1.0, "recall": 1 / 3, "f1": 0.5, "support": 3})
+        self.assertEqual(per_label[4], {"precision": None, "recall": None, "f1": None, "support": 0})
+
+
+class BootstrapTest(unittest.TestCase):
+    def setUp(self):
+        rng = Random(1)
+        self.matrix = metrics.ConfusionMatrix()
+        # whether each record should have a grade; some gold-negative records (grade 9) do
+        self.positive = []
+        for _ in range(300):
+            gold = rng.choice([0, 1, 2, 3])
+            self.matrix.add(gold if rng.random() < 0.8 else rng.choice([0, 1, 2, 3]), gold)
+            self.positive.append(gold != 0 or rng.random() < 0.2)
+
+    def test_intervals_hold_the_point_estimates(self):
+        scores = self.matrix.metrics(positives=sum(self.positive))
+        intervals = self.matrix.bootstrap(500, positive=self.positive)
+        for name, (low, high) in intervals.items():
+            self.assertTrue(low <= scores[name] <= high, name)
+
+    def test_same_seed_same_intervals(self):
+        self.assertEqual(self.matrix.bootstrap(200, seed=3), self.matrix.bootstrap(200, seed=3))
+
+    def test_resample_matches_counting_records(self):
+        # one resample, counted the slow way
+        drawn = np.random.default_rng(5).integers(0, self.matrix.seen, size=(1, self.matrix.seen))[0]
+        resampled = metrics.ConfusionMatrix()
+        n = len(self.matrix.labels)
+        for i in drawn:
+            resampled.add(self.matrix.labels[self.matrix.pairs[i] // n], self.matrix.labels[self.matrix.pairs[i] % n])
+        expected = resampled.metrics(positives=sum(self.positive[i] for i in drawn))
+        intervals = self.matrix.bootstrap(1, seed=5, positive=self.positive)
+        for name, (low, high) in intervals.items():
+            self.assertAlmostEqual(low, expected[name], msg=name)
+
+    def test_empty(self):
+        self.assertEqual(metrics.ConfusionMatrix().bootstrap(10)["binary_accuracy"], (None, None))
+
+
+if __name__ == "__main__":
+    unittest.main()
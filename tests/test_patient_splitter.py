@@ -0,0 +1,61 @@
+import os
+import shutil
+import tempfile
+import unittest
+import patient_splitter
+import synthetic_corpus
+
+
+def record_id_number(rid):
+    return int(rid[3:])
+
+
+class LoadRecordsTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.data_dir = synthetic_corpus.generate(self.directory, 30, files=3, seed=1)
+
+    def expected(self, test):
+        '''The records of the data files read whole and split on the record marker'''
+        texts = {}
+        for file_name in patient_splitter.get_file_list(self.data_dir, test):
+            with open(file_name) as f:
+                for text in f.read().split("**PROTECTED[begin]")[1:]:
+                    texts.setdefault(patient_splitter.get_record_id(text), []).append(text)
+        return {rid: "".join(parts) for rid, parts in texts.items()}
+
+    def test_matches_reading_whole_files(self):
+        for test in (False, True):
+            records = patient_splitter.load_records(self.data_dir, test)
+            expected = self.expected(test)
+            self.assertEqual(len(records), 30)
+            self.assertEqual({r.rid: r.text for r in records}, expected)
+            self.assertEqual([r.rid for r in records], sorted(expected, key=record_id_number))
+
+    def test_annotations_are_attached(self):
+        for record in patient_splitter.load_records(self.data_dir):
+            grade_text = record.annotation and list(record.annotation.values())[0].get("Histologic Grade Text")
+            if grade_text:
+                self.assertIn(grade_text, record.text)
+
+    def test_iter_records_matches_load_records(self):
+        self.assertEqual([(r.rid, r.text) for r in patient_splitter.iter_records(self.data_dir, True)],
+                         [(r.rid, r.text) for r in patient_splitter.load_records(self.data_dir, True)])
+
+    def test_duplicate_ids_are_joined_and_crlf_is_decoded(self):
+        file_name = os.path.join(self.data_dir, "notes_synth_9_train.txt")
+        with open(file_name, "wb") as f:
+            f.write(b"**PROTECTED[begin]\r\n<PATIENT_DISPLAY_ID>\r\nPAT900\r\n</PATIENT_DISPLAY_ID>\r\nfirst\r\n"
+                    b"**PROTECTED[begin]\r\n<PATIENT_DISPLAY_ID>\r\nPAT900\r\n</PATIENT_DISPLAY_ID>\r\nsecond\r\n")
+        open(os.path.join(self.data_dir, "notes_synth_8_train.txt"), "w").close()
+        with open(os.path.join(self.directory, "Annotations", "annotations_synth_9_train.json"), "w") as f:
+            f.write("{}")
+        record = patient_splitter.load_records(self.data_dir)[-1]
+        self.assertEqual(record.rid, "PAT900")
+        self.assertEqual(record.text, "\n<PATIENT_DISPLAY_ID>\nPAT900\n</PATIENT_DISPLAY_ID>\nfirst\n"
+                                      "\n<PATIENT_DISPLAY_ID>\nPAT900\n</PATIENT_DISPLAY_ID>\nsecond\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+from random import Random
+import pipeline
+
+
+def bottom_k(lines, size, seed):
+    '''The sample NegativeSampler should pick: the size lines whose lowest priority is lowest'''
+    rng = Random(seed)
+    priorities = {}
+    for line in lines:
+        priority = rng.random()
+        priorities[line] = min(priority, priorities.get(line, priority))
+    return sorted(priorities, key=priorities.get)[:size]
+
+
+class NegativeSamplerTest(unittest.TestCase):
+    def sample(self, lines, size, seed=0):
+        sampler = pipeline.NegativeSampler(size, seed)
+        for line in lines:
+            sampler.add(line)
+        return sampler.sample()
+
+    def test_matches_bottom_k_of_the_lowest_priorities(self):
+        rng = Random(3)
+        for size in (1, 5, 50):
+            lines = ["line %d" % int(rng.paretovariate(1.2)) for _ in range(2000)]
+            self.assertEqual(self.sample(lines, size, seed=size), bottom_k(lines, size, size))
+
+    def test_fewer_distinct_lines_than_size(self):
+        self.assertEqual(sorted(self.sample(["a", "b", "a", "c"], 10)), ["a", "b", "c"])
+        self.assertEqual(self.sample(["a", "b"], 0), [])
+
+    def test_same_seed_same_sample(self):
+        lines = ["line %d" % (i % 97) for i in range(1000)]
+        self.assertEqual(self.sample(lines, 10, seed=7), self.sample(lines, 10, seed=7))
+        self.assertNotEqual(self.sample(lines, 10, seed=7), self.sample(lines, 10, seed=8))
+
+    def test_frequent_lines_are_picked_more_often(self):
+        # "common" is 10 of the 20 occurrences, so with one pick it should win about half the time
+        lines = ["common"] * 10 + ["rare %d" % i for i in range(10)]
+        wins = sum(self.sample(lines, 1, seed)[0] == "common" for seed in range(2000))
+        self.assertTrue(900 < wins < 1100, wins)
+
+    def test_counts_lines_offered(self):
+        sampler = pipeline.NegativeSampler(2, 0)
+        for line in "abcabc":
+            sampler.add(line)
+        self.assertEqual(sampler.seen, 6)
+
+
+class ReportedGradeTest(unittest.TestCase):
+    def test_no_grades_is_zero(self):
+        self.assertEqual(pipeline.reported_grade([]), 0)
+
+    def test_most_common_grade(self):
+        self.assertEqual(pipeline.reported_grade([2, 3, 2]), 2)
+        self.assertEqual(pipeline.reported_grade([1, 3]), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+import rule_based_classifier
+
+
+class PercentileTest(unittest.TestCase):
+    def test_nearest_rank(self):
+        values = list(range(1, 11))
+        self.assertEqual(rule_based_classifier.percentile(values, 50), 5)
+        self.assertEqual(rule_based_classifier.percentile(values, 90), 9)
+        self.assertEqual(rule_based_classifier.percentile(values, 91), 10)
+        self.assertEqual(rule_based_classifier.percentile(values, 100), 10)
+        self.assertEqual(rule_based_classifier.percentile(values, 0), 1)
+
+    def test_whole_ranks_are_exact(self):
+        values = list(range(1, 101))
+        for p in range(1, 101):
+            self.assertEqual(rule_based_classifier.percentile(values, p), p)
+
+    def test_empty(self):
+        self.assertEqual(rule_based_classifier.percentile([], 50), 0.0)
+
+
+class RecordScanTest(unittest.TestCase):
+    def test_finds_keywords_in_any_case(self):
+        scan = rule_based_classifier.RecordScan("HISTOLOGIC GRADE: 2\nModerately differentiated")
+        self.assertTrue(scan.has("histologic"))
+        self.assertTrue(scan.has("grade"))
+        self.assertTrue(scan.has("differentiated"))
+        self.assertFalse(scan.has("nottingham"))
+
+    def test_overlapping_keywords(self):
+        # "undifferentiated" contains "differentiated"
+        self.assertTrue(rule_based_classifier.RecordScan("undifferentiated").has("differentiated"))
+
+
+class ClassifyRecordTest(unittest.TestCase):
+    def test_header_rules(self):
+        self.assertEqual(rule_based_classifier.classify_record("Histologic grade: 3", 2), [3])
+        self.assertEqual(rule_based_classifier.classify_record("Nottingham histologic score: 2", 2), [2])
+        self.assertEqual(rule_based_classifier.classify_record("Overall grade: 7/9 (2)", 2), [2])
+
+    def test_later_trials(self):
+        self.assertEqual(rule_based_classifier.classify_record("intermediate nuclear grade", 2), [2])
+        self.assertEqual(rule_based_classifier.classify_record("moderately differentiated", 2), [2])
+        self.assertEqual(rule_based_classifier.classify_record("moderately differentiated", 0), [0])
+
+    def test_no_grade(self):
+        self.assertEqual(rule_based_classifier.classify_record("no keywords here", 2), [0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+import io
+import json
+import threading
+import unittest
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+import service
+
+
+class FakePipeline:
+    '''Stands in for a fitted pipeline.Pipeline; fails on non-string text the way classify_record does.'''
+    def classify_record(self, text):
+        return {"grade": 2 if "grade 2" in text.split("\n")[0] else 0}
+
+    def classify_batch(self, texts):
+        return [self.classify_record(text) for text in texts]
+
+
+class ServeStdinTest(unittest.TestCase):
+    def serve(self, *requests):
+        stdout = io.StringIO()
+        service.serve_stdin(FakePipeline(), io.StringIO("".join(r + "\n" for r in requests)), stdout)
+        return [json.loads(line) for line in stdout.getvalue().splitlines()]
+
+    def test_grades_each_line_with_its_id(self):
+        self.assertEqual(self.serve('{"id": "A", "text": "grade 2"}', '{"text": "none"}'),
+                         [{"grade": 2, "id": "A"}, {"grade": 0}])
+
+    def test_non_string_text_is_a_bad_request(self):
+        results = self.serve('{"text": null}', '{"text": 5}', '{"text": "grade 2"}')
+        self.assertTrue(results[0]["error"].startswith("bad request"))
+        self.assertTrue(results[1]["error"].startswith("bad request"))
+        # the loop carries on after a bad request
+        self.assertEqual(results[2], {"grade": 2})
+
+    def test_malformed_json_is_a_bad_request(self):
+        self.assertIn("error", self.serve("{not json")[0])
+
+
+class ServeHttpTest(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), service.make_handler(FakePipeline()))
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def post(self, body):
+        request = urllib.request.Request("http://127.0.0.1:%d/classify" % self.server.server_address[1],
+                                         data=json.dumps(body).encode())
+        try:
+            with urllib.request.urlopen(request, timeout=10) as response:
+                return response.status, json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            return e.code, json.loads(e.read())
+
+    def test_classify(self):
+        self.assertEqual(self.post({"text": "grade 2"}), (200, {"grade": 2}))
+        self.assertEqual(self.post({"texts": ["grade 2", "x"]}), (200, {"results": [{"grade": 2}, {"grade": 0}]}))
+
+    def test_non_string_text_is_a_400(self):
+        for body in ({"text": None}, {"text": 5}, {"texts": "grade 2"}, {"texts": ["ok", None]}):
+            status, result = self.post(body)
+            self.assertEqual(status, 400, body)
+            self.assertTrue(result["error"].startswith("bad request"))
+
+
+if __name__ == "__main__":
+    unittest.main()
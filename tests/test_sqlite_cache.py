@@ -0,0 +1,103 @@
+import itertools
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import prediction_cache
+import record
+import sqlite_cache
+import umls_cache
+
+
+class Clock:
+    '''Stands in for the time module, one second later each call, so entries are ordered by use'''
+    def __init__(self):
+        self.ticks = itertools.count(1)
+
+    def time(self):
+        return float(next(self.ticks))
+
+
+class CacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        clock = mock.patch.object(sqlite_cache, "time", Clock())
+        clock.start()
+        self.addCleanup(clock.stop)
+
+    def open(self, max_entries=100):
+        cache = prediction_cache.PredictionCache(os.path.join(self.directory, "cache.sqlite"), max_entries)
+        self.addCleanup(cache.close)
+        return cache
+
+    def test_round_trip(self):
+        cache = self.open()
+        cache.put_many(["a", "b"], [[2], [1, 3]])
+        self.assertEqual(cache.get_many(["a", "x", "b"]), [[2], None, [1, 3]])
+        self.assertEqual(cache.stats()["hits"], 2)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_replacing_keeps_the_count(self):
+        cache = self.open()
+        cache.put_many(["a", "b"], [[1], [1]])
+        cache.put_many(["b", "c"], [[2], [2]])
+        self.assertEqual(cache.count, 3)
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(cache.get_many(["b"]), [[2]])
+
+    def test_evicts_least_recently_used(self):
+        cache = self.open(max_entries=3)
+        cache.put_many(["a", "b", "c"], [[1], [2], [3]])
+        cache.get_many(["a"]) # a is now used more recently than b and c
+        cache.put_many(["d", "e"], [[4], [5]])
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(cache.get_many(["a", "b", "c", "d", "e"]), [[1], None, None, [4], [5]])
+
+    def test_store_does_not_count_the_table(self):
+        cache = self.open()
+        statements = []
+        cache.db.set_trace_callback(statements.append)
+        for i in range(10):
+            cache.put_many(["k%d" % i], [[i]])
+        self.assertFalse([s for s in statements if "COUNT" in s.upper()])
+
+    def test_count_survives_reopening(self):
+        self.open().put_many(["a", "b"], [[1], [2]])
+        self.assertEqual(self.open().count, 2)
+
+    def test_prediction_keys(self):
+        cache = self.open()
+        self.assertNotEqual(cache.rules_key("text"), cache.ml_key("text", "model", False))
+        self.assertNotEqual(cache.ml_key("text", "model", False), cache.ml_key("text", "model", True))
+        self.assertNotEqual(cache.ml_key("text", "model", False), cache.ml_key("text", "other model", False))
+
+    def test_umls_cache(self):
+        cache = umls_cache.UMLSCache(os.path.join(self.directory, "umls.sqlite"), 100)
+        self.addCleanup(cache.close)
+        term = record.Term("T1", "0", "5", "tumor")
+        cache.put("a tumor", [term])
+        cache.put_many(["b", "c"], [[], [term]])
+        self.assertIsNone(cache.get("x"))
+        self.assertEqual(cache.get("b"), [])
+        self.assertEqual([t.tag for t in cache.get("c")], ["tumor"])
+        self.assertEqual(len(cache), 3)
+
+
+class SharedTest(unittest.TestCase):
+    def test_opens_once(self):
+        opened = []
+        shared = sqlite_cache.Shared(lambda: opened.append(1) or mock.Mock())
+        self.assertIs(shared.get(), shared.get())
+        self.assertEqual(len(opened), 1)
+        cache = shared.get()
+        shared.close()
+        cache.close.assert_called_once_with()
+
+    def test_turned_off(self):
+        self.assertIsNone(sqlite_cache.Shared(lambda: None).get())
+
+
+if __name__ == "__main__":
+    unittest.main()
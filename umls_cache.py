@@ -0,0 +1,88 @@
+"""
+Persistent cache of UMLS tagging results
+
+Maps a hash of (MetaMap Lite configuration, input text) to the parsed
+Term/Concept objects MetaMap Lite produced for that text. Entries are kept
+in an SQLite file and evicted least-recently-used first once the cache
+grows past its maximum number of entries (see sqlite_cache.py).
+"""
+import hashlib
+import pickle
+import metamap_pool
+import sqlite_cache
+from config import UMLS_CACHE_FILE, UMLS_CACHE_MAX_ENTRIES
+
+
+def config_fingerprint():
+    """
+    Hashes the MetaMap Lite options (index dir, models dir, special terms file, output format)
+
+    :return: hex digest identifying the current MetaMap Lite configuration
+    """
+    args, _ = metamap_pool.metamap_command()
+    return hashlib.sha256("\n".join(args[1:]).encode()).hexdigest()
+
+
+class UMLSCache(sqlite_cache.SQLiteCache):
+    table = "tags"
+    value_column = "terms"
+
+    def __init__(self, path, max_entries=UMLS_CACHE_MAX_ENTRIES):
+        """
+        Opens (or creates) a cache file
+
+        :param path: location of the SQLite cache file
+        :param max_entries: number of strings kept before the least recently used are evicted
+        """
+        super().__init__(path, max_entries)
+        self.fingerprint = config_fingerprint()
+
+    def dumps(self, value):
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, stored):
+        return pickle.loads(stored)
+
+    def key(self, text):
+        return hashlib.sha256((self.fingerprint + "\0" + text).encode()).hexdigest()
+
+    def get(self, text):
+        """
+        :param text: input string
+        :return: the cached list of Terms for the string, or None if it hasn't been tagged yet
+        """
+        return self.lookup([self.key(text)])[0]
+
+    def put(self, text, terms):
+        """
+        Stores the Terms MetaMap Lite found for a string
+
+        :param text: input string
+        :param terms: list of Terms returned by parse_umls_terms
+        """
+        self.store([self.key(text)], [terms])
+
+    def put_many(self, texts, terms_lists):
+        """
+        Stores the Terms MetaMap Lite found for each of several strings, in one transaction
+
+        :param texts: input strings
+        :param terms_lists: list of Terms returned by parse_umls_terms for each string
+        """
+        self.store([self.key(text) for text in texts], terms_lists)
+
+
+_shared = sqlite_cache.Shared(lambda: UMLSCache(UMLS_CACHE_FILE) if UMLS_CACHE_FILE is not None else None)
+
+
+def get_cache():
+    """
+    Returns the process-wide cache, opening it on first use.
+
+    :return: the UMLSCache, or None if caching is turned off in config.py
+    """
+    return _shared.get()
+
+
+def close_cache():
+    _shared.close()